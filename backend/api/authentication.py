@@ -0,0 +1,99 @@
+from django.contrib.auth import get_user_model
+from django.db import router
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import TokenUser
+
+User = get_user_model()
+
+# Поля пользователя, которые попадают в токены: по ним аутентификация
+# отклоняет неактивных и проверяет права персонала без запроса к базе.
+USER_CLAIMS = ("is_active", "is_staff")
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """Refresh-токен с данными пользователя, копируемыми в access-токены."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim in USER_CLAIMS:
+            token[claim] = getattr(user, claim)
+        return token
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Аутентификация по access-токену JWT без запроса к базе: проверяется
+    подпись, срок действия и признак активности из токена. Пользователь
+    собирается из токена с загруженными id, is_active и is_staff,
+    остальные поля отложены и подгружаются одним запросом при первом
+    обращении. Токены без этих данных проверяются по базе, как в
+    JWTAuthentication.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                "Токен не содержит идентификатора пользователя."
+            )
+        if any(claim not in validated_token for claim in USER_CLAIMS):
+            return super().get_user(validated_token)
+        if not validated_token["is_active"]:
+            raise AuthenticationFailed(
+                "Пользователь неактивен.", code="user_inactive"
+            )
+        id_field = User._meta.get_field(api_settings.USER_ID_FIELD)
+        values = {id_field.attname: user_id}
+        values.update((claim, validated_token[claim]) for claim in USER_CLAIMS)
+        # from_db ожидает значения в порядке полей модели.
+        field_names = [
+            field.attname
+            for field in User._meta.concrete_fields
+            if field.attname in values
+        ]
+        return TokenUser.from_db(
+            router.db_for_read(TokenUser),
+            field_names,
+            [values[name] for name in field_names],
+        )
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Обновление пары токенов. Старый refresh-токен отзывается, новые
+    токены выпускаются с актуальными данными пользователя; неактивные
+    пользователи и токены, выданные до смены пароля, отклоняются.
+    """
+
+    token_class = ClaimsRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        user = User.objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]}
+        ).first()
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(
+                "Пользователь не найден или неактивен.", code="user_inactive"
+            )
+        if api_settings.CHECK_REVOKE_TOKEN and refresh.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(
+                "Пароль пользователя был изменён.", code="password_changed"
+            )
+        refresh.blacklist()
+        new_refresh = self.token_class.for_user(user)
+        return {
+            "access": str(new_refresh.access_token),
+            "refresh": str(new_refresh),
+        }
@@ -0,0 +1,153 @@
+"""
+Замеры основных эндпоинтов API: задержка (p50/p95) и число SQL-запросов.
+Запросы идут через настоящий URLconf тестовым клиентом, поэтому
+в замер попадают middleware, аутентификация, пагинация и рендеринг.
+"""
+
+import math
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from recipes.dataset import generate_dataset
+from recipes.models import Ingredient, Recipe
+
+from .cache import get_recipe_cache
+from .indexes import ingredient_index, recipe_id_index, recipe_ingredient_index
+from .shortlinks import encode_short_code
+
+User = get_user_model()
+
+PAGE_SIZES = (6, 50)
+
+# Имя, шаблон URL, нужна ли авторизация. {limit} — размер страницы,
+# такие эндпоинты замеряются для каждого из PAGE_SIZES.
+ENDPOINTS = (
+    ("recipes-list", "/api/recipes/?limit={limit}", False),
+    ("recipes-list-auth", "/api/recipes/?limit={limit}", True),
+    ("recipes-detail", "/api/recipes/{recipe_id}/", True),
+    ("ingredients-search", "/api/ingredients/?name={prefix}", False),
+    (
+        "subscriptions",
+        "/api/users/subscriptions/?limit={limit}&recipes_limit=3",
+        True,
+    ),
+    ("download-shopping-cart", "/api/recipes/download_shopping_cart/", True),
+    ("short-link", "/s/{short_code}/", False),
+)
+
+# Допустимое число SQL-запросов на запрос к эндпоинту при холодном кеше
+# ответов, включая запрос версий данных для ETag и ключей кеша. Не зависит
+# ни от размера страницы, ни от объёма данных.
+QUERY_BUDGETS = {
+    "recipes-list": 4,
+    "recipes-list-auth": 5,
+    "recipes-detail": 4,
+    "ingredients-search": 0,
+    "subscriptions": 5,
+    "download-shopping-cart": 3,
+    "short-link": 0,
+}
+
+
+def reset_state():
+    """Сбрасывает кеш ответов и индексы в памяти процесса."""
+    get_recipe_cache().clear()
+    for index in (ingredient_index, recipe_ingredient_index, recipe_id_index):
+        index.invalidate()
+
+
+def seed_dataset(recipes, seed=0, ingredients_path=None):
+    """
+    Заполняет базу через generate_dataset: десять рецептов на
+    пользователя, ингредиенты из файла, если их ещё нет. Возвращает
+    читателя, от имени которого идут запросы, — пользователя с
+    непустым списком покупок и наибольшим числом подписок.
+    """
+    if not Ingredient.objects.exists():
+        call_command(
+            "load_ingredients", path=ingredients_path, stdout=StringIO()
+        )
+    generate_dataset(users=max(recipes // 10, 2), recipes=recipes, seed=seed)
+    reset_state()
+    return (
+        User.objects.filter(shopping_cart_recipes__isnull=False)
+        .annotate(follows=Count("follower", distinct=True))
+        .order_by("-follows", "pk")
+        .first()
+    )
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def measure(client, url, repeat, warm=False):
+    """
+    Выполняет GET repeat раз. Число запросов берётся из последнего
+    прогона, когда индексы в памяти уже построены.
+    """
+    timings = []
+    for _ in range(repeat):
+        if not warm:
+            get_recipe_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                size = sum(map(len, response.streaming_content))
+            else:
+                size = len(response.content)
+            timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "status": response.status_code,
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "queries": len(queries),
+        "bytes": size,
+    }
+
+
+def run_benchmarks(reader, repeat=20, page_sizes=PAGE_SIZES, warm=False):
+    """Замеряет все ENDPOINTS и возвращает список результатов."""
+    anonymous = APIClient()
+    authenticated = APIClient()
+    authenticated.force_authenticate(reader)
+    recipe_id = Recipe.objects.order_by("-pub_date", "-id").values_list(
+        "pk", flat=True
+    )[0]
+    params = {
+        "recipe_id": recipe_id,
+        "short_code": encode_short_code(recipe_id),
+        "prefix": Ingredient.objects.values_list("name", flat=True)[0][:2],
+    }
+    results = []
+    for name, template, needs_auth in ENDPOINTS:
+        client = authenticated if needs_auth else anonymous
+        limits = page_sizes if "{limit}" in template else (None,)
+        for limit in limits:
+            url = template.format(limit=limit, **params)
+            result = measure(client, url, repeat, warm=warm)
+            results.append(
+                {
+                    "endpoint": name,
+                    "url": url,
+                    "limit": limit,
+                    "budget": QUERY_BUDGETS[name],
+                    **result,
+                }
+            )
+    return results
+
+
+def over_budget(results):
+    return [
+        result for result in results if result["queries"] > result["budget"]
+    ]
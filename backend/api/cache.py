@@ -0,0 +1,282 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import DataVersion
+
+# Ключи версий в DataVersion. Эпоха повышается после массовых изменений
+# в обход сигналов моделей и входит во все ключи кеша и ETag.
+EPOCH_VERSION_KEY = "epoch"
+CONTENT_VERSION_KEY = "recipes"
+COUNTERS_VERSION_KEY = "counters"
+HITS_KEY = "recipes:hits"
+MISSES_KEY = "recipes:misses"
+
+
+def get_recipe_cache():
+    return caches[settings.RECIPE_CACHE_ALIAS]
+
+
+def user_version_key(user_id):
+    return f"user:{user_id}"
+
+
+def cart_version_key(user_id):
+    return f"cart:{user_id}"
+
+
+def get_versions(*keys):
+    """
+    Текущие версии эпохи и ключей keys одним запросом. Версии хранятся
+    в базе и общие для всех процессов; ключ без записи имеет версию 0.
+    """
+    keys = (EPOCH_VERSION_KEY, *keys)
+    stored = dict(
+        DataVersion.objects.filter(key__in=keys).values_list("key", "version")
+    )
+    return [stored.get(key, 0) for key in keys]
+
+
+def get_request_versions(request, *keys):
+    """get_versions, запомненные на время запроса."""
+    memo = request.__dict__.setdefault("_data_versions", {})
+    if keys not in memo:
+        memo[keys] = get_versions(*keys)
+    return memo[keys]
+
+
+def _bump_version(key):
+    versions = DataVersion.objects.filter(key=key)
+    if versions.update(version=F("version") + 1):
+        return
+    try:
+        with transaction.atomic():
+            DataVersion.objects.create(key=key, version=1)
+    except IntegrityError:
+        # Запись успел создать другой процесс.
+        versions.update(version=F("version") + 1)
+
+
+def bump_epoch_version():
+    """Инвалидирует все ключи кеша и ETag."""
+    _bump_version(EPOCH_VERSION_KEY)
+
+
+def bump_content_version():
+    """Инвалидирует все закешированные ответы по рецептам."""
+    _bump_version(CONTENT_VERSION_KEY)
+
+
+def bump_counters_version():
+    """Версия счётчиков избранного и списков покупок у рецептов."""
+    _bump_version(COUNTERS_VERSION_KEY)
+
+
+def bump_user_version(user_id):
+    """Версия избранного, списка покупок и подписок пользователя."""
+    _bump_version(user_version_key(user_id))
+
+
+def bump_cart_version(user_id):
+    """Инвалидирует закешированные выгрузки списка покупок пользователя."""
+    _bump_version(cart_version_key(user_id))
+
+
+def _incr_counter(key):
+    cache = get_recipe_cache()
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def get_cache_stats():
+    cache = get_recipe_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else 0.0,
+    }
+
+
+def _request_digest(request, kwargs, *parts):
+    query = "&".join(
+        f"{key}={value}"
+        for key, values in sorted(request.query_params.lists())
+        for value in values
+    )
+    return hashlib.md5(
+        "|".join(map(str, (sorted(kwargs.items()), query, *parts))).encode(),
+        usedforsecurity=False,
+    ).hexdigest()
+
+
+def build_cache_key(action, request, kwargs, versions):
+    # В закешированных данных абсолютные URL картинок, поэтому хост и
+    # схема входят в ключ.
+    digest = _request_digest(
+        request, kwargs, request.scheme, request.get_host(), *versions
+    )
+    return f"recipes:{action}:{digest}"
+
+
+def is_not_modified(request, etag):
+    """Совпадает ли etag с одним из If-None-Match запроса."""
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return "*" in etags or etag in etags
+
+
+def build_shopping_list_cache_key(user_id, export_format, date):
+    versions = get_versions(CONTENT_VERSION_KEY, cart_version_key(user_id))
+    return (
+        f"recipes:shopping-list:{user_id}:{':'.join(map(str, versions))}:"
+        f"{export_format}:{date:%Y%m%d}"
+    )
+
+
+def build_shopping_list_etag(cache_key):
+    """
+    ETag выгрузки списка покупок. Ключ кеша уже содержит версии данных,
+    формат и дату, поэтому для проверки If-None-Match тело не нужно.
+    """
+    return quote_etag(
+        hashlib.md5(cache_key.encode(), usedforsecurity=False).hexdigest()
+    )
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Кеширует ответы list/retrieve для анонимных пользователей.
+    Ключ строится из хоста, параметров запроса и версии содержимого,
+    которая повышается при изменении рецептов. При сортировке по
+    счётчикам в ключ входит и версия счётчиков.
+    """
+
+    cached_actions = ("list", "retrieve")
+    counter_fields = ("favorites_count", "in_carts_count")
+
+    def orders_by_counters(self, request):
+        ordering = request.query_params.get("ordering", "")
+        return any(
+            field.strip().lstrip("-") in self.counter_fields
+            for field in ordering.split(",")
+        )
+
+    def get_cache_version_keys(self, request):
+        keys = [CONTENT_VERSION_KEY]
+        if self.orders_by_counters(request):
+            keys.append(COUNTERS_VERSION_KEY)
+        return keys
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def _cached_response(self, handler, request, *args, **kwargs):
+        if (
+            self.action not in self.cached_actions
+            or not request.user.is_anonymous
+        ):
+            return handler(request, *args, **kwargs)
+
+        cache = get_recipe_cache()
+        cache_key = build_cache_key(
+            self.action,
+            request,
+            kwargs,
+            get_request_versions(
+                request, *self.get_cache_version_keys(request)
+            ),
+        )
+        data = cache.get(cache_key)
+        if data is not None:
+            _incr_counter(HITS_KEY)
+            response = Response(data)
+            response["X-Cache"] = "HIT"
+            return response
+
+        _incr_counter(MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(cache_key, response.data)
+        response["X-Cache"] = "MISS"
+        return response
+
+
+class ETagMixin:
+    """
+    ETag ответа по одному запросу версий: он строится из версии
+    содержимого, версии списков пользователя (избранное, покупки,
+    подписки) и параметров запроса. На совпавший If-None-Match
+    представление отвечает 304, не выбирая и не сериализуя данные.
+    """
+
+    def get_etag_version_keys(self, request):
+        keys = [CONTENT_VERSION_KEY]
+        if request.user.is_authenticated:
+            keys.append(user_version_key(request.user.pk))
+        return keys
+
+    def get_etag_parts(self, request):
+        parts = get_request_versions(
+            request, *self.get_etag_version_keys(request)
+        )
+        if request.user.is_authenticated:
+            parts = [request.user.pk, *parts]
+        return parts
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return handler(request, *args, **kwargs)
+        etag = quote_etag(
+            _request_digest(
+                request,
+                kwargs,
+                self.action,
+                request.accepted_renderer.format,
+                *self.get_etag_parts(request),
+            )
+        )
+        if is_not_modified(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (
+            status.HTTP_200_OK,
+            status.HTTP_304_NOT_MODIFIED,
+        ):
+            response["ETag"] = etag
+            patch_vary_headers(response, ["Authorization"])
+        return response
+
+
+class ConditionalGetMixin(ETagMixin):
+    """Условные GET-запросы для list и retrieve."""
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
@@ -0,0 +1,80 @@
+import csv
+import json
+
+from .cache import get_recipe_cache
+
+EXPORT_CACHE_MAX_BYTES = 1024 * 1024
+
+
+class _EchoBuffer:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def render_txt(date, totals, recipes):
+    # Строки разделяются переводом строки без завершающего, как в
+    # прежней выгрузке.
+    yield f"Список покупок Foodgram на {date:%d.%m.%Y}:"
+    yield "\n\nПродукты:"
+    for idx, (name, unit, total) in enumerate(totals, 1):
+        yield f"\n{idx}. {name.capitalize()} ({unit}) — {total}"
+    yield "\n\nРецепты, для которых нужны эти продукты:"
+    for idx, (title, author_username) in enumerate(recipes, 1):
+        yield f"\n{idx}. {title} — @{author_username}"
+
+
+def render_csv(date, totals, recipes):
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(("Продукт", "Единица измерения", "Количество"))
+    for name, unit, total in totals:
+        yield writer.writerow((name, unit, total))
+    # Рецепты идут отдельной таблицей после пустой строки.
+    yield writer.writerow(())
+    yield writer.writerow(("Рецепт", "Автор"))
+    for title, author_username in recipes:
+        yield writer.writerow((title, author_username))
+
+
+def render_json(date, totals, recipes):
+    yield f'{{"date":"{date.isoformat()}","ingredients":['
+    for idx, (name, unit, total) in enumerate(totals):
+        item = {"name": name, "measurement_unit": unit, "amount": total}
+        yield ("," if idx else "") + json.dumps(
+            item, ensure_ascii=False, separators=(",", ":")
+        )
+    yield '],"recipes":['
+    for idx, (title, author_username) in enumerate(recipes):
+        item = {"name": title, "author": author_username}
+        yield ("," if idx else "") + json.dumps(
+            item, ensure_ascii=False, separators=(",", ":")
+        )
+    yield "]}"
+
+
+EXPORT_FORMATS = {
+    "txt": (render_txt, "text/plain; charset=utf-8"),
+    "csv": (render_csv, "text/csv; charset=utf-8"),
+    "json": (render_json, "application/json"),
+}
+
+
+def stream_and_cache(chunks, cache_key):
+    """
+    Отдаёт части ответа в кодировке UTF-8 и, если итог не превышает
+    EXPORT_CACHE_MAX_BYTES, сохраняет его в кеш.
+    """
+    collected = []
+    size = 0
+    for chunk in chunks:
+        encoded = chunk.encode("utf-8")
+        if collected is not None:
+            size += len(encoded)
+            if size > EXPORT_CACHE_MAX_BYTES:
+                collected = None
+            else:
+                collected.append(encoded)
+        yield encoded
+    if collected is not None:
+        get_recipe_cache().set(cache_key, b"".join(collected))
@@ -0,0 +1,143 @@
+from rest_framework.response import Response
+
+from config.storage import image_storage
+from recipes.models import IngredientInRecipe
+
+from .images import variant_urls
+from .metrics import SerializationTimer
+from .serializers import get_followed_author_ids
+
+RECIPE_ROW_FIELDS = (
+    "id",
+    "name",
+    "image",
+    "image_variants",
+    "text",
+    "cooking_time",
+    "pub_date",
+    "author_id",
+    "author__email",
+    "author__username",
+    "author__first_name",
+    "author__last_name",
+    "author__avatar",
+    "author__avatar_variants",
+    "is_favorited",
+    "is_in_shopping_cart",
+)
+
+
+def _file_url(storage, name, request):
+    if not name:
+        return None
+    url = storage.url(name)
+    return request.build_absolute_uri(url) if request else url
+
+
+def build_recipe_list(rows, request):
+    """
+    Собирает список рецептов из строк values() в том же виде, что и
+    RecipeSerializer: тот же порядок ключей и те же значения.
+    Ингредиенты всех рецептов загружаются одним запросом.
+    """
+    ingredients = {row["id"]: [] for row in rows}
+    ingredient_rows = (
+        IngredientInRecipe.objects.filter(recipe_id__in=ingredients)
+        .order_by("pk")
+        .values_list(
+            "recipe_id",
+            "ingredient_id",
+            "ingredient__name",
+            "ingredient__measurement_unit",
+            "amount",
+        )
+    )
+    for recipe_id, ingredient_id, name, unit, amount in ingredient_rows:
+        ingredients[recipe_id].append(
+            {
+                "id": ingredient_id,
+                "name": name,
+                "measurement_unit": unit,
+                "amount": amount,
+            }
+        )
+
+    followed_ids = get_followed_author_ids(request)
+    storage = image_storage()
+    authors = {}
+    recipes = []
+    with SerializationTimer():
+        for row in rows:
+            author_id = row["author_id"]
+            author = authors.get(author_id)
+            if author is None:
+                author = authors[author_id] = {
+                    "id": author_id,
+                    "email": row["author__email"],
+                    "username": row["author__username"],
+                    "first_name": row["author__first_name"],
+                    "last_name": row["author__last_name"],
+                    "is_subscribed": author_id in followed_ids,
+                    "avatar": _file_url(
+                        storage, row["author__avatar"], request
+                    ),
+                    "avatar_variants": variant_urls(
+                        row["author__avatar_variants"], request
+                    ),
+                }
+            recipes.append(
+                {
+                    "id": row["id"],
+                    "author": author,
+                    "is_favorited": row["is_favorited"],
+                    "is_in_shopping_cart": row["is_in_shopping_cart"],
+                    "name": row["name"],
+                    "image": _file_url(storage, row["image"], request),
+                    "image_variants": variant_urls(
+                        row["image_variants"], request
+                    ),
+                    "text": row["text"],
+                    "cooking_time": row["cooking_time"],
+                    "ingredients": ingredients[row["id"]],
+                }
+            )
+    return recipes
+
+
+def ordering_row_fields(queryset):
+    """
+    Поля сортировки, которых нет в RECIPE_ROW_FIELDS (например,
+    favorites_count или search_rank): курсорная пагинация строит курсор
+    по значению первого из них в последней строке страницы.
+    """
+    fields = []
+    for field in queryset.query.order_by:
+        if not isinstance(field, str):
+            continue
+        name = field.lstrip("-")
+        if name != "?" and name not in RECIPE_ROW_FIELDS:
+            fields.append(name)
+    return fields
+
+
+class FastRecipeListMixin:
+    """
+    Быстрый путь для списка рецептов: строки values() вместо моделей и
+    вложенных сериализаторов. Включается атрибутом fast_list у view.
+    """
+
+    fast_list = False
+
+    def list(self, request, *args, **kwargs):
+        if not self.fast_list:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.prefetch_related(None).values(
+            *RECIPE_ROW_FIELDS, *ordering_row_fields(queryset)
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                build_recipe_list(page, request)
+            )
+        return Response(build_recipe_list(list(queryset), request))
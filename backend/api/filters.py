@@ -1,11 +1,18 @@
+import re
+
 import django_filters
 from recipes.models import (
+    SEARCH_CONFIG,
     Recipe,
     Ingredient,
 )
 
 from django.contrib.auth import get_user_model
-from django_filters.rest_framework import FilterSet, CharFilter
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F
+from django_filters.rest_framework import CharFilter, FilterSet, NumberFilter
+from rest_framework import filters
 
 User = get_user_model()
 
@@ -22,10 +29,57 @@ class IngredientFilter(FilterSet):
     """
     Фильтр для ингредиентов.
     Позволяет фильтровать по частичному вхождению в начале названия.
+    Параметр limit ограничивает число подсказок.
     """
 
     name = CharFilter(field_name="name", lookup_expr="istartswith")
+    limit = NumberFilter(method="filter_limit", min_value=0)
 
     class Meta:
         model = Ingredient
-        fields = ("name",)
+        fields = ("name", "limit")
+
+    def filter_limit(self, queryset, name, value):
+        return queryset[: int(value)]
+
+
+class RecipeSearchFilter(filters.SearchFilter):
+    """
+    Полнотекстовый поиск рецептов по названию, описанию и ингредиентам.
+    На PostgreSQL использует сохранённый search_vector и GIN-индекс,
+    каждое слово запроса ищется как префикс. На других СУБД работает
+    обычный поиск по search_fields.
+    """
+
+    def get_search_query(self, request):
+        words = re.findall(r"\w+", " ".join(self.get_search_terms(request)))
+        if not words:
+            return None
+        return SearchQuery(
+            " & ".join(f"{word}:*" for word in words),
+            config=SEARCH_CONFIG,
+            search_type="raw",
+        )
+
+    def filter_queryset(self, request, queryset, view):
+        if connection.vendor != "postgresql":
+            return super().filter_queryset(request, queryset, view)
+        query = self.get_search_query(request)
+        if query is None:
+            return queryset
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F("search_vector"), query)
+        )
+
+
+class RecipeOrderingFilter(filters.OrderingFilter):
+    """Без явного ?ordering= результаты поиска сортируются по релевантности."""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if (
+            "search_rank" in queryset.query.annotations
+            and not request.query_params.get(self.ordering_param)
+        ):
+            return ["-search_rank", *(ordering or [])]
+        return ordering
@@ -0,0 +1,176 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from config.storage import image_storage
+from recipes.models import Recipe
+
+from .cache import bump_content_version
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKER_THREADS,
+            thread_name_prefix="image-variants",
+        )
+    return _executor
+
+
+def variant_name(source_name, label, extension):
+    directory, file_name = os.path.split(source_name)
+    stem = os.path.splitext(file_name)[0]
+    return f"{directory}/variants/{stem}_{label}.{extension}"
+
+
+def _render_variant(image, size, pil_format, options):
+    resized = image.copy()
+    resized.thumbnail(size, Image.Resampling.LANCZOS)
+    if pil_format == "JPEG" and resized.mode != "RGB":
+        resized = resized.convert("RGB")
+    buffer = BytesIO()
+    resized.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def process_image_variants(model, pk, field_name, variants_field, source):
+    """
+    Строит уменьшенные копии изображения в форматах WebP и JPEG и
+    сохраняет их имена в variants_field, если исходное изображение
+    за это время не поменялось.
+    """
+    try:
+        storage = model._meta.get_field(field_name).storage
+        with storage.open(source, "rb") as file:
+            image = ImageOps.exif_transpose(Image.open(file))
+            image.load()
+        variants = {"source": source}
+        for label, size in settings.IMAGE_VARIANT_SIZES.items():
+            variants[label] = {}
+            for extension, (pil_format, options) in VARIANT_FORMATS.items():
+                name = variant_name(source, label, extension)
+                # Имя копии однозначно определяется исходным файлом,
+                # поэтому готовую копию можно переиспользовать.
+                if not default_storage.exists(name):
+                    name = default_storage.save(
+                        name,
+                        ContentFile(
+                            _render_variant(image, size, pil_format, options)
+                        ),
+                    )
+                variants[label][extension] = name
+        updated = model.objects.filter(
+            pk=pk, **{field_name: source}
+        ).update(**{variants_field: variants})
+        if updated:
+            bump_content_version()
+    except Exception:
+        logger.exception(
+            "Не удалось обработать изображение %s для %s #%s",
+            source,
+            model.__name__,
+            pk,
+        )
+
+
+def _process_in_worker(*args):
+    try:
+        process_image_variants(*args)
+    finally:
+        connections.close_all()
+
+
+def schedule_image_variants(instance, field_name, variants_field):
+    """
+    Ставит построение копий изображения в фоновую очередь после
+    коммита транзакции. Ничего не делает, если копии уже построены
+    для текущего файла.
+    """
+    source = getattr(instance, field_name).name or ""
+    variants = getattr(instance, variants_field) or {}
+    if variants.get("source", "") == source:
+        return
+    model = type(instance)
+    if not source:
+        model.objects.filter(pk=instance.pk).update(**{variants_field: {}})
+        return
+
+    def submit():
+        args = (model, instance.pk, field_name, variants_field, source)
+        if settings.IMAGE_PROCESSING_ASYNC:
+            _get_executor().submit(_process_in_worker, *args)
+        else:
+            process_image_variants(*args)
+
+    transaction.on_commit(submit)
+
+
+def variant_urls(variants, request=None):
+    """Преобразует имена файлов копий в URL для ответа API."""
+    urls = {}
+    for label, files in (variants or {}).items():
+        if label == "source":
+            continue
+        urls[label] = {}
+        for extension, name in files.items():
+            url = default_storage.url(name)
+            urls[label][extension] = (
+                request.build_absolute_uri(url) if request else url
+            )
+    return urls
+
+
+IMAGE_FIELDS = (
+    (Recipe, "image"),
+    (User, "avatar"),
+)
+
+
+def count_image_references(name):
+    """Число объектов, ссылающихся на файл картинки."""
+    return sum(
+        model.objects.filter(**{field_name: name}).count()
+        for model, field_name in IMAGE_FIELDS
+    )
+
+
+def delete_image_variants(name):
+    """Удаляет уменьшенные копии картинки."""
+    for label in settings.IMAGE_VARIANT_SIZES:
+        for extension in VARIANT_FORMATS:
+            default_storage.delete(variant_name(name, label, extension))
+
+
+def release_image(name):
+    """
+    Освобождает ссылку на файл картинки: после коммита файл и его копии
+    удаляются, если на них больше не ссылается ни один объект.
+    """
+    if not name:
+        return
+
+    def release():
+        if image_storage().delete_unreferenced(name, count_image_references):
+            delete_image_variants(name)
+
+    transaction.on_commit(release)
@@ -0,0 +1,409 @@
+import abc
+import hashlib
+import heapq
+import json
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import chain
+
+from django.conf import settings
+from django.db import connection, connections
+
+from recipes.models import Ingredient, IngredientInRecipe, Recipe
+
+logger = logging.getLogger(__name__)
+
+
+class InProcessIndex(abc.ABC):
+    """
+    Индекс в памяти процесса. Строится лениво при первом обращении и
+    сбрасывается сигналами об изменении данных. Не реже чем раз в ttl
+    секунд индекс перестраивается в фоновом потоке, чтобы подхватить
+    изменения других процессов; до конца перестройки запросы получают
+    прежние данные. Данные читаются без блокировки, поэтому изменения
+    либо атомарны, либо собирают новый снимок и подменяют ссылку на него.
+    """
+
+    ttl_setting = None
+    default_ttl = 300
+
+    def __init__(self):
+        self._data = None
+        self._built_at = 0.0
+        self._generation = 0
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        return getattr(settings, self.ttl_setting or "", self.default_ttl)
+
+    def get(self):
+        data = self._data
+        if data is None:
+            with self._lock:
+                data = self._data
+                if data is None:
+                    generation = self._generation
+                    data = self.build()
+                    if generation == self._generation:
+                        self._data = data
+                        self._built_at = time.monotonic()
+        elif time.monotonic() - self._built_at > self.ttl:
+            self.rebuild_in_background()
+        return data
+
+    def rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(
+            target=self._rebuild_in_thread,
+            name=f"{type(self).__name__}-rebuild",
+            daemon=True,
+        ).start()
+
+    def rebuild(self):
+        """Строит новый снимок, если индекс не сбросили во время сборки."""
+        generation = self._generation
+        data = self.build()
+        with self._lock:
+            if generation == self._generation:
+                self._data = data
+                self._built_at = time.monotonic()
+
+    def _rebuild_in_thread(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Не удалось перестроить %s", type(self).__name__)
+        finally:
+            self._rebuilding = False
+            connections.close_all()
+
+    def invalidate(self):
+        self._generation += 1
+        self._data = None
+
+    @abc.abstractmethod
+    def build(self):
+        """Строит данные индекса из базы."""
+
+
+def _upper_each_char(value):
+    return "".join(
+        char.upper() if len(char.upper()) == 1 else char for char in value
+    )
+
+
+def _upper_ascii(value):
+    return "".join(char.upper() if char.isascii() else char for char in value)
+
+
+# Ключи сравнения, повторяющие istartswith в СУБД: PostgreSQL сравнивает
+# UPPER(), который переводит в верхний регистр каждый символ отдельно
+# (ß остаётся ß), а LIKE в SQLite не учитывает регистр только у ASCII.
+ISTARTSWITH_KEYS = {
+    "postgresql": _upper_each_char,
+    "sqlite": _upper_ascii,
+}
+
+
+class IngredientPrefixIndex(InProcessIndex):
+    """
+    Отсортированный список ключей названий ингредиентов для
+    автодополнения. Поиск префикса — два bisect. Ключи строятся так же,
+    как istartswith в текущей СУБД, поэтому результат совпадает с
+    IngredientFilter.
+    """
+
+    ttl_setting = "INGREDIENT_INDEX_TTL"
+
+    def is_supported(self):
+        return connection.vendor in ISTARTSWITH_KEYS
+
+    def build(self):
+        key = ISTARTSWITH_KEYS.get(connection.vendor, str)
+        items = [
+            {"id": pk, "name": name, "measurement_unit": unit}
+            for pk, name, unit in Ingredient.objects.values_list(
+                "id", "name", "measurement_unit"
+            )
+        ]
+        entries = sorted(
+            (key(item["name"]), position)
+            for position, item in enumerate(items)
+        )
+        fingerprint = hashlib.md5(usedforsecurity=False)
+        for item in items:
+            fingerprint.update(
+                json.dumps(item, ensure_ascii=False).encode()
+            )
+        return {
+            "key": key,
+            "keys": [name_key for name_key, _ in entries],
+            "positions": [position for _, position in entries],
+            "items": items,
+            "fingerprint": fingerprint.hexdigest(),
+        }
+
+    def fingerprint(self):
+        """Хеш содержимого индекса, одинаковый во всех процессах."""
+        return self.get()["fingerprint"]
+
+    def search(self, prefix="", limit=None):
+        """
+        Возвращает ингредиенты, название которых начинается с prefix
+        без учёта регистра, в порядке сортировки модели.
+        """
+        data = self.get()
+        if prefix:
+            prefix = data["key"](prefix)
+            keys = data["keys"]
+            low = bisect_left(keys, prefix)
+            high = bisect_left(keys, prefix + "\U0010ffff", low)
+            positions = sorted(data["positions"][low:high])
+        else:
+            positions = range(len(data["items"]))
+        if limit is not None:
+            positions = positions[: int(limit)]
+        items = data["items"]
+        return [items[position] for position in positions]
+
+
+class PagedMap:
+    """
+    Неизменяемое отображение целых id на значения, разбитое на страницы
+    по 2 ** page_bits id. with_changes копирует только затронутые
+    страницы и список страниц, а не всё отображение.
+    """
+
+    page_bits = 10
+
+    def __init__(self, pages=()):
+        self._pages = tuple(pages)
+
+    @classmethod
+    def from_items(cls, items):
+        return cls().with_changes(items)
+
+    def get(self, key, default=None):
+        index = key >> self.page_bits
+        if index < len(self._pages):
+            return self._pages[index].get(key, default)
+        return default
+
+    def with_changes(self, changes):
+        """
+        Новое отображение с изменениями из пар (id, значение). Значение
+        None удаляет id.
+        """
+        pages = list(self._pages)
+        copied = set()
+        for key, value in changes:
+            index = key >> self.page_bits
+            if index >= len(pages):
+                pages.extend({} for _ in range(index - len(pages) + 1))
+            if index not in copied:
+                copied.add(index)
+                pages[index] = dict(pages[index])
+            if value is None:
+                pages[index].pop(key, None)
+            else:
+                pages[index][key] = value
+        return type(self)(pages)
+
+
+class RankedMatches:
+    """
+    Результат поиска по ингредиентам, упорядоченный по покрытию.
+    Поддерживает len() и срезы, поэтому отдаётся пагинатору как есть:
+    полная сортировка не нужна, для страницы берутся первые
+    offset + limit элементов через heapq.
+    """
+
+    def __init__(self, matched, recipes):
+        self._matched = matched
+        self._recipes = recipes
+
+    def __len__(self):
+        return len(self._matched)
+
+    def _rank(self, recipe_id):
+        matched = self._matched[recipe_id]
+        total = len(self._recipes.get(recipe_id))
+        return (-matched / total, -matched, total, -recipe_id)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            raise TypeError("Поддерживаются только срезы.")
+        start, stop, _ = item.indices(len(self))
+        return heapq.nsmallest(stop, self._matched, key=self._rank)[start:]
+
+
+class RecipeIngredientIndex(InProcessIndex):
+    """
+    Инвертированный индекс «ингредиент → отсортированный массив id
+    рецептов» и отображение «рецепт → id его ингредиентов», оба в
+    PagedMap. Опубликованный снимок не меняется: refresh_recipes под
+    блокировкой перечитывает рецепты из базы и подменяет снимок новым,
+    в котором скопированы только затронутые массивы и страницы.
+    """
+
+    ttl_setting = "RECIPE_INGREDIENT_INDEX_TTL"
+    chunk_size = 10000
+
+    def build(self):
+        postings = {}
+        recipes = {}
+        rows = (
+            IngredientInRecipe.objects.order_by("ingredient_id", "recipe_id")
+            .values_list("ingredient_id", "recipe_id")
+            .iterator(chunk_size=self.chunk_size)
+        )
+        for ingredient_id, recipe_id in rows:
+            posting = postings.get(ingredient_id)
+            if posting is None:
+                posting = postings[ingredient_id] = array("q")
+            posting.append(recipe_id)
+            recipes.setdefault(recipe_id, []).append(ingredient_id)
+        return {
+            "postings": PagedMap.from_items(postings.items()),
+            "recipes": PagedMap.from_items(
+                (recipe_id, tuple(ingredient_ids))
+                for recipe_id, ingredient_ids in recipes.items()
+            ),
+        }
+
+    def refresh_recipes(self, recipe_ids):
+        """
+        Перечитывает из базы ингредиенты указанных рецептов. Чтение идёт
+        под блокировкой, чтобы из двух одновременных обновлений последним
+        применялось то, что видело более новые данные.
+        """
+        with self._lock:
+            data = self._data
+            if data is None:
+                return
+            current = {recipe_id: [] for recipe_id in recipe_ids}
+            rows = IngredientInRecipe.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values_list("recipe_id", "ingredient_id")
+            for recipe_id, ingredient_id in rows:
+                current[recipe_id].append(ingredient_id)
+
+            postings = data["postings"]
+            changed = {}
+
+            def posting_copy(ingredient_id):
+                if ingredient_id not in changed:
+                    changed[ingredient_id] = array(
+                        "q", postings.get(ingredient_id, ())
+                    )
+                return changed[ingredient_id]
+
+            for recipe_id, ingredient_ids in current.items():
+                for ingredient_id in data["recipes"].get(recipe_id, ()):
+                    posting = posting_copy(ingredient_id)
+                    position = bisect_left(posting, recipe_id)
+                    if (
+                        position < len(posting)
+                        and posting[position] == recipe_id
+                    ):
+                        del posting[position]
+                for ingredient_id in ingredient_ids:
+                    insort(posting_copy(ingredient_id), recipe_id)
+            self._data = {
+                "postings": postings.with_changes(
+                    (ingredient_id, posting or None)
+                    for ingredient_id, posting in changed.items()
+                ),
+                "recipes": data["recipes"].with_changes(
+                    (recipe_id, tuple(ingredient_ids) or None)
+                    for recipe_id, ingredient_ids in current.items()
+                ),
+            }
+            self._generation += 1
+
+    def match(self, have, exclude=(), only=None, skip=()):
+        """
+        Рецепты, в которых есть хотя бы один ингредиент из have и нет ни
+        одного из exclude. only и skip ограничивают выборку множествами
+        id рецептов. Порядок: доля ингредиентов рецепта, которые уже
+        есть, затем число совпадений, затем новые рецепты выше.
+        """
+        data = self.get()
+        postings = data["postings"]
+        matched = Counter(
+            chain.from_iterable(
+                postings.get(ingredient_id, ()) for ingredient_id in set(have)
+            )
+        )
+        for ingredient_id in set(exclude):
+            for recipe_id in postings.get(ingredient_id, ()):
+                matched.pop(recipe_id, None)
+        for recipe_id in skip:
+            matched.pop(recipe_id, None)
+        if only is not None:
+            matched = Counter(
+                {
+                    recipe_id: count
+                    for recipe_id, count in matched.items()
+                    if recipe_id in only
+                }
+            )
+        return RankedMatches(matched, data["recipes"])
+
+
+class RecipeIdIndex(InProcessIndex):
+    """
+    Битовая карта id существующих рецептов: один бит на id, миллион
+    рецептов занимает около 125 КБ. Создание и удаление рецептов
+    применяются на месте, без перестройки.
+    """
+
+    ttl_setting = "RECIPE_ID_INDEX_TTL"
+
+    def build(self):
+        bitmap = bytearray()
+        for pk in Recipe.objects.values_list("pk", flat=True).iterator():
+            self._set_bit(bitmap, pk, True)
+        return bitmap
+
+    @staticmethod
+    def _set_bit(bitmap, pk, value):
+        byte, bit = divmod(pk, 8)
+        if byte >= len(bitmap):
+            if not value:
+                return
+            bitmap.extend(bytes(byte - len(bitmap) + 1))
+        if value:
+            bitmap[byte] |= 1 << bit
+        else:
+            bitmap[byte] &= ~(1 << bit) & 0xFF
+
+    def __contains__(self, pk):
+        bitmap = self.get()
+        byte, bit = divmod(pk, 8)
+        return byte < len(bitmap) and bool(bitmap[byte] & (1 << bit))
+
+    def _update(self, pk, value):
+        with self._lock:
+            if self._data is not None:
+                self._set_bit(self._data, pk, value)
+
+    def add(self, pk):
+        self._update(pk, True)
+
+    def discard(self, pk):
+        self._update(pk, False)
+
+
+ingredient_index = IngredientPrefixIndex()
+recipe_ingredient_index = RecipeIngredientIndex()
+recipe_id_index = RecipeIdIndex()
@@ -0,0 +1 @@
+# Этот файл нужен, чтобы Python считал директорию commands пакетом
@@ -0,0 +1,149 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from api.benchmarks import over_budget, run_benchmarks, seed_dataset
+
+
+def parse_sizes(value):
+    try:
+        sizes = [int(size) for size in value.split(",") if size]
+    except ValueError:
+        sizes = []
+    if not sizes or min(sizes) < 1:
+        raise CommandError(
+            "--sizes: список положительных чисел через запятую."
+        )
+    return sizes
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет задержку и число SQL-запросов основных эндпоинтов "
+        "на сгенерированных данных нескольких размеров. Работает "
+        "в отдельной тестовой базе и пишет результаты в JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=parse_sizes,
+            default=[100, 1000],
+            help="Число рецептов в наборах данных, через запятую.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Число запросов к каждому эндпоинту.",
+        )
+        parser.add_argument(
+            "--warm",
+            action="store_true",
+            help="Не очищать кеш ответов между запросами.",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Зерно генератора данных."
+        )
+        parser.add_argument(
+            "--ingredients",
+            help="Файл ингредиентов, по умолчанию как у load_ingredients.",
+        )
+        parser.add_argument(
+            "--output", help="Файл для результатов в формате JSON."
+        )
+        parser.add_argument(
+            "--strict",
+            action="store_true",
+            help="Завершиться с ошибкой при превышении бюджета запросов.",
+        )
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat должен быть положительным.")
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True
+        )
+        try:
+            runs = []
+            for size in options["sizes"]:
+                call_command("flush", interactive=False, verbosity=0)
+                reader = seed_dataset(
+                    size,
+                    seed=options["seed"],
+                    ingredients_path=options["ingredients"],
+                )
+                results = run_benchmarks(
+                    reader, repeat=options["repeat"], warm=options["warm"]
+                )
+                runs.append({"recipes": size, "results": results})
+                self.write_table(size, results)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "commit": current_commit(),
+            "created": datetime.now(timezone.utc).isoformat(),
+            "database": connection.vendor,
+            "python": platform.python_version(),
+            "repeat": options["repeat"],
+            "warm": options["warm"],
+            "runs": runs,
+        }
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты записаны в {options['output']}")
+
+        exceeded = [
+            f"{result['url']} ({run['recipes']} рецептов): "
+            f"{result['queries']} > {result['budget']}"
+            for run in runs
+            for result in over_budget(run["results"])
+        ]
+        for line in exceeded:
+            self.stdout.write(self.style.WARNING(f"Превышен бюджет: {line}"))
+        if exceeded and options["strict"]:
+            raise CommandError(
+                f"Превышений бюджета запросов: {len(exceeded)}"
+            )
+
+    def write_table(self, size, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Рецептов: {size}"))
+        for result in results:
+            style = (
+                self.style.WARNING
+                if result["queries"] > result["budget"]
+                else self.style.SUCCESS
+            )
+            self.stdout.write(
+                style(
+                    f"{result['url']:<60} {result['status']} "
+                    f"p50={result['p50_ms']:.1f}ms "
+                    f"p95={result['p95_ms']:.1f}ms "
+                    f"queries={result['queries']}/{result['budget']}"
+                )
+            )
@@ -0,0 +1,81 @@
+import posixpath
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.images import (
+    IMAGE_FIELDS,
+    count_image_references,
+    delete_image_variants,
+)
+from config.storage import RELEASED_SUFFIX, image_storage
+
+
+def walk_files(storage, directory):
+    if not storage.exists(directory):
+        return
+    directories, files = storage.listdir(directory)
+    for file_name in files:
+        yield posixpath.join(directory, file_name)
+    for child in directories:
+        yield from walk_files(storage, posixpath.join(directory, child))
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет файлы картинок и их копии, на которые не ссылается "
+        "ни один рецепт или пользователь"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать, сколько файлов будет удалено.",
+        )
+
+    def handle(self, *args, **options):
+        storage = image_storage()
+        referenced = set()
+        for model, field_name in IMAGE_FIELDS:
+            referenced.update(
+                model.objects.exclude(**{field_name: ""})
+                .exclude(**{f"{field_name}__isnull": True})
+                .values_list(field_name, flat=True)
+            )
+        referenced_stems = {
+            posixpath.splitext(posixpath.basename(name))[0]
+            for name in referenced
+        }
+
+        removed_images = 0
+        removed_variants = 0
+        for model, field_name in IMAGE_FIELDS:
+            upload_to = model._meta.get_field(field_name).upload_to
+            directory = upload_to.rstrip("/")
+            for name in walk_files(storage, directory):
+                # Временные файлы идущих загрузок и удалений не трогаем.
+                if name.endswith((".upload", RELEASED_SUFFIX)):
+                    continue
+                if "/variants/" in name:
+                    stem = posixpath.basename(name).rsplit("_", 1)[0]
+                    if stem not in referenced_stems:
+                        removed_variants += 1
+                        if not options["dry_run"]:
+                            default_storage.delete(name)
+                elif name not in referenced:
+                    if options["dry_run"]:
+                        removed_images += 1
+                    elif storage.delete_unreferenced(
+                        name, count_image_references
+                    ):
+                        removed_images += 1
+                        delete_image_variants(name)
+
+        prefix = "[dry-run] " if options["dry_run"] else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefix}Удалено картинок без ссылок: {removed_images}, "
+                f"осиротевших копий: {removed_variants}"
+            )
+        )
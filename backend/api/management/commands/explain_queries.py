@@ -0,0 +1,177 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from api.views import RecipeViewSet, UserSubscriptionViewSet
+from recipes.models import Ingredient, IngredientInRecipe
+from recipes.services import shopping_list_recipes, shopping_list_totals
+from users.models import Follow
+
+User = get_user_model()
+
+PAGE_SIZE = 6
+SEQ_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    # SCAN без USING — полный просмотр таблицы; SCAN ... USING INDEX
+    # и SEARCH используют индекс.
+    "sqlite": re.compile(r"\bSCAN (\w+)(?!\w| USING)"),
+}
+
+
+def build_view(view_class, user, params=None, action="list"):
+    request = Request(RequestFactory().get("/", params or {}))
+    request.user = user or AnonymousUser()
+    return view_class(
+        request=request, action=action, format_kwarg=None, args=(), kwargs={}
+    )
+
+
+def explain(queryset, **options):
+    # QuerySet.explain() добавляет EXPLAIN и во вложенный запрос фильтра
+    # по оконной функции (recipes_limit), поэтому префикс ставится к
+    # готовому SQL.
+    sql, params = queryset.query.sql_with_params()
+    prefix = connection.ops.explain_query_prefix(**options)
+    with connection.cursor() as cursor:
+        cursor.execute(f"{prefix} {sql}", params)
+        return "\n".join(
+            " ".join(map(str, row)) for row in cursor.fetchall()
+        )
+
+
+def recipe_list(user, params=None):
+    view = build_view(RecipeViewSet, user, params)
+    return view.filter_queryset(view.get_queryset())[:PAGE_SIZE]
+
+
+class Command(BaseCommand):
+    help = (
+        "Выполняет EXPLAIN для основных запросов API и отмечает полные "
+        "просмотры таблиц. Запускать на базе, заполненной "
+        "generate_dataset: на маленьких таблицах планировщик вправе "
+        "выбрать Seq Scan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            help="email пользователя для запросов с авторизацией.",
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="EXPLAIN ANALYZE (только PostgreSQL).",
+        )
+        parser.add_argument(
+            "--strict",
+            action="store_true",
+            help="Завершиться с ошибкой, если найдены полные просмотры.",
+        )
+
+    def get_user(self, email):
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError(f"Пользователь {email} не найден.")
+        follower_id = (
+            Follow.objects.order_by("user_id")
+            .values_list("user_id", flat=True)
+            .first()
+        )
+        user = User.objects.filter(pk=follower_id).first()
+        user = user or User.objects.order_by("pk").first()
+        if user is None:
+            raise CommandError("В базе нет пользователей.")
+        return user
+
+    def get_queries(self, user):
+        recipe_ids = list(
+            recipe_list(user).values_list("pk", flat=True)[:PAGE_SIZE]
+        )
+        subscriptions = build_view(
+            UserSubscriptionViewSet,
+            user,
+            {"recipes_limit": 3},
+            action="get_user_subscriptions",
+        )
+        author_ids = list(
+            subscriptions.get_subscriptions_queryset(user).values_list(
+                "pk", flat=True
+            )[:PAGE_SIZE]
+        )
+        recipes_prefetch = subscriptions.get_recipes_prefetch().queryset
+        return [
+            ("recipes: list (anonymous)", recipe_list(None)),
+            ("recipes: list", recipe_list(user)),
+            ("recipes: author", recipe_list(None, {"author": user.pk})),
+            ("recipes: is_favorited", recipe_list(user, {"is_favorited": 1})),
+            (
+                "recipes: is_in_shopping_cart",
+                recipe_list(user, {"is_in_shopping_cart": 1}),
+            ),
+            (
+                "recipes: ingredients prefetch",
+                IngredientInRecipe.objects.filter(
+                    recipe_id__in=recipe_ids
+                ).select_related("ingredient"),
+            ),
+            ("shopping list: totals", shopping_list_totals(user)),
+            ("shopping list: recipes", shopping_list_recipes(user)),
+            (
+                "subscriptions: authors",
+                subscriptions.get_subscriptions_queryset(user)[:PAGE_SIZE],
+            ),
+            (
+                "subscriptions: recipes",
+                recipes_prefetch.filter(author_id__in=author_ids),
+            ),
+            (
+                "ingredients: name prefix",
+                Ingredient.objects.filter(name__istartswith="а"),
+            ),
+        ]
+
+    def handle(self, *args, **options):
+        user = self.get_user(options["user"])
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        # В планах встречаются и подзапросы, отмечаются только таблицы.
+        table_names = set(connection.introspection.django_table_names())
+        explain_options = {}
+        if options["analyze"] and connection.vendor == "postgresql":
+            explain_options["analyze"] = True
+
+        flagged = 0
+        for title, queryset in self.get_queries(user):
+            plan = explain(queryset, **explain_options)
+            tables = (
+                sorted(set(pattern.findall(plan)) & table_names)
+                if pattern
+                else []
+            )
+            if tables:
+                flagged += 1
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"{title}: полный просмотр {', '.join(tables)}"
+                    )
+                )
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{title}: OK"))
+            if tables or options["verbosity"] > 1:
+                self.stdout.write(plan)
+
+        if pattern is None:
+            self.stdout.write(
+                f"Поиск полных просмотров для {connection.vendor} "
+                "не поддерживается."
+            )
+        summary = f"Запросов с полным просмотром таблиц: {flagged}"
+        if flagged and options["strict"]:
+            raise CommandError(summary)
+        self.stdout.write(summary)
@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.db.models.fields.json import KeyTextTransform
+
+from api.images import process_image_variants
+from recipes.models import Recipe
+
+User = get_user_model()
+
+TARGETS = (
+    (Recipe, "image", "image_variants"),
+    (User, "avatar", "avatar_variants"),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит уменьшенные копии картинок рецептов и аватаров, "
+        "для которых они отсутствуют или устарели"
+    )
+
+    def handle(self, *args, **options):
+        for model, field_name, variants_field in TARGETS:
+            pending = (
+                model.objects.exclude(**{field_name: ""})
+                .exclude(**{f"{field_name}__isnull": True})
+                .annotate(
+                    variants_source=KeyTextTransform("source", variants_field)
+                )
+                .filter(
+                    Q(variants_source__isnull=True)
+                    | ~Q(variants_source=F(field_name))
+                )
+                .values_list("pk", field_name)
+            )
+            processed = 0
+            for pk, source in pending.iterator():
+                process_image_variants(
+                    model, pk, field_name, variants_field, source
+                )
+                processed += 1
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{model._meta.verbose_name_plural}: "
+                    f"обработано изображений: {processed}"
+                )
+            )
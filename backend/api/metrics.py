@@ -0,0 +1,273 @@
+"""
+Метрики запросов в памяти процесса: задержка, число SQL-запросов и
+время в базе, размер ответа и время сериализации по имени URL и методу.
+Отдаются в текстовом формате Prometheus.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .cache import get_cache_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Прочие методы попадают в метку "other", чтобы произвольные методы
+# из запросов не плодили серии метрик.
+KNOWN_METHODS = frozenset(
+    ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "TRACE")
+)
+
+_current_request = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """Счётчики одного запроса. Он же обёртка execute_wrapper."""
+
+    __slots__ = ("queries", "db_time", "serializer_time", "serializing")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+
+class SerializationTimer:
+    """
+    Добавляет время блока к сериализации текущего запроса. Вложенные
+    блоки (сериализатор автора внутри рецепта) не учитываются дважды.
+    """
+
+    __slots__ = ("metrics", "started")
+
+    def __enter__(self):
+        metrics = _current_request.get()
+        if metrics is None or metrics.serializing:
+            self.metrics = None
+            return
+        metrics.serializing = True
+        self.metrics = metrics
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            self.metrics.serializing = False
+            self.metrics.serializer_time += time.perf_counter() - self.started
+
+
+class TimedSerializerMixin:
+    """Учитывает to_representation сериализатора в метриках запроса."""
+
+    def to_representation(self, instance):
+        with SerializationTimer():
+            return super().to_representation(instance)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class EndpointStats:
+    __slots__ = (
+        "statuses",
+        "latency",
+        "queries",
+        "response_size",
+        "db_time",
+        "serializer_time",
+    )
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, method, status, latency, metrics, size):
+        with self._lock:
+            stats = self._endpoints.get((view, method))
+            if stats is None:
+                stats = self._endpoints[(view, method)] = EndpointStats()
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.latency.observe(latency)
+            stats.queries.observe(metrics.queries)
+            stats.db_time += metrics.db_time
+            stats.serializer_time += metrics.serializer_time
+            if size is not None:
+                stats.response_size.observe(size)
+
+    def snapshot(self):
+        """Копия метрик: словарь на каждую пару (view, method)."""
+        with self._lock:
+            return [
+                {
+                    "view": view,
+                    "method": method,
+                    "statuses": dict(stats.statuses),
+                    "api_request_duration_seconds": (
+                        list(stats.latency.counts),
+                        stats.latency.sum,
+                    ),
+                    "api_db_queries": (
+                        list(stats.queries.counts),
+                        stats.queries.sum,
+                    ),
+                    "api_response_size_bytes": (
+                        list(stats.response_size.counts),
+                        stats.response_size.sum,
+                    ),
+                    "api_db_time_seconds_total": stats.db_time,
+                    "api_serializer_time_seconds_total": (
+                        stats.serializer_time
+                    ),
+                }
+                for (view, method), stats in sorted(self._endpoints.items())
+            ]
+
+
+registry = MetricsRegistry()
+
+
+def _labels(**labels):
+    def escape(value):
+        return (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n")
+        )
+
+    return ",".join(
+        f'{name}="{escape(value)}"' for name, value in labels.items()
+    )
+
+
+def _histogram_lines(name, buckets, counts, total, labels):
+    cumulative = 0
+    for bucket, count in zip((*buckets, "+Inf"), counts):
+        cumulative += count
+        yield f'{name}_bucket{{{labels},le="{bucket}"}} {cumulative}'
+    yield f"{name}_sum{{{labels}}} {total}"
+    yield f"{name}_count{{{labels}}} {cumulative}"
+
+
+def render_metrics():
+    """Метрики процесса в текстовом формате Prometheus."""
+    histograms = (
+        (
+            "api_request_duration_seconds",
+            "Время обработки запроса.",
+            LATENCY_BUCKETS,
+        ),
+        ("api_db_queries", "SQL-запросов на запрос.", QUERY_BUCKETS),
+        ("api_response_size_bytes", "Размер тела ответа.", SIZE_BUCKETS),
+    )
+    counters = (
+        ("api_db_time_seconds_total", "Время выполнения SQL-запросов."),
+        ("api_serializer_time_seconds_total", "Время сериализации."),
+    )
+    snapshot = registry.snapshot()
+    lines = [
+        "# HELP api_requests_total Число запросов.",
+        "# TYPE api_requests_total counter",
+    ]
+    for endpoint in snapshot:
+        for status, count in sorted(endpoint["statuses"].items()):
+            labels = _labels(
+                view=endpoint["view"], method=endpoint["method"], status=status
+            )
+            lines.append(f"api_requests_total{{{labels}}} {count}")
+    for name, help_text, buckets in histograms:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for endpoint in snapshot:
+            counts, total = endpoint[name]
+            labels = _labels(view=endpoint["view"], method=endpoint["method"])
+            lines.extend(
+                _histogram_lines(name, buckets, counts, total, labels)
+            )
+    for name, help_text in counters:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for endpoint in snapshot:
+            labels = _labels(view=endpoint["view"], method=endpoint["method"])
+            lines.append(f"{name}{{{labels}}} {endpoint[name]}")
+    cache_stats = get_cache_stats()
+    for result in ("hits", "misses"):
+        name = f"api_response_cache_{result}_total"
+        lines += [
+            f"# HELP {name} Обращения к кешу ответов для анонимных.",
+            f"# TYPE {name} counter",
+            f"{name} {cache_stats[result]}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Собирает метрики каждого запроса. При METRICS_ENABLED=False
+    исключается из цепочки middleware при запуске. У потоковых ответов
+    (выгрузка списка покупок) учитывается только время до начала
+    отдачи: запросы к базе при чтении streaming_content в метрики не
+    попадают, размер ответа не известен.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current_request.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        latency = time.perf_counter() - started
+        match = request.resolver_match
+        registry.observe(
+            match.view_name if match else "unresolved",
+            request.method if request.method in KNOWN_METHODS else "other",
+            response.status_code,
+            latency,
+            metrics,
+            None if response.streaming else len(response.content),
+        )
+        return response
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-17 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="DataVersion",
+            fields=[
+                (
+                    "key",
+                    models.CharField(
+                        max_length=100,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Ключ",
+                    ),
+                ),
+                (
+                    "version",
+                    models.PositiveBigIntegerField(default=0, verbose_name="Версия"),
+                ),
+            ],
+            options={
+                "verbose_name": "Версия данных",
+                "verbose_name_plural": "Версии данных",
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-17 08:07
+
+import django.contrib.auth.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0001_initial"),
+        ("users", "0006_user_feed_fanout"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TokenUser",
+            fields=[],
+            options={
+                "proxy": True,
+                "indexes": [],
+                "constraints": [],
+            },
+            bases=("users.user",),
+            managers=[
+                ("objects", django.contrib.auth.models.UserManager()),
+            ],
+        ),
+    ]
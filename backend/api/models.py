@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.db import models
+from rest_framework.exceptions import AuthenticationFailed
+
+User = get_user_model()
+
+
+class DataVersion(models.Model):
+    """
+    Версия группы данных для ключей кеша и ETag. Хранится в базе, чтобы
+    изменения из любого процесса и из команд управления были видны всем
+    процессам.
+    """
+
+    key = models.CharField("Ключ", max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField("Версия", default=0)
+
+    class Meta:
+        verbose_name = "Версия данных"
+        verbose_name_plural = "Версии данных"
+
+    def __str__(self):
+        return f"{self.key}: {self.version}"
+
+
+class TokenUser(User):
+    """
+    Пользователь, собранный из access-токена без запроса к базе. При
+    обращении к любому отложенному полю подгружает их все одним запросом;
+    если пользователя уже удалили, запрос отклоняется как
+    неаутентифицированный.
+    """
+
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        deferred_fields = self.get_deferred_fields()
+        if fields is not None and deferred_fields.issuperset(fields):
+            fields = deferred_fields
+        try:
+            super().refresh_from_db(using=using, fields=fields, **kwargs)
+        except User.DoesNotExist:
+            raise AuthenticationFailed(
+                "Пользователь не найден.", code="user_not_found"
+            )
@@ -1,7 +1,89 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size_query_param = "limit"
     page_size = 6
     max_page_size = 100
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация ленты рецептов по (pub_date, id).
+    Не выполняет COUNT(*) и OFFSET, поэтому глубокие страницы
+    отдаются так же быстро, как первая.
+    """
+
+    page_size_query_param = "limit"
+    page_size = 6
+    max_page_size = 100
+    ordering = ("-pub_date", "-id")
+
+
+class FeedCursorPagination(RecipeCursorPagination):
+    """
+    Курсор ленты подписок: позиция (pub_date, id) последнего рецепта
+    страницы. Страницу собирает recipes.services.feed_positions, поэтому
+    пагинатор только разбирает и строит курсоры.
+    """
+
+    invalid_cursor_message = "Неверный курсор."
+
+    def decode_position(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            pub_date, pk = (
+                base64.urlsafe_b64decode(encoded.encode()).decode().split("|")
+            )
+            position = (parse_datetime(pub_date), int(pk))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if position[0] is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_position(self, position):
+        pub_date, pk = position
+        return base64.urlsafe_b64encode(
+            f"{pub_date.isoformat()}|{pk}".encode()
+        ).decode()
+
+    def paginate_positions(self, get_positions, request):
+        """
+        Вызывает get_positions(limit, after) и запоминает, есть ли
+        следующая страница. Возвращает id рецептов страницы.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        positions = get_positions(
+            self.page_size + 1, self.decode_position(request)
+        )
+        self.next_position = (
+            positions[self.page_size - 1]
+            if len(positions) > self.page_size
+            else None
+        )
+        return [pk for _, pk in positions[: self.page_size]]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_position(self.next_position),
+        )
+
+    def get_paginated_response(self, data):
+        return Response(
+            {"next": self.get_next_link(), "previous": None, "results": data}
+        )
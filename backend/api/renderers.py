@@ -0,0 +1,60 @@
+import csv
+import io
+
+from rest_framework import renderers
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class PlainTextRenderer(renderers.BaseRenderer):
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = "\n".join(str(value) for value in data.values())
+        return str(data).encode(self.charset)
+
+
+class CSVRenderer(renderers.BaseRenderer):
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if isinstance(data, dict):
+            writer.writerows(data.items())
+        return buffer.getvalue().encode(self.charset)
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    JSON через orjson, если он установлен. При настройках DRF по
+    умолчанию (компактный вывод, не-ASCII без экранирования) результат
+    побайтно совпадает с JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(
+            data,
+            default=self.encoder_class().default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
+        # JSONRenderer экранирует разделители строк, недопустимые в JS.
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
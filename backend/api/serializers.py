@@ -3,19 +3,29 @@ from djoser.serializers import (
 )
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.files.base import ContentFile
+from django.db import transaction
 import base64
+from collections.abc import Mapping
+import binascii
 import six
+import uuid
 from rest_framework import (
     serializers,
 )
 
+from config.storage import IMAGE_EXTENSIONS
 from recipes.models import (
     Ingredient,
     Recipe,
     IngredientInRecipe,
 )
+from recipes.services import refresh_cart_totals_for_recipe
 from users.models import Follow
+from .images import release_image, variant_urls
+from .metrics import TimedSerializerMixin
 from django.contrib.auth.models import AnonymousUser
 from rest_framework.exceptions import (
     NotAuthenticated,
@@ -24,20 +34,66 @@ from rest_framework.exceptions import (
 User = get_user_model()
 
 
+def get_followed_author_ids(request):
+    """
+    Возвращает множество id авторов, на которых подписан пользователь
+    запроса. Загружается один раз и кешируется на объекте запроса.
+    """
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    followed_ids = getattr(request, "_followed_author_ids", None)
+    if followed_ids is None:
+        followed_ids = frozenset(
+            Follow.objects.filter(user=user).values_list(
+                "author_id", flat=True
+            )
+        )
+        request._followed_author_ids = followed_ids
+    return followed_ids
+
+
 class Base64ImageField(serializers.ImageField):
+    """
+    Картинка в base64. Размер проверяется до декодирования, файл
+    получает уникальное имя с расширением по формату изображения.
+    """
+
+    default_error_messages = {
+        "too_large": "Размер изображения не должен превышать {max_size} байт.",
+        "unsupported_format": (
+            "Допустимы только изображения JPEG, PNG, GIF и WebP."
+        ),
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, six.string_types):
             if "data:" in data and ";base64," in data:
-                header, data = data.split(";base64,")
+                _, data = data.split(";base64,")
+            max_size = settings.IMAGE_UPLOAD_MAX_BYTES
+            if len(data) * 3 // 4 - data[-2:].count("=") > max_size:
+                self.fail("too_large", max_size=max_size)
             try:
-                decoded_file = base64.b64decode(data)
-            except TypeError:
+                decoded_file = base64.b64decode(data, validate=True)
+            except (TypeError, binascii.Error):
                 self.fail("invalid_image")
-            file_name = (
-                "uploaded_image.png"
-            )
-            data = ContentFile(decoded_file, name=file_name)
-        return super().to_internal_value(data)
+            # Временное имя нужно только проверке расширения в ImageField,
+            # настоящее расширение ставится ниже по формату изображения.
+            data = ContentFile(decoded_file, name="image.png")
+        file = super().to_internal_value(data)
+        image = getattr(file, "image", None)
+        extension = IMAGE_EXTENSIONS.get(getattr(image, "format", None))
+        if extension is None:
+            self.fail("unsupported_format")
+        file.name = f"{uuid.uuid4().hex}.{extension}"
+        return file
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """URL уменьшенных копий картинки: {размер: {формат: url}}."""
+
+    def to_representation(self, value):
+        return variant_urls(value, self.context.get("request"))
 
 
 class CustomUserCreateSerializer(DjoserUserCreateSerializer):
@@ -56,8 +112,9 @@ class CustomUserCreateSerializer(DjoserUserCreateSerializer):
         )
 
 
-class CustomUserSerializer(DjoserUserSerializer):
+class CustomUserSerializer(TimedSerializerMixin, DjoserUserSerializer):
     is_subscribed = serializers.SerializerMethodField()
+    avatar_variants = ImageVariantsField()
 
     class Meta(DjoserUserSerializer.Meta):
         model = User
@@ -69,11 +126,13 @@ class CustomUserSerializer(DjoserUserSerializer):
             "last_name",
             "is_subscribed",
             "avatar",
+            "avatar_variants",
         )
         read_only_fields = (
             "id",
             "is_subscribed",
             "avatar",
+            "avatar_variants",
         )
 
     def to_representation(self, instance):
@@ -94,10 +153,12 @@ class CustomUserSerializer(DjoserUserSerializer):
             or isinstance(obj, AnonymousUser)
         ):
             return False
-        return Follow.objects.filter(user=request.user, author=obj).exists()
+        return obj.pk in get_followed_author_ids(request)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     """
     Сериализатор для модели Ingredient.
     Поля id, name, measurement_unit являются read-only.
@@ -109,20 +170,67 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ("id", "name", "measurement_unit")
 
 
+class IngredientIdField(serializers.PrimaryKeyRelatedField):
+    """
+    id ингредиента в составе рецепта. Ингредиенты всех позиций заранее
+    загружает одним запросом IngredientAmountListSerializer, поле берёт
+    их оттуда; ошибки те же, что у PrimaryKeyRelatedField.
+    """
+
+    def to_pk(self, data):
+        """Первичный ключ из значения или None, если тип не подходит."""
+        if isinstance(data, bool):
+            return None
+        try:
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            return None
+
+    def to_internal_value(self, data):
+        ingredients = getattr(self.parent.parent, "ingredients", None)
+        if ingredients is None:
+            return super().to_internal_value(data)
+        pk = self.to_pk(data)
+        if pk is None:
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        ingredient = ingredients.get(pk)
+        if ingredient is None:
+            self.fail("does_not_exist", pk_value=data)
+        return ingredient
+
+
+class IngredientAmountListSerializer(serializers.ListSerializer):
+    """Проверяет существование всех ингредиентов одним запросом IN."""
+
+    def to_internal_value(self, data):
+        id_field = self.child.fields["id"]
+        pks = set()
+        if isinstance(data, list):
+            for item in data:
+                if isinstance(item, Mapping):
+                    pks.add(id_field.to_pk(item.get("id")))
+        pks.discard(None)
+        self.ingredients = Ingredient.objects.in_bulk(pks)
+        try:
+            return super().to_internal_value(data)
+        finally:
+            del self.ingredients
+
+
 class IngredientAmountWriteSerializer(serializers.Serializer):
     """
     Сериализатор для записи ингредиентов в рецепт (id и количество).
     Используется для write_only поля в RecipeSerializer.
     """
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = IngredientIdField(queryset=Ingredient.objects.all())
     amount = serializers.IntegerField(
         min_value=1,
         error_messages={"min_value": "Количество должно быть не меньше 1."},
     )
 
     class Meta:
-        pass
+        list_serializer_class = IngredientAmountListSerializer
 
 
 class IngredientInRecipeReadSerializer(serializers.ModelSerializer):
@@ -142,7 +250,7 @@ class IngredientInRecipeReadSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit", "amount")
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
     recipe_ingredients = IngredientInRecipeReadSerializer(
         many=True, read_only=True, source="ingredient_amounts"
@@ -152,6 +260,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     image = (
         Base64ImageField()
     )
+    image_variants = ImageVariantsField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
@@ -166,6 +275,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "image_variants",
             "text",
             "cooking_time",
         )
@@ -174,6 +284,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             "author",
             "is_favorited",
             "is_in_shopping_cart",
+            "image_variants",
         )
 
     def validate(self, attrs):
@@ -228,37 +339,100 @@ class RecipeSerializer(serializers.ModelSerializer):
         return representation
 
     def get_is_favorited(self, obj):
+        annotated = getattr(obj, "is_favorited", None)
+        if annotated is not None:
+            return annotated
         request = self.context.get("request")
         if not request or request.user.is_anonymous:
             return False
         return obj.favorited_by.filter(user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        annotated = getattr(obj, "is_in_shopping_cart", None)
+        if annotated is not None:
+            return annotated
         request = self.context.get("request")
         if not request or request.user.is_anonymous:
             return False
         return obj.in_shopping_carts_of.filter(user=request.user).exists()
 
-    def _manage_ingredients(self, recipe, ingredients_data_list):
-        IngredientInRecipe.objects.filter(recipe=recipe).delete()
-        ings_to_create = [
+    def _manage_ingredients(
+        self, recipe, ingredients_data_list, created=False
+    ):
+        """
+        Приводит состав рецепта к переданному: вставляет новые строки,
+        обновляет изменившиеся количества и удаляет лишние. Если состав
+        не изменился, ничего не пишет. Сохранённые строки не
+        переписываются, поэтому состав отдаётся в порядке добавления
+        ингредиентов: перестановка в запросе порядок не меняет. Кеши и
+        поисковый вектор обновляются сигналами сохранения самого рецепта.
+        """
+        submitted = {
+            item["id"].pk: item["amount"] for item in ingredients_data_list
+        }
+        existing = {}
+        if not created:
+            existing = {
+                ingredient_id: (pk, amount)
+                for pk, ingredient_id, amount in (
+                    IngredientInRecipe.objects.filter(
+                        recipe=recipe
+                    ).values_list("pk", "ingredient_id", "amount")
+                )
+            }
+        to_delete = {
+            ingredient_id: pk
+            for ingredient_id, (pk, _) in existing.items()
+            if ingredient_id not in submitted
+        }
+        to_update = [
+            IngredientInRecipe(
+                pk=pk,
+                ingredient_id=ingredient_id,
+                amount=submitted[ingredient_id],
+            )
+            for ingredient_id, (pk, amount) in existing.items()
+            if submitted.get(ingredient_id, amount) != amount
+        ]
+        to_create = [
             IngredientInRecipe(
-                recipe=recipe,
-                ingredient=item_data["id"],
-                amount=item_data["amount"],
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
             )
-            for item_data in ingredients_data_list
+            for ingredient_id, amount in submitted.items()
+            if ingredient_id not in existing
         ]
-        IngredientInRecipe.objects.bulk_create(ings_to_create)
+        if not (to_delete or to_update or to_create):
+            return
+
+        if to_delete:
+            IngredientInRecipe.objects.filter(
+                pk__in=to_delete.values()
+            ).delete()
+        if to_update:
+            IngredientInRecipe.objects.bulk_update(to_update, ["amount"])
+        if to_create:
+            IngredientInRecipe.objects.bulk_create(to_create)
+        if not created:
+            refresh_cart_totals_for_recipe(
+                recipe.pk,
+                [
+                    *to_delete,
+                    *(item.ingredient_id for item in to_update),
+                    *(item.ingredient_id for item in to_create),
+                ],
+            )
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_list = validated_data.pop("ingredients")
         recipe = Recipe.objects.create(**validated_data)
-        self._manage_ingredients(recipe, ingredients_list)
+        self._manage_ingredients(recipe, ingredients_list, created=True)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_list = validated_data.pop("ingredients", None)
+        old_image = instance.image.name
         instance.name = validated_data.get("name", instance.name)
         instance.text = validated_data.get("text", instance.text)
         instance.cooking_time = validated_data.get(
@@ -267,7 +441,11 @@ class RecipeSerializer(serializers.ModelSerializer):
         instance.image = validated_data.get(
             "image", instance.image
         )
-        instance.save()
+        # Счётчики в instance могли устареть, поэтому сохраняются только
+        # поля из запроса.
+        instance.save(update_fields=["name", "text", "cooking_time", "image"])
+        if instance.image.name != old_image:
+            release_image(old_image)
 
         if ingredients_list is not None:
             self._manage_ingredients(instance, ingredients_list)
@@ -288,17 +466,27 @@ class RecipeSerializer(serializers.ModelSerializer):
         return data
 
 
-class RecipeMinifiedSerializer(serializers.ModelSerializer):
+class RecipeMinifiedSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     """
     Урезанный сериализатор для рецепта.
     Используется для ответов при добавлении в избранное/список покупок.
     Поля: id, name, image, cooking_time.
     """
 
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
-        read_only_fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_variants", "cooking_time")
+        read_only_fields = (
+            "id",
+            "name",
+            "image",
+            "image_variants",
+            "cooking_time",
+        )
 
 
 class UserWithRecipesSerializer(
@@ -306,11 +494,12 @@ class UserWithRecipesSerializer(
 ):
     """
     Сериализатор для пользователя с его рецептами (урезанными).
-    Используется для эндпоинта подписок.
+    Используется для эндпоинта подписок. Ограничение recipes_limit
+    применяется при prefetch во view.
     """
 
     recipes = RecipeMinifiedSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta(
         CustomUserSerializer.Meta
@@ -324,25 +513,6 @@ class UserWithRecipesSerializer(
             "recipes_count",
         )
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        recipes_limit_str = self.context.get("request").query_params.get(
-            "recipes_limit"
-        )
-        if recipes_limit_str:
-            try:
-                recipes_limit = int(recipes_limit_str)
-                limited_recipes_qs = instance.recipes.all()[:recipes_limit]
-                representation["recipes"] = RecipeMinifiedSerializer(
-                    limited_recipes_qs, many=True
-                ).data
-            except ValueError:
-                pass
-        return representation
-
 
 class SetAvatarSerializer(serializers.Serializer):
     avatar = Base64ImageField(required=True)
@@ -353,9 +523,10 @@ class SetAvatarSerializer(serializers.Serializer):
 
 class SetAvatarResponseSerializer(serializers.Serializer):
     avatar = serializers.URLField(read_only=True)
+    avatar_variants = ImageVariantsField()
 
     class Meta:
-        fields = ("avatar",)
+        fields = ("avatar", "avatar_variants")
 
 
 class RecipeGetShortLinkSerializer(serializers.Serializer):
@@ -0,0 +1,48 @@
+import string
+
+# Буквы идут первыми, чтобы коды большинства рецептов начинались с буквы
+# и не путались со старыми ссылками вида /s/<pk>/.
+ALPHABET = string.ascii_lowercase + string.ascii_uppercase + string.digits
+BASE = len(ALPHABET)
+ALPHABET_INDEX = {char: index for index, char in enumerate(ALPHABET)}
+LEGACY_PREFIX = ALPHABET[0]
+MAX_PK = 2**63 - 1
+
+
+def encode_short_code(pk):
+    """
+    Кодирует id рецепта в base62. Код из одних цифр дополняется ведущим
+    нулевым разрядом «a», так как такие коды зарезервированы за старыми
+    ссылками с id.
+    """
+    if pk < 0:
+        raise ValueError("id рецепта не может быть отрицательным.")
+    digits = []
+    while True:
+        pk, remainder = divmod(pk, BASE)
+        digits.append(ALPHABET[remainder])
+        if not pk:
+            break
+    code = "".join(reversed(digits))
+    if code.isdigit():
+        code = LEGACY_PREFIX + code
+    return code
+
+
+def decode_short_code(code):
+    """
+    Возвращает id рецепта по коду или None, если код некорректен.
+    Код из одних цифр считается старой ссылкой с id рецепта.
+    """
+    if not code or len(code) > 20:
+        return None
+    if code.isascii() and code.isdigit():
+        pk = int(code)
+    else:
+        pk = 0
+        for char in code:
+            index = ALPHABET_INDEX.get(char)
+            if index is None:
+                return None
+            pk = pk * BASE + index
+    return pk if pk <= MAX_PK else None
@@ -0,0 +1,161 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+)
+from recipes.services import data_changed
+from users.models import Follow
+
+from .cache import (
+    bump_cart_version,
+    bump_content_version,
+    bump_counters_version,
+    bump_epoch_version,
+    bump_user_version,
+)
+from .images import release_image, schedule_image_variants
+from .indexes import (
+    ingredient_index,
+    recipe_id_index,
+    recipe_ingredient_index,
+)
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=User)
+def invalidate_recipe_cache(sender, **kwargs):
+    transaction.on_commit(bump_content_version)
+
+
+@receiver(post_save, sender=User)
+def invalidate_cache_on_user_change(sender, update_fields=None, **kwargs):
+    # Данные автора входят в ответы по рецептам. Обновление last_login
+    # при входе на них не влияет.
+    if update_fields is None or set(update_fields) != {"last_login"}:
+        transaction.on_commit(bump_content_version)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_user_lists(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_user_version(user_id))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def invalidate_counters(sender, **kwargs):
+    # Счётчики не выводятся в ответах, но от них зависит сортировка
+    # ?ordering=-favorites_count.
+    transaction.on_commit(bump_counters_version)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def refresh_recipe_ingredient_index(sender, instance, **kwargs):
+    # После удаления pk у объекта обнуляется, поэтому запоминаем его сразу.
+    recipe_id = instance.pk
+    transaction.on_commit(
+        lambda: recipe_ingredient_index.refresh_recipes([recipe_id])
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def add_to_recipe_id_index(sender, instance, created, **kwargs):
+    if created:
+        recipe_id = instance.pk
+        transaction.on_commit(lambda: recipe_id_index.add(recipe_id))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_recipe_id_index(sender, instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: recipe_id_index.discard(recipe_id))
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def refresh_recipe_ingredient_index_on_amount(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: recipe_ingredient_index.refresh_recipes([instance.recipe_id])
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def invalidate_shopping_list_cache(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_cart_version(instance.user_id))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+# Поля, от которых зависят только ответы по рецептам: их пересчёт
+# повышает версию содержимого, а не эпоху.
+CONTENT_ONLY_FIELDS = {"search_vector"}
+
+# Индексы в памяти, которые строятся по строкам модели.
+BULK_INVALIDATED_INDEXES = {
+    Ingredient: (ingredient_index,),
+    Recipe: (recipe_id_index, recipe_ingredient_index),
+    IngredientInRecipe: (recipe_ingredient_index,),
+}
+
+
+@receiver(data_changed)
+def invalidate_on_bulk_change(sender, fields=None, **kwargs):
+    # Массовые изменения не говорят, какие строки затронуты, поэтому
+    # сбрасываются все ключи кеша и ETag, а при вставке или удалении
+    # строк — и индексы по этой модели. Пересчёт поисковых векторов
+    # идёт после каждого сохранения рецепта и меняет только поиск.
+    if fields is not None and CONTENT_ONLY_FIELDS.issuperset(fields):
+        bump_content_version()
+        return
+    bump_epoch_version()
+    if fields is None:
+        for index in BULK_INVALIDATED_INDEXES.get(sender, ()):
+            index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(sender, instance, **kwargs):
+    schedule_image_variants(instance, "image", "image_variants")
+
+
+@receiver(post_save, sender=User)
+def process_user_avatar(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or "avatar" in update_fields:
+        schedule_image_variants(instance, "avatar", "avatar_variants")
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(sender, instance, **kwargs):
+    release_image(instance.image.name)
+
+
+@receiver(post_delete, sender=User)
+def release_user_avatar(sender, instance, **kwargs):
+    release_image(instance.avatar.name)
@@ -0,0 +1,1647 @@
+import base64
+import json
+import os
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock, skipIf, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.contrib.postgres.search import SearchQuery
+from django.db import connection
+from django.db.models import Value
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from config.storage import image_storage
+from recipes.models import (
+    SEARCH_CONFIG,
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+    ShoppingCartTotal,
+    TimelineEntry,
+)
+from recipes.services import (
+    backfill_timelines,
+    notify_data_changed,
+    recount_counters,
+    update_search_vectors,
+)
+from users.models import Follow
+
+from .authentication import ClaimsRefreshToken, StatelessJWTAuthentication
+from .benchmarks import run_benchmarks, seed_dataset
+from .cache import (
+    CONTENT_VERSION_KEY,
+    EPOCH_VERSION_KEY,
+    get_recipe_cache,
+)
+from .filters import (
+    IngredientFilter,
+    RecipeOrderingFilter,
+    RecipeSearchFilter,
+)
+from .indexes import (
+    ingredient_index,
+    recipe_id_index,
+    recipe_ingredient_index,
+)
+from .metrics import MetricsRegistry, RequestMetrics, render_metrics
+from .models import DataVersion
+from .renderers import FastJSONRenderer
+from .serializers import (
+    Base64ImageField,
+    IngredientSerializer,
+    RecipeSerializer,
+)
+from .shortlinks import decode_short_code, encode_short_code
+from .views import RecipeViewSet
+
+User = get_user_model()
+
+
+def create_user(username, **extra):
+    return User.objects.create_user(
+        email=f"{username}@example.com",
+        username=username,
+        first_name=extra.pop("first_name", "Имя"),
+        last_name=extra.pop("last_name", "Фамилия"),
+        password="password-123",
+        **extra,
+    )
+
+
+def create_recipe(author, name="Рецепт", **extra):
+    image = extra.pop("image", "recipes/images/aa/recipe.png")
+    return Recipe.objects.create(
+        author=author,
+        name=name,
+        image=image,
+        # Копии картинки считаются готовыми, чтобы сохранение рецепта
+        # в тестах не запускало их построение.
+        image_variants=extra.pop("image_variants", {"source": image}),
+        text=extra.pop("text", "Описание"),
+        cooking_time=extra.pop("cooking_time", 10),
+        **extra,
+    )
+
+
+class FastRecipeListTests(APITestCase):
+    """Быстрый путь списка рецептов совпадает с сериализаторами побайтно."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user("reader", first_name="Читатель")
+        cls.authors = [
+            create_user(
+                f"author{index}", first_name="Автор", last_name=f"№{index}"
+            )
+            for index in range(3)
+        ]
+        User.objects.filter(pk=cls.authors[0].pk).update(
+            avatar="users/avatars/aa/avatar.jpg",
+            avatar_variants={
+                "source": "users/avatars/aa/avatar.jpg",
+                "thumb": {"webp": "users/avatars/aa/variants/avatar.webp"},
+            },
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=f"ингредиент {index}", measurement_unit="г")
+                for index in range(6)
+            ]
+        )
+        for index in range(8):
+            recipe = create_recipe(
+                cls.authors[index % 3],
+                f"Рецепт «{index}»",
+                image=f"recipes/images/bb/recipe{index}.png",
+                text="Строка\u2028с разделителем и \"кавычками\"",
+                cooking_time=index + 1,
+            )
+            IngredientInRecipe.objects.bulk_create(
+                [
+                    IngredientInRecipe(
+                        recipe=recipe,
+                        ingredient=ingredients[(index + offset) % 6],
+                        amount=offset + 1,
+                    )
+                    for offset in range(index % 4)
+                ]
+            )
+        recipes = list(Recipe.objects.order_by("pk"))
+        Recipe.objects.filter(pk=recipes[0].pk).update(
+            image_variants={
+                "source": recipes[0].image.name,
+                "card": {
+                    "webp": "recipes/images/bb/variants/recipe0_card.webp",
+                    "jpeg": "recipes/images/bb/variants/recipe0_card.jpeg",
+                },
+            }
+        )
+        Favorite.objects.create(user=cls.reader, recipe=recipes[1])
+        ShoppingCart.objects.create(user=cls.reader, recipe=recipes[2])
+        Follow.objects.create(user=cls.reader, author=cls.authors[1])
+
+    def get_both(self, url):
+        get_recipe_cache().clear()
+        fast = self.client.get(url)
+        get_recipe_cache().clear()
+        with mock.patch.object(
+            RecipeViewSet, "fast_list", False
+        ), mock.patch.object(
+            RecipeViewSet, "renderer_classes", [JSONRenderer]
+        ):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(slow.status_code, 200)
+        return fast.content, slow.content
+
+    def assert_same_bytes(self, url):
+        fast, slow = self.get_both(url)
+        self.assertEqual(fast, slow, url)
+
+    def test_anonymous_list(self):
+        for url in (
+            "/api/recipes/",
+            "/api/recipes/?page=2",
+            "/api/recipes/?limit=3&ordering=name",
+            f"/api/recipes/?author={self.authors[0].pk}",
+            "/api/recipes/?search=3",
+        ):
+            self.assert_same_bytes(url)
+
+    def test_authenticated_list(self):
+        self.client.force_authenticate(self.reader)
+        for url in (
+            "/api/recipes/?limit=10",
+            "/api/recipes/?is_favorited=1",
+            "/api/recipes/?is_in_shopping_cart=1",
+            "/api/recipes/?is_favorited=0&ordering=-cooking_time",
+        ):
+            self.assert_same_bytes(url)
+
+    def test_cursor_pagination(self):
+        self.client.force_authenticate(self.reader)
+        fast, slow = self.get_both("/api/recipes/?cursor=&limit=3")
+        self.assertEqual(fast, slow)
+        next_url = self.client.get("/api/recipes/?cursor=&limit=3").json()[
+            "next"
+        ]
+        self.assert_same_bytes(next_url)
+
+    def test_fast_renderer_matches_json_renderer(self):
+        data = {
+            "text": "юникод\u2028и\u2029разделители",
+            "nested": [{"id": 1, "flag": True, "empty": None}],
+        }
+        self.assertEqual(
+            FastJSONRenderer().render(data), JSONRenderer().render(data)
+        )
+
+
+class QueryBudgetTests(APITestCase):
+    """Число SQL-запросов эндпоинтов укладывается в QUERY_BUDGETS."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=f"продукт {index}", measurement_unit="г")
+                for index in range(20)
+            ]
+        )
+        with mock.patch(
+            "recipes.dataset.placeholder_image",
+            return_value="recipes/images/placeholder.png",
+        ):
+            cls.reader = seed_dataset(60)
+
+    def test_query_budgets(self):
+        for result in run_benchmarks(self.reader, repeat=2):
+            with self.subTest(url=result["url"]):
+                self.assertIn(result["status"], (200, 302))
+                self.assertLessEqual(result["queries"], result["budget"])
+
+    def test_queries_do_not_grow_with_page_size(self):
+        results = run_benchmarks(self.reader, repeat=1)
+        queries = {}
+        for result in results:
+            if result["limit"] is not None:
+                queries.setdefault(result["endpoint"], set()).add(
+                    result["queries"]
+                )
+        self.assertEqual(
+            {endpoint: len(counts) for endpoint, counts in queries.items()},
+            {endpoint: 1 for endpoint in queries},
+        )
+
+
+class RecipeIngredientUpdateTests(APITestCase):
+    """Правка рецепта пишет только изменившиеся строки состава."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user("cook")
+        cls.buyer = create_user("buyer")
+        cls.ingredients = Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=f"продукт {index}", measurement_unit="г")
+                for index in range(3)
+            ]
+        )
+        cls.recipe = create_recipe(
+            cls.author, image="recipes/images/cc/recipe.png"
+        )
+        IngredientInRecipe.objects.bulk_create(
+            [
+                IngredientInRecipe(
+                    recipe=cls.recipe, ingredient=ingredient, amount=amount
+                )
+                for ingredient, amount in zip(cls.ingredients[:2], (100, 5))
+            ]
+        )
+        ShoppingCart.objects.create(user=cls.buyer, recipe=cls.recipe)
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+
+    def patch_ingredients(self, amounts):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f"/api/recipes/{self.recipe.pk}/",
+                {
+                    "name": "Рецепт",
+                    "text": "Описание",
+                    "cooking_time": 10,
+                    "ingredients": [
+                        {"id": self.ingredients[index].pk, "amount": amount}
+                        for index, amount in amounts
+                    ],
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        return [
+            query["sql"]
+            for query in queries
+            if "recipes_ingredientinrecipe" in query["sql"]
+            and not query["sql"].startswith("SELECT")
+        ]
+
+    def get_rows(self):
+        return dict(
+            IngredientInRecipe.objects.filter(
+                recipe=self.recipe
+            ).values_list("ingredient_id", "pk")
+        )
+
+    def test_unchanged_ingredients_are_not_written(self):
+        rows = self.get_rows()
+        self.assertEqual(self.patch_ingredients([(1, 5), (0, 100)]), [])
+        self.assertEqual(self.get_rows(), rows)
+
+    def test_only_changes_are_written(self):
+        kept_pk = self.get_rows()[self.ingredients[0].pk]
+        writes = self.patch_ingredients([(0, 150), (2, 7)])
+        self.assertEqual(len(writes), 3, writes)
+        self.assertEqual(self.get_rows()[self.ingredients[0].pk], kept_pk)
+        expected = {
+            self.ingredients[0].pk: 150,
+            self.ingredients[2].pk: 7,
+        }
+        self.assertEqual(
+            dict(
+                IngredientInRecipe.objects.filter(
+                    recipe=self.recipe
+                ).values_list("ingredient_id", "amount")
+            ),
+            expected,
+        )
+        self.assertEqual(
+            dict(
+                ShoppingCartTotal.objects.filter(
+                    user=self.buyer
+                ).values_list("ingredient_id", "total")
+            ),
+            expected,
+        )
+
+    def test_reordering_keeps_stored_order(self):
+        # Строки не переписываются, поэтому состав в ответе остаётся в
+        # порядке добавления ингредиентов, а не в порядке из запроса.
+        self.assertEqual(self.patch_ingredients([(1, 5), (0, 100)]), [])
+        response = self.client.get(f"/api/recipes/{self.recipe.pk}/")
+        self.assertEqual(
+            [item["id"] for item in response.json()["ingredients"]],
+            [self.ingredients[0].pk, self.ingredients[1].pk],
+        )
+
+    def test_ingredients_are_checked_with_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f"/api/recipes/{self.recipe.pk}/",
+                {
+                    "ingredients": [
+                        {"id": self.ingredients[0].pk, "amount": 0},
+                        {"id": self.ingredients[1].pk, "amount": 1},
+                        {"id": 999999, "amount": 1},
+                    ],
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["ingredients"],
+            [
+                {"amount": ["Количество должно быть не меньше 1."]},
+                {},
+                {"id": ['Invalid pk "999999" - object does not exist.']},
+            ],
+        )
+        lookups = [
+            query["sql"]
+            for query in queries
+            if 'FROM "recipes_ingredient"' in query["sql"]
+        ]
+        self.assertEqual(len(lookups), 1, lookups)
+
+
+class RecipeUserFlagsTests(APITestCase):
+    """is_favorited и is_in_shopping_cart считаются в запросе списка."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user("reader")
+        author = create_user("author")
+        cls.recipes = [
+            create_recipe(author, f"Рецепт {index}") for index in range(8)
+        ]
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipes[1])
+        ShoppingCart.objects.create(user=cls.reader, recipe=cls.recipes[2])
+        ShoppingCart.objects.create(user=cls.reader, recipe=cls.recipes[1])
+
+    def get_flags(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return {
+            recipe["id"]: (
+                recipe["is_favorited"],
+                recipe["is_in_shopping_cart"],
+            )
+            for recipe in response.json()["results"]
+        }
+
+    def test_flags_of_reader(self):
+        self.client.force_authenticate(self.reader)
+        flags = self.get_flags("/api/recipes/?limit=10")
+        self.assertEqual(flags.pop(self.recipes[1].pk), (True, True))
+        self.assertEqual(flags.pop(self.recipes[2].pk), (False, True))
+        self.assertEqual(set(flags.values()), {(False, False)})
+
+    def test_anonymous_flags_are_false(self):
+        flags = self.get_flags("/api/recipes/?limit=10")
+        self.assertEqual(set(flags.values()), {(False, False)})
+
+    def test_filters_use_flags(self):
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(
+            set(self.get_flags("/api/recipes/?is_favorited=1")),
+            {self.recipes[1].pk},
+        )
+        self.assertEqual(
+            set(self.get_flags("/api/recipes/?is_in_shopping_cart=true")),
+            {self.recipes[1].pk, self.recipes[2].pk},
+        )
+        self.assertEqual(
+            len(self.get_flags("/api/recipes/?is_favorited=0&limit=10")), 7
+        )
+
+    def test_queries_do_not_depend_on_page_size(self):
+        self.client.force_authenticate(self.reader)
+        counts = []
+        for limit in (2, 8):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(f"/api/recipes/?limit={limit}")
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class IsSubscribedTests(APITestCase):
+    """is_subscribed всех пользователей ответа — один запрос к подпискам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user("reader")
+        cls.authors = [create_user(f"author{index}") for index in range(4)]
+        for author in cls.authors:
+            for index in range(2):
+                create_recipe(author, f"Рецепт {author.username} {index}")
+        for author in cls.authors[:2]:
+            Follow.objects.create(user=cls.reader, author=author)
+
+    def setUp(self):
+        self.client.force_authenticate(self.reader)
+
+    def get_with_follow_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        follow_queries = [
+            query["sql"]
+            for query in queries
+            if 'FROM "users_follow"' in query["sql"]
+        ]
+        return response.json(), follow_queries
+
+    def test_recipe_authors(self):
+        data, follow_queries = self.get_with_follow_queries(
+            "/api/recipes/?limit=10"
+        )
+        subscribed = {
+            recipe["author"]["id"]: recipe["author"]["is_subscribed"]
+            for recipe in data["results"]
+        }
+        self.assertEqual(
+            subscribed,
+            {
+                author.pk: index < 2
+                for index, author in enumerate(self.authors)
+            },
+        )
+        self.assertEqual(len(follow_queries), 1, follow_queries)
+
+    def test_user_list(self):
+        data, follow_queries = self.get_with_follow_queries(
+            "/api/users/?limit=10"
+        )
+        subscribed = {
+            user["id"]: user["is_subscribed"] for user in data["results"]
+        }
+        self.assertEqual(subscribed.pop(self.reader.pk), False)
+        self.assertEqual(
+            subscribed,
+            {
+                author.pk: index < 2
+                for index, author in enumerate(self.authors)
+            },
+        )
+        self.assertEqual(len(follow_queries), 1, follow_queries)
+
+    def test_anonymous_is_not_subscribed(self):
+        self.client.force_authenticate(None)
+        data, follow_queries = self.get_with_follow_queries("/api/users/")
+        self.assertEqual(
+            {user["is_subscribed"] for user in data["results"]}, {False}
+        )
+        self.assertEqual(follow_queries, [])
+
+
+class RecipeCursorPaginationTests(APITestCase):
+    """Курсорный режим списка рецептов: порядок (-pub_date, -id)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [create_user("first"), create_user("second")]
+        recipes = [
+            create_recipe(cls.authors[index % 2], f"Рецепт {index}")
+            for index in range(7)
+        ]
+        # Одинаковая дата у нескольких рецептов: порядок решает id.
+        Recipe.objects.filter(pk__in=[r.pk for r in recipes[2:5]]).update(
+            pub_date=recipes[2].pub_date
+        )
+        cls.expected = list(
+            Recipe.objects.order_by("-pub_date", "-id").values_list(
+                "pk", flat=True
+            )
+        )
+
+    def walk(self, url):
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(
+                any("COUNT(" in query["sql"] for query in queries)
+            )
+            data = response.json()
+            self.assertNotIn("count", data)
+            ids += [recipe["id"] for recipe in data["results"]]
+            url = data["next"]
+        return ids
+
+    def test_pages_follow_feed_order(self):
+        self.assertEqual(
+            self.walk("/api/recipes/?cursor=&limit=2"), self.expected
+        )
+
+    def test_filters_keep_working(self):
+        author = self.authors[0]
+        self.assertEqual(
+            self.walk(f"/api/recipes/?cursor=&limit=2&author={author.pk}"),
+            [
+                pk
+                for pk in self.expected
+                if Recipe.objects.get(pk=pk).author_id == author.pk
+            ],
+        )
+
+    def test_ordering_by_counter(self):
+        # Курсор строится по favorites_count, которого нет среди полей
+        # строки быстрого пути.
+        counts = {pk: (pk * 3) % 7 for pk in self.expected}
+        for pk, count in counts.items():
+            Recipe.objects.filter(pk=pk).update(favorites_count=count)
+        self.assertEqual(
+            self.walk(
+                "/api/recipes/?cursor=&limit=2&ordering=-favorites_count"
+            ),
+            sorted(counts, key=counts.get, reverse=True),
+        )
+
+    def test_page_number_mode_by_default(self):
+        data = self.client.get("/api/recipes/?limit=2").json()
+        self.assertEqual(data["count"], 7)
+        self.assertIn("page=2", data["next"])
+
+
+@override_settings(
+    BACKGROUND_TASKS_ASYNC=False,
+    FEED_FANOUT_MAX_FOLLOWERS=1,
+    FEED_FANOUT_HYSTERESIS=0,
+)
+class FeedTests(APITestCase):
+    """Лента подписок из записей лент и рецептов авторов без раскладки."""
+
+    def setUp(self):
+        self.reader = create_user("reader")
+        self.author = create_user("author")
+        self.popular = create_user("popular")
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(user=self.reader, author=self.author)
+            Follow.objects.create(user=create_user("fan"), author=self.popular)
+            Follow.objects.create(user=self.reader, author=self.popular)
+        self.popular.refresh_from_db()
+        self.assertFalse(self.popular.feed_fanout)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes = [
+                create_recipe(
+                    (self.author, self.popular)[index % 2], f"Рецепт {index}"
+                )
+                for index in range(7)
+            ]
+            create_recipe(create_user("stranger"), "Чужой")
+        # Одинаковая дата у рецептов из обоих источников: порядок решает id.
+        tied = [recipe.pk for recipe in recipes[2:5]]
+        Recipe.objects.filter(pk__in=tied).update(
+            pub_date=recipes[2].pub_date
+        )
+        TimelineEntry.objects.filter(recipe__in=tied).update(
+            pub_date=recipes[2].pub_date
+        )
+        self.expected = list(
+            Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes])
+            .order_by("-pub_date", "-id")
+            .values_list("pk", flat=True)
+        )
+        self.client.force_authenticate(self.reader)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [recipe["id"] for recipe in data["results"]]
+            url = data["next"]
+        return ids
+
+    def test_merges_timeline_and_pulled_authors(self):
+        self.assertEqual(
+            set(
+                TimelineEntry.objects.filter(user=self.reader).values_list(
+                    "recipe__author", flat=True
+                )
+            ),
+            {self.author.pk},
+        )
+        for limit in (1, 2, 3, 10):
+            with self.subTest(limit=limit):
+                self.assertEqual(
+                    self.walk(f"/api/recipes/feed/?limit={limit}"),
+                    self.expected,
+                )
+
+    def test_no_duplicates_after_switching_mode(self):
+        # Записи лент остаются после выключения раскладки.
+        backfill_timelines([self.reader.pk], self.popular.pk)
+        self.assertEqual(
+            self.walk("/api/recipes/feed/?limit=2"), self.expected
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/recipes/feed/?cursor=bad")
+        self.assertEqual(response.status_code, 404)
+
+
+class AnonymousResponseCacheTests(APITestCase):
+    """Кеш ответов списка и карточки рецепта для анонимных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user("author")
+        cls.reader = create_user("reader")
+        cls.recipes = [
+            create_recipe(cls.author, f"Рецепт {index}") for index in range(3)
+        ]
+
+    def setUp(self):
+        get_recipe_cache().clear()
+
+    def get(self, url, **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_miss_then_hit(self):
+        first = self.get("/api/recipes/")
+        second = self.get("/api/recipes/")
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.json(), second.json())
+        detail_url = f"/api/recipes/{self.recipes[0].pk}/"
+        self.assertEqual(self.get(detail_url)["X-Cache"], "MISS")
+        # Из базы читаются только версии данных.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(detail_url)["X-Cache"], "HIT")
+
+    def test_authenticated_requests_are_not_cached(self):
+        self.client.force_authenticate(self.reader)
+        self.assertNotIn("X-Cache", self.get("/api/recipes/"))
+
+    def test_recipe_change_invalidates(self):
+        self.get("/api/recipes/")
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(pk=self.recipes[0].pk).save()
+        self.assertEqual(self.get("/api/recipes/")["X-Cache"], "MISS")
+
+    def test_key_includes_host_and_scheme(self):
+        self.get("/api/recipes/")
+        other_host = self.get("/api/recipes/", HTTP_HOST="localhost")
+        https = self.get("/api/recipes/", secure=True)
+        self.assertEqual(other_host["X-Cache"], "MISS")
+        self.assertEqual(https["X-Cache"], "MISS")
+        self.assertTrue(
+            other_host.json()["results"][0]["image"].startswith(
+                "http://localhost/"
+            )
+        )
+        self.assertTrue(
+            https.json()["results"][0]["image"].startswith("https://")
+        )
+
+    def test_favorites_invalidate_counter_ordering(self):
+        url = "/api/recipes/?ordering=-favorites_count"
+        self.get(url)
+        self.get("/api/recipes/")
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.reader, recipe=self.recipes[1])
+        response = self.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(
+            response.json()["results"][0]["id"], self.recipes[1].pk
+        )
+        self.assertEqual(self.get("/api/recipes/")["X-Cache"], "HIT")
+
+    def test_cache_stats(self):
+        self.get("/api/recipes/")
+        self.get("/api/recipes/")
+        self.client.force_authenticate(create_user("admin", is_staff=True))
+        stats = self.get("/api/recipes/cache-stats/").json()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+
+class ConditionalGetTests(APITestCase):
+    """ETag меняется при любых изменениях данных, в том числе массовых."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user("reader")
+        cls.recipes = [
+            create_recipe(create_user(f"author{index}"), f"Рецепт {index}")
+            for index in range(2)
+        ]
+        Ingredient.objects.create(name="мука", measurement_unit="г")
+
+    def setUp(self):
+        get_recipe_cache().clear()
+
+    def assert_transition(self, url, change, status_code=200):
+        """Ответ 304 до изменения и status_code после него."""
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status_code)
+        return response
+
+    def test_version_bumped_by_another_process(self):
+        def bump():
+            DataVersion.objects.update_or_create(
+                key=CONTENT_VERSION_KEY, defaults={"version": 100}
+            )
+
+        self.assert_transition("/api/recipes/", bump)
+
+    def test_bulk_update_bypassing_signals(self):
+        def drift():
+            Recipe.objects.update(favorites_count=5)
+            recount_counters()
+
+        self.assert_transition("/api/recipes/", drift)
+
+    def test_favorites_change_counter_ordering(self):
+        def favorite():
+            Favorite.objects.create(
+                user=create_user("fan"), recipe=self.recipes[0]
+            )
+
+        response = self.assert_transition(
+            "/api/recipes/?ordering=-favorites_count", favorite
+        )
+        self.assertEqual(
+            response.json()["results"][0]["id"], self.recipes[0].pk
+        )
+        self.assert_transition(
+            "/api/recipes/",
+            lambda: Favorite.objects.create(
+                user=self.reader, recipe=self.recipes[1]
+            ),
+            status_code=304,
+        )
+
+    def test_favorites_change_user_flags(self):
+        self.client.force_authenticate(self.reader)
+        response = self.assert_transition(
+            f"/api/recipes/{self.recipes[0].pk}/",
+            lambda: Favorite.objects.create(
+                user=self.reader, recipe=self.recipes[0]
+            ),
+        )
+        self.assertTrue(response.json()["is_favorited"])
+
+    def test_ingredients_loaded_by_command(self):
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".csv", encoding="utf-8", delete=False
+        ) as file:
+            file.write("name,measurement_unit\nсахар,г\n")
+        self.addCleanup(os.remove, file.name)
+        response = self.assert_transition(
+            "/api/ingredients/",
+            lambda: call_command(
+                "load_ingredients", path=file.name, stdout=StringIO()
+            ),
+        )
+        self.assertEqual(
+            [item["name"] for item in response.json()], ["мука", "сахар"]
+        )
+
+    def test_search_vectors_bump_only_content(self):
+        def reindex():
+            notify_data_changed(Recipe, ["search_vector"])
+
+        self.assert_transition("/api/recipes/", reindex)
+        self.assertFalse(
+            DataVersion.objects.filter(key=EPOCH_VERSION_KEY).exists()
+        )
+
+    def test_ingredients_added_by_another_process(self):
+        def add():
+            # Индекс этого процесса не получает сигналов о вставке и
+            # подхватывает её при перестройке по истечении TTL.
+            Ingredient.objects.bulk_create(
+                [Ingredient(name="соль", measurement_unit="г")]
+            )
+            ingredient_index.rebuild()
+
+        response = self.assert_transition("/api/ingredients/", add)
+        self.assertEqual(
+            [item["name"] for item in response.json()], ["мука", "соль"]
+        )
+
+
+class GenerateDatasetTests(APITestCase):
+    """Набор данных загружается в обход сигналов, но кеши сбрасываются."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f"продукт {index}", measurement_unit="г")
+            for index in range(5)
+        )
+        create_recipe(create_user("author"))
+
+    def setUp(self):
+        patcher = mock.patch(
+            "recipes.dataset.placeholder_image",
+            return_value="recipes/images/placeholder.png",
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_invalid_sizes(self):
+        for sizes in ({"users": 0}, {"recipes": 0}):
+            with self.subTest(**sizes), self.assertRaises(CommandError):
+                call_command(
+                    "generate_dataset",
+                    **{"users": 2, "recipes": 2, **sizes},
+                    stdout=StringIO(),
+                )
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_invalidates_indexes_and_etags(self):
+        recipe_id_index.invalidate()
+        self.addCleanup(recipe_id_index.invalidate)
+        etag = self.client.get("/api/recipes/")["ETag"]
+        recipe_id_index.get()
+        last_pk = Recipe.objects.latest("pk").pk
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                "generate_dataset", users=2, recipes=3, stdout=StringIO()
+            )
+
+        self.assertIn(last_pk + 3, recipe_id_index)
+        response = self.client.get("/api/recipes/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 4)
+
+
+class ShoppingListExportTests(APITestCase):
+    """Выгрузка списка покупок: форматы, ошибки и ETag."""
+
+    url = "/api/recipes/download_shopping_cart/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("buyer")
+        cls.recipe = create_recipe(create_user("author"), "Блины")
+        IngredientInRecipe.objects.create(
+            recipe=cls.recipe,
+            ingredient=Ingredient.objects.create(
+                name="мука", measurement_unit="г"
+            ),
+            amount=200,
+        )
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipe)
+
+    def setUp(self):
+        get_recipe_cache().clear()
+        self.client.force_authenticate(self.user)
+
+    def test_formats(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertEqual(
+            response.getvalue().decode(),
+            f"Список покупок Foodgram на {timezone.localdate():%d.%m.%Y}:\n"
+            "\n"
+            "Продукты:\n"
+            "1. Мука (г) — 200\n"
+            "\n"
+            "Рецепты, для которых нужны эти продукты:\n"
+            "1. Блины — @author",
+        )
+
+        response = self.client.get(self.url, {"format": "csv"})
+        self.assertTrue(response["Content-Type"].startswith("text/csv"))
+        self.assertEqual(
+            response.getvalue().decode().splitlines(),
+            [
+                "Продукт,Единица измерения,Количество",
+                "мука,г,200",
+                "",
+                "Рецепт,Автор",
+                "Блины,author",
+            ],
+        )
+
+        response = self.client.get(self.url, HTTP_ACCEPT="application/json")
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(
+            json.loads(response.getvalue())["ingredients"],
+            [{"name": "мука", "measurement_unit": "г", "amount": 200}],
+        )
+
+    def test_errors_are_json(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIn("detail", response.json())
+
+        self.client.force_authenticate(create_user("empty"))
+        response = self.client.get(self.url, {"format": "csv"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIn("errors", response.json())
+
+    def test_not_modified_without_cached_export(self):
+        response = self.client.get(self.url)
+        response.getvalue()
+        etag = response["ETag"]
+        get_recipe_cache().clear()
+        # Из базы читаются только версии данных.
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCart.objects.filter(user=self.user).delete()
+            ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertIn("Мука", response.getvalue().decode())
+
+
+class IngredientIndexTests(APITestCase):
+    """Список ингредиентов из индекса совпадает с IngredientFilter."""
+
+    names = [
+        "Straße",
+        "STRASSE",
+        "strasse",
+        "Ёлка",
+        "ёлка",
+        "ель",
+        "Ежевика",
+        "mango",
+        "Mandarin",
+        "MANGOLD",
+        "масло",
+        "Масло сливочное",
+    ]
+    prefixes = [
+        "",
+        "straß",
+        "STRAß",
+        "strasse",
+        "ё",
+        "Ё",
+        "е",
+        "Е",
+        "man",
+        "MANG",
+        "ма",
+        "МАСЛО С",
+        "нет",
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit="г") for name in cls.names
+        )
+
+    def setUp(self):
+        ingredient_index.invalidate()
+
+    def filtered(self, params):
+        filterset = IngredientFilter(params, queryset=Ingredient.objects.all())
+        self.assertTrue(filterset.is_valid())
+        return IngredientSerializer(filterset.qs, many=True).data
+
+    def test_index_matches_filter(self):
+        self.client.get("/api/ingredients/")
+        for prefix in self.prefixes:
+            for params in ({"name": prefix}, {"name": prefix, "limit": 2}):
+                with self.subTest(**params):
+                    with self.assertNumQueries(0):
+                        response = self.client.get("/api/ingredients/", params)
+                    self.assertEqual(response.json(), self.filtered(params))
+
+    def test_invalid_limit_is_rejected(self):
+        response = self.client.get("/api/ingredients/", {"limit": "-1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_vendors_use_filter(self):
+        with mock.patch.object(
+            ingredient_index, "is_supported", return_value=False
+        ):
+            response = self.client.get("/api/ingredients/", {"name": "ма"})
+        self.assertEqual(response.json(), self.filtered({"name": "ма"}))
+
+
+class DenormalizedCountersTests(APITestCase):
+    """Сохранение загруженного ранее объекта не затирает счётчики."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user("author")
+        cls.reader = create_user("reader")
+        cls.recipe = create_recipe(cls.author)
+
+    def test_recipe_update_keeps_favorites_count(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.create(user=self.reader, recipe=self.recipe)
+        RecipeSerializer().update(stale, {"name": "Новое название"})
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, "Новое название")
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+        stale.cooking_time = 5
+        stale.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.cooking_time, 5)
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_avatar_delete_keeps_followers_count(self):
+        User.objects.filter(pk=self.author.pk).update(
+            avatar="users/avatars/aa/avatar.png"
+        )
+        stale = User.objects.get(pk=self.author.pk)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client.force_authenticate(stale)
+        response = self.client.delete("/api/users/me/avatar/")
+        self.assertEqual(response.status_code, 204)
+        self.author.refresh_from_db()
+        self.assertFalse(self.author.avatar)
+        self.assertEqual(self.author.followers_count, 1)
+
+
+class SubscriptionRecipesLimitTests(APITestCase):
+    """recipes_limit отдаёт новейшие рецепты каждого автора."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user("reader")
+        cls.authors = [create_user(f"author{index}") for index in range(2)]
+        cls.recipe_ids = {}
+        now = timezone.now()
+        for author in cls.authors:
+            recipes = [create_recipe(author, f"Рецепт {i}") for i in range(3)]
+            for age, recipe in enumerate(recipes):
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    pub_date=now - timezone.timedelta(days=age)
+                )
+            cls.recipe_ids[author.pk] = [recipe.pk for recipe in recipes]
+        cls.author = cls.authors[0]
+        Follow.objects.create(user=cls.reader, author=cls.authors[1])
+
+    def setUp(self):
+        self.client.force_authenticate(self.reader)
+
+    def test_subscriptions(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        response = self.client.get(
+            "/api/users/subscriptions/", {"recipes_limit": 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        for author in response.json()["results"]:
+            with self.subTest(author=author["username"]):
+                self.assertEqual(
+                    [recipe["id"] for recipe in author["recipes"]],
+                    self.recipe_ids[author["id"]][:2],
+                )
+                self.assertEqual(author["recipes_count"], 3)
+
+    def test_subscribe(self):
+        response = self.client.post(
+            f"/api/users/{self.author.pk}/subscribe/?recipes_limit=1"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [recipe["id"] for recipe in response.json()["recipes"]],
+            self.recipe_ids[self.author.pk][:1],
+        )
+
+    def test_without_limit(self):
+        response = self.client.get("/api/users/subscriptions/")
+        recipes = response.json()["results"][0]["recipes"]
+        self.assertEqual(len(recipes), 3)
+
+
+class Base64ImageFieldTests(APITestCase):
+    """Расширение картинки определяется по её содержимому."""
+
+    def encode(self, image_format, mime_type):
+        buffer = BytesIO()
+        Image.new("RGB", (2, 2)).save(buffer, format=image_format)
+        data = base64.b64encode(buffer.getvalue()).decode()
+        return f"data:{mime_type};base64,{data}"
+
+    def test_extension_comes_from_image_format(self):
+        for image_format, mime_type, extension in (
+            ("PNG", "text/html", ".png"),
+            ("JPEG", "image/svg+xml", ".jpg"),
+            ("GIF", "image/png", ".gif"),
+        ):
+            with self.subTest(image_format=image_format):
+                file = Base64ImageField().to_internal_value(
+                    self.encode(image_format, mime_type)
+                )
+                self.assertTrue(file.name.endswith(extension))
+
+    def test_other_formats_are_rejected(self):
+        field = Base64ImageField()
+        with self.assertRaises(ValidationError):
+            field.to_internal_value(self.encode("BMP", "image/png"))
+        # Не-картинку отклоняет ImageField Django ещё до проверки формата.
+        with self.assertRaises(DjangoValidationError):
+            field.to_internal_value(
+                "data:image/png;base64,"
+                + base64.b64encode(b"<script></script>").decode()
+            )
+
+
+class ImageStorageTests(APITestCase):
+    """Общие файлы картинок в ContentAddressedStorage."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user("author")
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = image_storage()
+        buffer = BytesIO()
+        Image.new("RGB", (2, 2)).save(buffer, format="PNG")
+        self.content = buffer.getvalue()
+
+    def save(self, name):
+        return self.storage.save(name, ContentFile(self.content))
+
+    def test_name_depends_only_on_content(self):
+        name = self.save("recipes/images/photo.jpeg")
+        self.assertEqual(self.save("recipes/images/other.gif"), name)
+        self.assertTrue(name.endswith(".png"))
+
+    def test_shared_file_is_deleted_with_last_reference(self):
+        name = self.save("recipes/images/photo.png")
+        first = create_recipe(self.author, image=name)
+        second = create_recipe(self.author, image=name)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(self.storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(self.storage.exists(name))
+
+    def test_upload_rewrites_file_released_before_commit(self):
+        name = self.save("recipes/images/photo.png")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.save("recipes/images/again.png"), name)
+            # Параллельный release_image ещё не видит новую ссылку.
+            self.assertTrue(
+                self.storage.delete_unreferenced(name, lambda name: False)
+            )
+            self.assertFalse(self.storage.exists(name))
+        self.assertTrue(self.storage.exists(name))
+
+    def test_reference_found_on_recheck_keeps_file(self):
+        name = self.save("recipes/images/photo.png")
+        is_referenced = mock.Mock(side_effect=[False, True])
+        self.assertFalse(self.storage.delete_unreferenced(name, is_referenced))
+        self.assertTrue(self.storage.exists(name))
+        with self.storage.open(name, "rb") as file:
+            self.assertEqual(file.read(), self.content)
+
+
+class RecipeSearchTests(APITestCase):
+    """Полнотекстовый поиск и сортировка по релевантности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user("author")
+        cls.pancakes = create_recipe(author, "Блины с мёдом")
+        cls.salad = create_recipe(
+            author, "Салат", text="Подавать с блинами"
+        )
+        create_recipe(author, "Суп")
+
+    def search_request(self, params):
+        return Request(APIRequestFactory().get("/api/recipes/", params))
+
+    def test_search_query(self):
+        query = RecipeSearchFilter().get_search_query(
+            self.search_request({"search": "Блины, с-мёдом"})
+        )
+        self.assertEqual(
+            query,
+            SearchQuery(
+                "Блины:* & с:* & мёдом:*",
+                config=SEARCH_CONFIG,
+                search_type="raw",
+            ),
+        )
+        self.assertIsNone(
+            RecipeSearchFilter().get_search_query(
+                self.search_request({"search": " ,-"})
+            )
+        )
+
+    def test_relevance_ordering_without_explicit_ordering(self):
+        queryset = Recipe.objects.annotate(search_rank=Value(1.0))
+        view = RecipeViewSet()
+        view.ordering = ["-pub_date", "-id"]
+        view.ordering_fields = ["pub_date"]
+        ordering_filter = RecipeOrderingFilter()
+        self.assertEqual(
+            ordering_filter.get_ordering(
+                self.search_request({}), queryset, view
+            ),
+            ["-search_rank", "-pub_date", "-id"],
+        )
+        self.assertEqual(
+            ordering_filter.get_ordering(
+                self.search_request({"ordering": "pub_date"}), queryset, view
+            ),
+            ["pub_date"],
+        )
+
+    @skipIf(connection.vendor == "postgresql", "Проверка запасного поиска")
+    def test_search_fields_fallback(self):
+        response = self.client.get("/api/recipes/", {"search": "Блины"})
+        self.assertEqual(
+            [recipe["id"] for recipe in response.json()["results"]],
+            [self.pancakes.pk],
+        )
+
+    @skipUnless(connection.vendor == "postgresql", "Нужен PostgreSQL")
+    def test_ranking(self):
+        update_search_vectors()
+        response = self.client.get("/api/recipes/", {"search": "блин"})
+        self.assertEqual(
+            [recipe["id"] for recipe in response.json()["results"]],
+            [self.pancakes.pk, self.salad.pk],
+        )
+
+
+class WhatCanICookTests(APITestCase):
+    """Подбор рецептов по ингредиентам через индекс в памяти."""
+
+    url = "/api/recipes/what-can-i-cook/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("cook")
+        author = create_user("author")
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit="г")
+            for name in ("мука", "молоко", "яйца", "мясо")
+        )
+        cls.flour, cls.milk, cls.eggs, cls.meat = ingredients
+        compositions = {
+            "Блины": [cls.flour, cls.milk, cls.eggs],
+            "Лепёшки": [cls.flour, cls.milk],
+            "Омлет": [cls.milk, cls.eggs],
+            "Котлеты": [cls.meat, cls.eggs],
+        }
+        cls.recipes = {}
+        for name, ingredients in compositions.items():
+            recipe = create_recipe(author, name)
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=1
+                )
+                for ingredient in ingredients
+            )
+            cls.recipes[name] = recipe.pk
+
+    def setUp(self):
+        recipe_ingredient_index.invalidate()
+
+    def names(self, response):
+        ids = {pk: name for name, pk in self.recipes.items()}
+        return [ids[recipe["id"]] for recipe in response.json()["results"]]
+
+    def test_ranking_and_exclude(self):
+        response = self.client.get(
+            self.url, {"have": f"{self.flour.pk},{self.milk.pk}"}
+        )
+        self.assertEqual(
+            self.names(response), ["Лепёшки", "Блины", "Омлет"]
+        )
+        response = self.client.get(
+            self.url,
+            {"have": [self.flour.pk, self.milk.pk], "exclude": self.eggs.pk},
+        )
+        self.assertEqual(self.names(response), ["Лепёшки"])
+
+    def test_flag_filters_are_applied_before_pagination(self):
+        Favorite.objects.create(
+            user=self.user, recipe_id=self.recipes["Омлет"]
+        )
+        Favorite.objects.create(
+            user=self.user, recipe_id=self.recipes["Котлеты"]
+        )
+        self.client.force_authenticate(self.user)
+        response = self.client.get(
+            self.url, {"have": self.eggs.pk, "is_favorited": 1, "limit": 1}
+        )
+        self.assertEqual(response.json()["count"], 2)
+        self.assertEqual(self.names(response), ["Котлеты"])
+
+        response = self.client.get(
+            self.url, {"have": self.eggs.pk, "is_favorited": 0}
+        )
+        self.assertEqual(response.json()["count"], 1)
+        self.assertEqual(self.names(response), ["Блины"])
+
+    def test_refresh_does_not_change_served_snapshot(self):
+        matches = recipe_ingredient_index.match([self.meat.pk])
+        data = recipe_ingredient_index.get()
+        published = dict(data)
+        pancakes = self.recipes["Блины"]
+        IngredientInRecipe.objects.filter(recipe_id=pancakes).delete()
+        IngredientInRecipe.objects.create(
+            recipe_id=pancakes, ingredient=self.meat, amount=1
+        )
+        Recipe.objects.filter(pk=self.recipes["Котлеты"]).delete()
+        recipe_ingredient_index.refresh_recipes(
+            [pancakes, self.recipes["Котлеты"]]
+        )
+        self.assertEqual(matches[0:10], [self.recipes["Котлеты"]])
+        self.assertEqual(
+            recipe_ingredient_index.match([self.meat.pk])[0:10], [pancakes]
+        )
+        self.assertEqual(data, published)
+        self.assertIsNot(recipe_ingredient_index.get(), data)
+
+    @override_settings(RECIPE_INGREDIENT_INDEX_TTL=0)
+    def test_stale_index_is_rebuilt_in_background(self):
+        data = recipe_ingredient_index.get()
+        with mock.patch("api.indexes.threading.Thread") as thread:
+            self.assertIs(recipe_ingredient_index.get(), data)
+            self.assertIs(recipe_ingredient_index.get(), data)
+        thread.assert_called_once()
+        recipe_ingredient_index.rebuild()
+        self.assertIsNot(recipe_ingredient_index.get(), data)
+
+
+class ShortLinkTests(APITestCase):
+    """Короткие ссылки: коды base62 и проверка id по битовой карте."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipe = create_recipe(create_user("author"))
+
+    def setUp(self):
+        recipe_id_index.invalidate()
+        self.addCleanup(recipe_id_index.invalidate)
+
+    def test_codes_round_trip(self):
+        for pk in (0, 1, 61, 62, 3843, 10**6, 2**63 - 1):
+            with self.subTest(pk=pk):
+                code = encode_short_code(pk)
+                self.assertFalse(code.isdigit())
+                self.assertEqual(decode_short_code(code), pk)
+        self.assertEqual(encode_short_code(61), "a9")
+
+    def test_legacy_and_invalid_codes(self):
+        self.assertEqual(decode_short_code("125"), 125)
+        for code in ("", "a-b", "кот", "z" * 21, "zzzzzzzzzzzz"):
+            with self.subTest(code=code):
+                self.assertIsNone(decode_short_code(code))
+
+    def test_get_link(self):
+        response = self.client.get(f"/api/recipes/{self.recipe.pk}/get-link/")
+        self.assertTrue(
+            response.json()["short-link"].endswith(
+                f"/s/{encode_short_code(self.recipe.pk)}/"
+            )
+        )
+
+    def test_redirect_without_queries(self):
+        recipe_id_index.get()
+        for code in (encode_short_code(self.recipe.pk), str(self.recipe.pk)):
+            with self.subTest(code=code), self.assertNumQueries(0):
+                response = self.client.get(f"/s/{code}/")
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(
+                response["Location"], f"/recipes/{self.recipe.pk}/"
+            )
+            self.assertIn("public", response["Cache-Control"])
+            self.assertIn(
+                f"max-age={settings.SHORT_LINK_CACHE_MAX_AGE}",
+                response["Cache-Control"],
+            )
+
+    def test_unknown_recipe(self):
+        recipe_id_index.get()
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/s/{encode_short_code(10**6)}/")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get("/s/a-b/").status_code, 404)
+
+    def test_recipe_from_another_process(self):
+        recipe_id_index.get()
+        # Сигнал о создании срабатывает после коммита, которого в тесте
+        # нет, поэтому рецепта в карте ещё нет, как при создании в другом
+        # процессе.
+        recipe = create_recipe(self.recipe.author, "Новый")
+        code = encode_short_code(recipe.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(f"/s/{code}/").status_code, 302)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(f"/s/{code}/").status_code, 302)
+
+
+class JWTAuthenticationTests(APITestCase):
+    """Вход, обновление и отзыв токенов JWT."""
+
+    def setUp(self):
+        self.user = create_user("reader")
+
+    def login(self):
+        response = self.client.post(
+            "/api/auth/token/login/",
+            {
+                "email": self.user.email,
+                "password": "password-123",
+                "token_type": "jwt",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def refresh(self, refresh):
+        return self.client.post(
+            "/api/auth/token/refresh/", {"refresh": refresh}
+        )
+
+    def me(self, access):
+        return self.client.get(
+            "/api/users/me/", HTTP_AUTHORIZATION=f"Bearer {access}"
+        )
+
+    def authenticate(self, access):
+        request = APIRequestFactory().get(
+            "/", HTTP_AUTHORIZATION=f"Bearer {access}"
+        )
+        return StatelessJWTAuthentication().authenticate(request)[0]
+
+    def test_login(self):
+        tokens = self.login()
+        response = self.me(tokens["access"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["username"], "reader")
+
+    def test_user_is_built_from_token(self):
+        access = self.login()["access"]
+        with self.assertNumQueries(0):
+            user = self.authenticate(access)
+            self.assertEqual(user, self.user)
+            self.assertIsInstance(user, User)
+            self.assertTrue(user.is_active)
+            self.assertFalse(user.is_staff)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, self.user.email)
+            self.assertEqual(user.first_name, "Имя")
+
+    def test_token_without_claims_is_checked_in_db(self):
+        access = RefreshToken.for_user(self.user).access_token
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(access), self.user)
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        access = ClaimsRefreshToken.for_user(self.user).access_token
+        self.assertEqual(self.me(access).status_code, 401)
+
+    def test_deleted_user(self):
+        access = self.login()["access"]
+        self.user.delete()
+        self.assertEqual(self.me(access).status_code, 401)
+
+    def test_refresh_rotates_tokens(self):
+        tokens = self.login()
+        response = self.refresh(tokens["refresh"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.me(response.json()["access"]).status_code, 200)
+        self.assertEqual(self.refresh(tokens["refresh"]).status_code, 401)
+        self.assertEqual(
+            self.refresh(response.json()["refresh"]).status_code, 200
+        )
+
+    def test_refresh_rejects_inactive_user(self):
+        tokens = self.login()
+        self.user.is_active = False
+        self.user.save(update_fields=["is_active"])
+        self.assertEqual(self.refresh(tokens["refresh"]).status_code, 401)
+
+    def test_logout_revokes_refresh_token(self):
+        tokens = self.login()
+        other = RefreshToken.for_user(create_user("other"))
+        response = self.client.post(
+            "/api/auth/token/logout/",
+            {"refresh": str(other)},
+            HTTP_AUTHORIZATION=f"Bearer {tokens['access']}",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(
+            "/api/auth/token/logout/",
+            {"refresh": tokens["refresh"]},
+            HTTP_AUTHORIZATION=f"Bearer {tokens['access']}",
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.refresh(tokens["refresh"]).status_code, 401)
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTests(APITestCase):
+    """Метрики в формате Prometheus и доступ к ним по адресу."""
+
+    def setUp(self):
+        patcher = mock.patch("api.metrics.registry", MetricsRegistry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+        get_recipe_cache().clear()
+
+    def metrics(self, address="127.0.0.1"):
+        return self.client.get("/metrics/", REMOTE_ADDR=address)
+
+    def test_request_metrics(self):
+        create_recipe(create_user("author"))
+        self.client.get("/api/recipes/")
+        self.client.get("/api/recipes/0/")
+        response = self.metrics()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        lines = response.content.decode().splitlines()
+        for line in (
+            'api_requests_total{view="api:recipes-list",method="GET",'
+            'status="200"} 1',
+            'api_requests_total{view="api:recipes-detail",method="GET",'
+            'status="404"} 1',
+            'api_request_duration_seconds_count{view="api:recipes-list",'
+            'method="GET"} 1',
+            'api_db_queries_bucket{view="api:recipes-list",method="GET",'
+            'le="+Inf"} 1',
+            "# TYPE api_serializer_time_seconds_total counter",
+            "api_response_cache_misses_total 2",
+        ):
+            with self.subTest(line=line):
+                self.assertIn(line, lines)
+
+    def test_unknown_method_is_labelled_other(self):
+        self.client.generic("PROPFIND", "/api/recipes/")
+        self.assertIn(
+            'api_requests_total{view="api:recipes-list",method="other",'
+            'status="401"} 1',
+            self.metrics().content.decode().splitlines(),
+        )
+
+    def test_histogram_buckets_are_cumulative(self):
+        for queries in (0, 4, 4, 200):
+            metrics = RequestMetrics()
+            metrics.queries = queries
+            self.registry.observe('say "hi"', "GET", 200, 0.01, metrics, 10)
+        lines = render_metrics().splitlines()
+        labels = 'view="say \\"hi\\"",method="GET"'
+        for line in (
+            f'api_db_queries_bucket{{{labels},le="0"}} 1',
+            f'api_db_queries_bucket{{{labels},le="3"}} 1',
+            f'api_db_queries_bucket{{{labels},le="5"}} 3',
+            f'api_db_queries_bucket{{{labels},le="100"}} 3',
+            f'api_db_queries_bucket{{{labels},le="+Inf"}} 4',
+            f"api_db_queries_sum{{{labels}}} 208",
+        ):
+            with self.subTest(line=line):
+                self.assertIn(line, lines)
+
+    def test_allowed_addresses(self):
+        self.assertEqual(self.metrics("::1").status_code, 200)
+        self.assertEqual(self.metrics("10.0.0.5").status_code, 404)
+        with self.settings(METRICS_ALLOWED_IPS=["10.0.0.0/8"]):
+            self.assertEqual(self.metrics("10.0.0.5").status_code, 200)
+            self.assertEqual(self.metrics("127.0.0.1").status_code, 404)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.metrics().status_code, 404)
@@ -2,6 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
 from .views import (
+    CustomUserViewSet,
     IngredientViewSet,
     RecipeViewSet,
     UserSubscriptionViewSet,
@@ -17,6 +18,7 @@ router_v1.register(r"recipes", RecipeViewSet, basename="recipes")
 router_v1.register(
     r"users", UserSubscriptionViewSet, basename="user-subscriptions"
 )
+router_v1.register(r"users", CustomUserViewSet, basename="users")
 
 urlpatterns = [
     path("", include(router_v1.urls)),
@@ -1,23 +1,42 @@
-from rest_framework import viewsets, filters, status
+from ipaddress import ip_address, ip_network
+from itertools import chain
+
+from rest_framework import viewsets, status
 from rest_framework.permissions import (
     AllowAny,
+    IsAdminUser,
     IsAuthenticated,
 )
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
 from rest_framework.decorators import (
     action,
 )
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import (
+    api_settings as jwt_settings,
+)
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenRefreshView
+from djoser.views import TokenCreateView, TokenDestroyView, UserViewSet
 
 from django.shortcuts import get_object_or_404
 
 from recipes.models import (
     Ingredient,
-    Recipe,
     IngredientInRecipe,
+    Recipe,
     Favorite,
     ShoppingCart,
 )
+from recipes.services import (
+    feed_positions,
+    shopping_list_recipes,
+    shopping_list_totals,
+)
 from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
 from users.models import Follow
 
 from .serializers import (
@@ -27,14 +46,48 @@ from .serializers import (
     UserWithRecipesSerializer,
 )
 
+from .cache import (
+    COUNTERS_VERSION_KEY,
+    AnonymousResponseCacheMixin,
+    ConditionalGetMixin,
+    ETagMixin,
+    build_shopping_list_cache_key,
+    build_shopping_list_etag,
+    get_cache_stats,
+    get_recipe_cache,
+    is_not_modified,
+)
+from .authentication import (
+    ClaimsRefreshToken,
+    ClaimsTokenRefreshSerializer,
+)
+from .exports import EXPORT_FORMATS, stream_and_cache
+from .images import release_image
+from .metrics import render_metrics
+from .indexes import (
+    ingredient_index,
+    recipe_id_index,
+    recipe_ingredient_index,
+)
 from .permissions import IsAuthorOrAdminOrReadOnly
+from .fastpath import FastRecipeListMixin
+from .renderers import CSVRenderer, FastJSONRenderer, PlainTextRenderer
+from .shortlinks import decode_short_code, encode_short_code
 from django_filters.rest_framework import DjangoFilterBackend
 from .filters import (
     IngredientFilter,
+    RecipeOrderingFilter,
+    RecipeSearchFilter,
 )
 
-from django.http import FileResponse
-from django.db.models import F, Sum
+from django.http import (
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.db import transaction
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
 from django.utils import timezone
 
 from rest_framework.views import APIView
@@ -42,17 +95,24 @@ from .serializers import (
     SetAvatarSerializer,
     SetAvatarResponseSerializer,
 )
+from django.conf import settings
 from django.shortcuts import redirect
 from django.http import Http404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
 
 from .pagination import (
     CustomPageNumberPagination,
+    FeedCursorPagination,
+    RecipeCursorPagination,
 )
 
 User = get_user_model()
 
+EXPORT_CHUNK_SIZE = 500
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+
+class IngredientViewSet(ETagMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet для просмотра ингредиентов.
     Доступен всем пользователям (даже неавторизованным).
@@ -66,50 +126,126 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def get_etag_parts(self, request):
+        # Хеш содержимого индекса одинаков во всех процессах и не требует
+        # запроса к базе; изменения других процессов индекс подхватывает
+        # при перестройке раз в INGREDIENT_INDEX_TTL секунд.
+        return [ingredient_index.fingerprint()]
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.list_from_index, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def list_from_index(self, request, *args, **kwargs):
+        """
+        Список отдаётся из индекса в памяти процесса без обращения к БД.
+        Параметры проверяет тот же IngredientFilter; если они неверны или
+        индекс не поддерживает СУБД, список строится обычным запросом.
+        """
+        filterset = IngredientFilter(
+            request.query_params, queryset=self.get_queryset()
+        )
+        if not ingredient_index.is_supported() or not filterset.is_valid():
+            return super().list(request, *args, **kwargs)
+        params = filterset.form.cleaned_data
+        return Response(
+            ingredient_index.search(params["name"], params["limit"])
+        )
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(
+    ConditionalGetMixin,
+    AnonymousResponseCacheMixin,
+    FastRecipeListMixin,
+    viewsets.ModelViewSet,
+):
     serializer_class = RecipeSerializer
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    fast_list = True
     permission_classes = [IsAuthorOrAdminOrReadOnly]
     filter_backends = [
         DjangoFilterBackend,
-        filters.SearchFilter,
-        filters.OrderingFilter,
+        RecipeSearchFilter,
+        RecipeOrderingFilter,
     ]
     filterset_fields = ["author"]
     search_fields = ["name"]
-    ordering_fields = ["pub_date", "name"]
-    ordering = ["-pub_date"]
-
-    def get_queryset(self):
-        queryset = Recipe.objects.select_related("author").prefetch_related(
-            "ingredient_amounts__ingredient",
-            "favorited_by",
-            "in_shopping_carts_of",
-        )
-
-        user = self.request.user
-        query_params = self.request.query_params
-        is_favorited_param = query_params.get("is_favorited")
-        if is_favorited_param in ["true", "1"] and user.is_authenticated:
-            queryset = queryset.filter(favorited_by__user=user)
-        elif (
-            is_favorited_param in ["false", "0"] and user.is_authenticated
+    ordering_fields = ["pub_date", "name", "favorites_count"]
+    ordering = ["-pub_date", "-id"]
+
+    def get_etag_version_keys(self, request):
+        keys = super().get_etag_version_keys(request)
+        if self.orders_by_counters(request):
+            keys.append(COUNTERS_VERSION_KEY)
+        return keys
+
+    @property
+    def paginator(self):
+        """
+        Режим курсорной пагинации включается параметром ?cursor=
+        (пустое значение — первая страница), иначе остаётся постраничный.
+        """
+        if not hasattr(self, "_paginator") and (
+            RecipeCursorPagination.cursor_query_param
+            in self.request.query_params
         ):
-            queryset = queryset.exclude(favorited_by__user=user)
+            self._paginator = RecipeCursorPagination()
+        return super().paginator
 
-        is_in_shopping_cart_param = query_params.get("is_in_shopping_cart")
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Выгрузка списка покупок отдаётся в txt или csv, но ошибки, как и
+        # во всём API, остаются в JSON: фронтенд разбирает их как JSON.
         if (
-            is_in_shopping_cart_param in ["true", "1"]
-            and user.is_authenticated
-        ):
-            queryset = queryset.filter(in_shopping_carts_of__user=user)
-        elif (
-            is_in_shopping_cart_param in ["false", "0"]
-            and user.is_authenticated
+            self.action == "download_shopping_cart"
+            and isinstance(response, Response)
+            and response.status_code >= status.HTTP_400_BAD_REQUEST
         ):
-            queryset = queryset.exclude(in_shopping_carts_of__user=user)
+            request.accepted_renderer = FastJSONRenderer()
+            request.accepted_media_type = FastJSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = (
+            Recipe.objects.select_related("author")
+            .prefetch_related(
+                Prefetch(
+                    "ingredient_amounts",
+                    queryset=IngredientInRecipe.objects.select_related(
+                        "ingredient"
+                    ).order_by("pk"),
+                )
+            )
+            .defer("search_vector")
+            .with_user_flags(user)
+        )
+
+        for field, value in self.get_flag_filters().items():
+            queryset = queryset.filter(**{field: value})
         return queryset
 
+    def get_flag_filters(self):
+        """
+        Фильтры ?is_favorited= и ?is_in_shopping_cart= в виде
+        {поле: значение}. Для анонимных пользователей не применяются.
+        """
+        if not self.request.user.is_authenticated:
+            return {}
+        flags = {}
+        for field in ("is_favorited", "is_in_shopping_cart"):
+            value = self.request.query_params.get(field)
+            if value in ("true", "1"):
+                flags[field] = True
+            elif value in ("false", "0"):
+                flags[field] = False
+        return flags
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -178,24 +314,47 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
     @action(
-        detail=False, methods=["get"], permission_classes=[IsAuthenticated]
+        detail=False,
+        methods=["get"],
+        permission_classes=[IsAuthenticated],
+        renderer_classes=[PlainTextRenderer, CSVRenderer, JSONRenderer],
     )
     def download_shopping_cart(self, request):
+        """
+        Потоково отдаёт список покупок в формате txt, csv или json
+        (?format=). ETag строится из версий списка и проверяется до
+        выборки данных; готовая выгрузка кешируется.
+        """
         user = request.user
+        export_format = request.accepted_renderer.format
+        render_export, content_type = EXPORT_FORMATS[export_format]
+        filename = f"shopping_list.{export_format}"
+        today = timezone.localdate()
 
-        totals = (
-            IngredientInRecipe.objects.filter(
-                recipe__in_shopping_carts_of__user=user
-            )
-            .values(
-                name=F("ingredient__name"),
-                unit=F("ingredient__measurement_unit"),
-            )
-            .annotate(total=Sum("amount"))
-            .order_by("name")
+        cache_key = build_shopping_list_cache_key(
+            user.pk, export_format, today
         )
+        etag = build_shopping_list_etag(cache_key)
+        if is_not_modified(request, etag):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+
+        body = get_recipe_cache().get(cache_key)
+        if body is not None:
+            response = HttpResponse(body, content_type=content_type)
+            response["Content-Length"] = len(body)
+            response["Content-Disposition"] = (
+                f'attachment; filename="{filename}"'
+            )
+            response["ETag"] = etag
+            return response
 
-        if not totals.exists():
+        totals = shopping_list_totals(user).iterator(
+            chunk_size=EXPORT_CHUNK_SIZE
+        )
+        first_row = next(totals, None)
+        if first_row is None:
             return Response(
                 {
                     "errors": (
@@ -206,35 +365,107 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        recipe_info = (
-            Recipe.objects.filter(in_shopping_carts_of__user=user)
-            .values_list("name", "author__username")
-            .order_by("name")
+        recipe_info = shopping_list_recipes(user).iterator(
+            chunk_size=EXPORT_CHUNK_SIZE
         )
+        chunks = render_export(
+            today, chain([first_row], totals), recipe_info
+        )
+        response = StreamingHttpResponse(
+            stream_and_cache(chunks, cache_key), content_type=content_type
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        response["ETag"] = etag
+        return response
 
-        report_lines = [
-            f"Список покупок Foodgram на {timezone.localdate():%d.%m.%Y}:",
-            "\nПродукты:",
-        ]
-        for idx, row in enumerate(totals, 1):
-            report_lines.append(
-                f"{idx}. {row['name'].capitalize()} "
-                f"({row['unit']}) — {row['total']}"
-            )
-
-        report_lines.append("\nРецепты, для которых нужны эти продукты:")
-        for idx, (title, author_username) in enumerate(recipe_info, 1):
-            report_lines.append(f"{idx}. {title} — @{author_username}")
+    def parse_ingredient_ids(self, param):
+        """Разбирает id ингредиентов из ?param=1,2 или ?param=1&param=2."""
+        ingredient_ids = set()
+        for value in self.request.query_params.getlist(param):
+            for part in value.split(","):
+                part = part.strip()
+                if not part:
+                    continue
+                if not part.isdigit():
+                    raise ValidationError(
+                        {param: [f"Некорректный id ингредиента: {part}."]}
+                    )
+                ingredient_ids.add(int(part))
+        return ingredient_ids
 
-        report_text = "\n".join(report_lines)
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[AllowAny],
+        url_path="what-can-i-cook",
+    )
+    def what_can_i_cook(self, request):
+        """
+        Рецепты по имеющимся ингредиентам (?have=) без нежелательных
+        (?exclude=), по убыванию доли ингредиентов, которые уже есть.
+        Подбор идёт по инвертированному индексу в памяти, из базы
+        читается только текущая страница.
+        """
+        have = self.parse_ingredient_ids("have")
+        if not have:
+            return Response(
+                {"have": ["Укажите хотя бы один ингредиент."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        exclude = self.parse_ingredient_ids("exclude")
+        # Фильтры по избранному и списку покупок применяются до
+        # ранжирования, иначе страницы были бы неполными.
+        only, skip = None, set()
+        for field, value in self.get_flag_filters().items():
+            model = Favorite if field == "is_favorited" else ShoppingCart
+            recipe_ids = set(
+                model.objects.filter(user=request.user).values_list(
+                    "recipe_id", flat=True
+                )
+            )
+            if value:
+                only = recipe_ids if only is None else only & recipe_ids
+            else:
+                skip |= recipe_ids
+        matches = recipe_ingredient_index.match(have, exclude, only, skip)
+
+        paginator = CustomPageNumberPagination()
+        page = paginator.paginate_queryset(matches, request, view=self)
+        recipes = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page if pk in recipes], many=True
+        )
+        return paginator.get_paginated_response(serializer.data)
 
-        response = FileResponse(
-            report_text,
-            content_type="text/plain; charset=utf-8",
-            filename="shopping_list.txt",
-            as_attachment=True,
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[IsAuthenticated],
+    )
+    def feed(self, request):
+        """
+        Новые рецепты авторов, на которых подписан пользователь,
+        с курсорной пагинацией.
+        """
+        paginator = FeedCursorPagination()
+        page = paginator.paginate_positions(
+            lambda limit, after: feed_positions(request.user, limit, after),
+            request,
         )
-        return response
+        recipes = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page if pk in recipes], many=True
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[IsAdminUser],
+        url_path="cache-stats",
+    )
+    def cache_stats(self, request):
+        return Response(get_cache_stats(), status=status.HTTP_200_OK)
 
     @action(
         detail=True,
@@ -244,13 +475,11 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def get_link(self, request, pk=None):
         recipe = self.get_object()
-        try:
-            short_redirect_path = f"/s/{recipe.pk}/"
-        except Exception:
-            short_redirect_path = f"/s/{recipe.pk}/"
-
         absolute_short_link_url = request.build_absolute_uri(
-            short_redirect_path
+            reverse(
+                "recipe-short-redirect",
+                kwargs={"code": encode_short_code(recipe.pk)},
+            )
         )
 
         return Response(
@@ -258,7 +487,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
 
 
-class UserSubscriptionViewSet(viewsets.ViewSet):
+class CustomUserViewSet(ConditionalGetMixin, UserViewSet):
+    """
+    Пользователи djoser с условными GET: список, профиль и /me/
+    отвечают 304, если ни пользователи, ни подписки не менялись.
+    """
+
+
+class UserSubscriptionViewSet(ETagMixin, viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     pagination_class = (
         CustomPageNumberPagination
@@ -267,19 +503,43 @@ class UserSubscriptionViewSet(viewsets.ViewSet):
     def get_serializer_class(self):
         return UserWithRecipesSerializer
 
+    def get_recipes_prefetch(self):
+        """
+        Prefetch рецептов авторов с учётом recipes_limit: ROW_NUMBER()
+        по автору отбирает не больше recipes_limit новейших рецептов
+        каждого автора одним запросом.
+        """
+        ordering = (F("pub_date").desc(), F("id").desc())
+        recipes = Recipe.objects.order_by(*ordering)
+        try:
+            recipes_limit = int(self.request.query_params["recipes_limit"])
+        except (KeyError, ValueError):
+            recipes_limit = None
+        if recipes_limit is not None and recipes_limit >= 0:
+            recipes = recipes.annotate(
+                author_row_number=Window(
+                    RowNumber(), partition_by=F("author"), order_by=ordering
+                )
+            ).filter(author_row_number__lte=recipes_limit)
+        return Prefetch("recipes", queryset=recipes)
+
     @action(detail=False, methods=["get"], url_path="subscriptions")
     def get_user_subscriptions(self, request):
-        user = request.user
+        return self.conditional_response(self.list_subscriptions, request)
+
+    def get_subscriptions_queryset(self, user):
         subscribed_author_ids = Follow.objects.filter(user=user).values_list(
             "author_id", flat=True
         )
-
-        authors_queryset = (
+        return (
             User.objects.filter(pk__in=subscribed_author_ids)
-            .prefetch_related("recipes")
+            .prefetch_related(self.get_recipes_prefetch())
             .order_by("username")
         )
 
+    def list_subscriptions(self, request):
+        authors_queryset = self.get_subscriptions_queryset(request.user)
+
         paginator = self.pagination_class()
 
         page = paginator.paginate_queryset(
@@ -316,9 +576,9 @@ class UserSubscriptionViewSet(viewsets.ViewSet):
                 )
 
             serializer_context = {"request": request}
-            author_instance = User.objects.prefetch_related("recipes").get(
-                pk=author_to_subscribe.pk
-            )
+            author_instance = User.objects.prefetch_related(
+                self.get_recipes_prefetch()
+            ).get(pk=author_to_subscribe.pk)
             serializer = self.get_serializer_class()(
                 author_instance, context=serializer_context
             )
@@ -348,13 +608,12 @@ class UserAvatarView(APIView):
         user = self.get_object()
         serializer = SetAvatarSerializer(data=request.data)
         if serializer.is_valid():
-            if user.avatar:
-                user.avatar.delete(
-                    save=False
-                )
-
-            user.avatar = serializer.validated_data["avatar"]
-            user.save()
+            old_avatar = user.avatar.name
+            with transaction.atomic():
+                user.avatar = serializer.validated_data["avatar"]
+                user.save(update_fields=["avatar"])
+                if user.avatar.name != old_avatar:
+                    release_image(old_avatar)
 
             avatar_url = (
                 request.build_absolute_uri(user.avatar.url)
@@ -362,7 +621,11 @@ class UserAvatarView(APIView):
                 else None
             )
             response_serializer = SetAvatarResponseSerializer(
-                {"avatar": avatar_url}
+                {
+                    "avatar": avatar_url,
+                    "avatar_variants": user.avatar_variants,
+                },
+                context={"request": request},
             )
             return Response(
                 response_serializer.data, status=status.HTTP_200_OK
@@ -372,19 +635,97 @@ class UserAvatarView(APIView):
     def delete(self, request, *args, **kwargs):
         user = self.get_object()
         if user.avatar:
-            user.avatar.delete(
-                save=True
-            )
+            old_avatar = user.avatar.name
+            with transaction.atomic():
+                user.avatar = None
+                user.save(update_fields=["avatar"])
+                release_image(old_avatar)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-def recipe_short_redirect_view(request, pk: int):
+def recipe_short_redirect_view(request, code: str):
     """
-    Обрабатывает короткую ссылку вида /s/<pk>/ и делает редирект
+    Обрабатывает короткую ссылку вида /s/<code>/ и делает редирект
     на полный фронтенд-путь рецепта /recipes/<pk>/.
+    Существование рецепта проверяется по битовой карте id в памяти,
+    в базу запрос идёт только для id, которых в карте нет (например,
+    рецепт создан в другом процессе). Карта может отставать от базы,
+    поэтому редирект временный (302) и кешируется ненадолго.
     """
-    if not Recipe.objects.filter(pk=pk).exists():
+    pk = decode_short_code(code)
+    if pk is None:
         raise Http404("Рецепт не найден.")
+    if pk not in recipe_id_index:
+        if not Recipe.objects.filter(pk=pk).exists():
+            raise Http404("Рецепт не найден.")
+        recipe_id_index.add(pk)
 
     frontend_recipe_path = f"/recipes/{pk}/"
-    return redirect(frontend_recipe_path, permanent=True)
+    response = redirect(frontend_recipe_path)
+    patch_cache_control(
+        response, public=True, max_age=settings.SHORT_LINK_CACHE_MAX_AGE
+    )
+    return response
+
+
+def metrics_view(request):
+    """
+    Метрики процесса в формате Prometheus. Доступны только с адресов
+    из METRICS_ALLOWED_IPS; остальным, как и при выключенных метриках,
+    отвечает 404.
+    """
+    address = ip_address(request.META["REMOTE_ADDR"])
+    if not settings.METRICS_ENABLED or not any(
+        address in ip_network(allowed, strict=False)
+        for allowed in settings.METRICS_ALLOWED_IPS
+    ):
+        raise Http404
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4"
+    )
+
+
+class TokenLoginView(TokenCreateView):
+    """
+    Вход по email и паролю. По умолчанию выдаёт токен DRF, а с
+    token_type=jwt — пару короткоживущего access- и refresh-токена JWT.
+    """
+
+    def _action(self, serializer):
+        if self.request.data.get("token_type") != "jwt":
+            return super()._action(serializer)
+        user = serializer.user
+        refresh = ClaimsRefreshToken.for_user(user)
+        user_logged_in.send(
+            sender=user.__class__, request=self.request, user=user
+        )
+        return Response(
+            {"access": str(refresh.access_token), "refresh": str(refresh)},
+            status=status.HTTP_200_OK,
+        )
+
+
+class TokenLogoutView(TokenDestroyView):
+    """
+    Выход. Если передан refresh-токен JWT, он отзывается; иначе
+    удаляется токен DRF, как раньше.
+    """
+
+    def post(self, request):
+        raw_refresh = request.data.get("refresh")
+        if not raw_refresh:
+            return super().post(request)
+        try:
+            refresh = RefreshToken(raw_refresh)
+        except TokenError as error:
+            raise ValidationError({"refresh": [str(error)]})
+        if refresh.get(jwt_settings.USER_ID_CLAIM) != request.user.pk:
+            raise ValidationError(
+                {"refresh": ["Токен выдан другому пользователю."]}
+            )
+        refresh.blacklist()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class TokenRefreshJWTView(TokenRefreshView):
+    serializer_class = ClaimsTokenRefreshSerializer
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import os
 import dj_database_url
+from datetime import timedelta
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -34,6 +35,7 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     "rest_framework",
     "rest_framework.authtoken",
+    "rest_framework_simplejwt.token_blacklist",
     "djoser",
     "django_filters",
     "users.apps.UsersConfig",
@@ -42,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -92,6 +95,50 @@ else:
         }
     }
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "recipes": {
+        "BACKEND": os.getenv(
+            "RECIPE_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("RECIPE_CACHE_LOCATION", "recipes"),
+        "TIMEOUT": int(os.getenv("RECIPE_CACHE_TIMEOUT", "300")),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("RECIPE_CACHE_MAX_ENTRIES", "2000")),
+        },
+    },
+}
+
+RECIPE_CACHE_ALIAS = "recipes"
+
+INGREDIENT_INDEX_TTL = int(os.getenv("INGREDIENT_INDEX_TTL", "300"))
+RECIPE_INGREDIENT_INDEX_TTL = int(
+    os.getenv("RECIPE_INGREDIENT_INDEX_TTL", "600")
+)
+RECIPE_ID_INDEX_TTL = int(os.getenv("RECIPE_ID_INDEX_TTL", "600"))
+# Битовая карта id может отставать от базы на RECIPE_ID_INDEX_TTL секунд,
+# поэтому редирект временный и кешируется ненадолго: ссылка на удалённый
+# рецепт не должна застревать в браузерах и прокси.
+SHORT_LINK_CACHE_MAX_AGE = int(os.getenv("SHORT_LINK_CACHE_MAX_AGE", "60"))
+FEED_FANOUT_MAX_FOLLOWERS = int(
+    os.getenv("FEED_FANOUT_MAX_FOLLOWERS", "1000")
+)
+# Автор возвращается к раскладке по лентам, только когда подписчиков
+# становится не больше FEED_FANOUT_MAX_FOLLOWERS - FEED_FANOUT_HYSTERESIS,
+# чтобы колебания около порога не перестраивали ленты каждый раз.
+FEED_FANOUT_HYSTERESIS = int(os.getenv("FEED_FANOUT_HYSTERESIS", "100"))
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "False") == "True"
+# Адреса и подсети, которым доступен /metrics/.
+METRICS_ALLOWED_IPS = [
+    address.strip()
+    for address in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+    if address.strip()
+]
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -121,6 +168,33 @@ STATIC_ROOT = "/app/static_django"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = "/app/media"
 
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+    "images": {
+        "BACKEND": "config.storage.ContentAddressedStorage",
+    },
+}
+
+IMAGE_UPLOAD_MAX_BYTES = int(
+    os.getenv("IMAGE_UPLOAD_MAX_BYTES", str(5 * 1024 * 1024))
+)
+IMAGE_VARIANT_SIZES = {
+    "thumb": (160, 160),
+    "card": (600, 600),
+}
+IMAGE_PROCESSING_ASYNC = os.getenv("IMAGE_PROCESSING_ASYNC", "True") == "True"
+IMAGE_WORKER_THREADS = int(os.getenv("IMAGE_WORKER_THREADS", "2"))
+
+# Отложенные задачи (поисковые векторы, ленты подписок) выполняются после
+# коммита в пуле потоков процесса, а при False — сразу в том же потоке.
+BACKGROUND_TASKS_ASYNC = os.getenv("BACKGROUND_TASKS_ASYNC", "True") == "True"
+BACKGROUND_WORKER_THREADS = int(os.getenv("BACKGROUND_WORKER_THREADS", "2"))
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "users.User"
@@ -128,6 +202,7 @@ AUTH_USER_MODEL = "users.User"
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.StatelessJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticatedOrReadOnly",
@@ -136,6 +211,19 @@ REST_FRAMEWORK = {
     "PAGE_SIZE": 6,
 }
 
+SIMPLE_JWT = {
+    "ACCESS_TOKEN_LIFETIME": timedelta(
+        minutes=int(os.getenv("JWT_ACCESS_TOKEN_MINUTES", "5"))
+    ),
+    "REFRESH_TOKEN_LIFETIME": timedelta(
+        days=int(os.getenv("JWT_REFRESH_TOKEN_DAYS", "7"))
+    ),
+    "ROTATE_REFRESH_TOKENS": True,
+    "BLACKLIST_AFTER_ROTATION": True,
+    "CHECK_REVOKE_TOKEN": True,
+    "AUTH_HEADER_TYPES": ("Bearer",),
+}
+
 DJOSER = {
     "PASSWORD_RESET_CONFIRM_URL": "password/reset/confirm/{uid}/{token}",
     "USERNAME_RESET_CONFIRM_URL": "username/reset/confirm/{uid}/{token}",
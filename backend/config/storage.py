@@ -0,0 +1,139 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+import uuid
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import transaction
+from PIL import Image
+
+# Расширения файлов картинок по формату, который определил Pillow.
+IMAGE_EXTENSIONS = {
+    "JPEG": "jpg",
+    "PNG": "png",
+    "GIF": "gif",
+    "WEBP": "webp",
+}
+
+RELEASED_SUFFIX = ".released"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище, в котором имя файла — SHA-256 его содержимого.
+    Повторное сохранение тех же байтов ничего не пишет на диск, а
+    одинаковые картинки разных объектов хранятся одним файлом.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = super().save(
+            self.get_content_name(name, content), content, max_length
+        )
+        if transaction.get_connection().in_atomic_block:
+            # Пока транзакция не закоммичена, ссылки на файл не видны
+            # другим процессам, и release_image может удалить общий файл.
+            # После коммита файл при необходимости записывается заново.
+            content.seek(0)
+            data = b"".join(content.chunks())
+            transaction.on_commit(
+                lambda: self._save(name, ContentFile(data))
+            )
+        return name
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, "seek"):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, "seek"):
+            content.seek(0)
+        content_hash = digest.hexdigest()
+        directory = posixpath.dirname(name)
+        extension = self.get_extension(name, content)
+        return posixpath.join(
+            directory, content_hash[:2], f"{content_hash}{extension}"
+        )
+
+    def get_extension(self, name, content):
+        """
+        Расширение по формату картинки, чтобы одинаковые байты всегда
+        получали одно имя. Для прочих файлов оно берётся из имени.
+        """
+        try:
+            with Image.open(content) as image:
+                image_format = image.format
+        except (OSError, ValueError):
+            image_format = None
+        finally:
+            content.seek(0)
+        if image_format in IMAGE_EXTENSIONS:
+            return f".{IMAGE_EXTENSIONS[image_format]}"
+        return posixpath.splitext(name)[1].lower()
+
+    def delete_unreferenced(self, name, is_referenced):
+        """
+        Удаляет файл, если is_referenced(name) ложно. Файл сначала
+        отсоединяется переименованием, затем ссылки проверяются ещё раз:
+        если за это время появилась ссылка, файл возвращается на место.
+        Загрузка, закоммиченная после отсоединения, сама записывает файл
+        заново (см. save). Возвращает True, если файл удалён.
+        """
+        if is_referenced(name):
+            return False
+        path = self.path(name)
+        released_path = f"{path}.{uuid.uuid4().hex}{RELEASED_SUFFIX}"
+        try:
+            os.rename(path, released_path)
+        except FileNotFoundError:
+            return False
+        if is_referenced(name):
+            os.replace(released_path, path)
+            return False
+        os.remove(released_path)
+        return True
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(
+                    directory, self.directory_permissions_mode, exist_ok=True
+                )
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        # Пишем во временный файл и атомарно переименовываем: при гонке
+        # двух одинаковых загрузок итоговый файл всё равно один и тот же.
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".upload")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+
+def image_storage():
+    return storages["images"]
@@ -18,20 +18,34 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
-from api.views import recipe_short_redirect_view
+from api.views import (
+    TokenLoginView,
+    TokenLogoutView,
+    TokenRefreshJWTView,
+    metrics_view,
+    recipe_short_redirect_view,
+)
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics/", metrics_view, name="metrics"),
     path(
-        "s/<int:pk>/", recipe_short_redirect_view, name="recipe-short-redirect"
+        "s/<str:code>/",
+        recipe_short_redirect_view,
+        name="recipe-short-redirect",
     ),
     path(
-        "api/auth/", include("djoser.urls.authtoken")
+        "api/auth/token/login/", TokenLoginView.as_view(), name="login"
     ),
     path(
-        "api/", include("api.urls")
+        "api/auth/token/logout/", TokenLogoutView.as_view(), name="logout"
+    ),
+    path(
+        "api/auth/token/refresh/",
+        TokenRefreshJWTView.as_view(),
+        name="token-refresh",
     ),
     path(
-        "api/", include("djoser.urls")
+        "api/", include("api.urls")
     ),
 ]
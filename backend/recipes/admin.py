@@ -6,6 +6,7 @@ from .models import (
     Favorite,
     ShoppingCart,
 )
+from .services import refresh_cart_totals_for_recipe
 
 
 @admin.register(Ingredient)
@@ -47,13 +48,18 @@ class RecipeAdmin(admin.ModelAdmin):
         ("Даты", {"fields": ("pub_date",), "classes": ("collapse",)}),
     )
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        refresh_cart_totals_for_recipe(form.instance.pk)
+
     def favorites_count_list_view(self, obj):
-        return obj.favorited_by.count()
+        return obj.favorites_count
 
     favorites_count_list_view.short_description = "В избранном"
+    favorites_count_list_view.admin_order_field = "favorites_count"
 
     def favorites_count_change_view(self, obj):
-        return obj.favorited_by.count()
+        return obj.favorites_count
 
     favorites_count_change_view.short_description = "Добавлений в избранное"
 
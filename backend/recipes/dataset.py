@@ -0,0 +1,373 @@
+"""
+Генерация синтетических данных для замеров производительности и проверки
+планов запросов. При одинаковом seed и одинаковом списке ингредиентов
+получаются одинаковые данные.
+"""
+
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from users.models import Follow
+
+from .models import (
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+    TimelineEntry,
+)
+from .services import (
+    notify_data_changed,
+    rebuild_cart_totals,
+    recount_counters,
+    update_fanout_flags,
+    update_search_vectors,
+)
+
+User = get_user_model()
+
+BATCH_SIZE = 10000
+DEFAULT_PASSWORD = "dataset-password"
+PLACEHOLDER_NAME = "recipes/images/placeholder.png"
+PUBLICATION_PERIOD = timedelta(days=730)
+DISH_NAMES = (
+    "Салат",
+    "Суп",
+    "Пирог",
+    "Запеканка",
+    "Рагу",
+    "Омлет",
+    "Каша",
+    "Паста",
+    "Котлеты",
+    "Плов",
+)
+# Число избранных рецептов, рецептов в списке покупок и подписок
+# пользователя берётся из распределения Парето с этими параметрами:
+# у большинства единицы, у немногих сотни.
+FAVORITES_ALPHA = 1.2
+CARTS_ALPHA = 1.6
+FOLLOWS_ALPHA = 1.3
+MAX_PER_USER = 500
+
+
+class ZipfChooser:
+    """
+    Выбирает элементы с вероятностью, обратно пропорциональной рангу
+    в степени exponent. Ранги раздаются случайной перестановкой.
+    """
+
+    def __init__(self, items, rng, exponent):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(
+            accumulate(
+                1 / rank**exponent for rank in range(1, len(self.items) + 1)
+            )
+        )
+        self.rng = rng
+
+    def choices(self, k):
+        return self.rng.choices(self.items, cum_weights=self.cum_weights, k=k)
+
+    def sample(self, k, exclude=None):
+        """k различных элементов, не больше половины всех."""
+        k = min(k, len(self.items) // 2)
+        chosen = set()
+        while len(chosen) < k:
+            chosen.update(self.choices(k - len(chosen)))
+            chosen.discard(exclude)
+        return chosen
+
+
+def _copy_text(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def bulk_load(model, rows, batch_size=BATCH_SIZE):
+    """
+    Вставляет строки (словари attname -> значение) пакетами в обход
+    экземпляров моделей и сигналов: COPY FROM STDIN на PostgreSQL,
+    executemany на остальных базах. Незаданные поля получают значения
+    по умолчанию, поля с auto_now_add — текущее время. Вместо сигналов
+    моделей после коммита отправляется data_changed.
+    """
+    fields = [
+        field for field in model._meta.concrete_fields if not field.primary_key
+    ]
+    now = timezone.now()
+    defaults = {
+        field.attname: (
+            field.get_default()
+            if field.has_default()
+            else now if getattr(field, "auto_now_add", False) else None
+        )
+        for field in fields
+    }
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    rows = iter(rows)
+    inserted = 0
+    # Вне транзакции executemany на SQLite фиксирует каждую строку.
+    with transaction.atomic(), connection.cursor() as cursor:
+        use_copy = connection.vendor == "postgresql" and hasattr(
+            cursor.cursor, "copy_expert"
+        )
+        while batch := list(islice(rows, batch_size)):
+            values = [
+                [row.get(name, default) for name, default in defaults.items()]
+                for row in batch
+            ]
+            if use_copy:
+                buffer = StringIO()
+                for row in values:
+                    buffer.write("\t".join(map(_copy_text, row)) + "\n")
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f"COPY {table} ({columns}) FROM STDIN", buffer
+                )
+            else:
+                placeholders = ", ".join(["%s"] * len(fields))
+                cursor.executemany(
+                    f"INSERT INTO {table} ({columns}) "
+                    f"VALUES ({placeholders})",
+                    [
+                        [
+                            field.get_db_prep_save(value, connection)
+                            for field, value in zip(fields, row)
+                        ]
+                        for row in values
+                    ],
+                )
+            inserted += len(batch)
+        notify_data_changed(model)
+    return inserted
+
+
+def _last_pk(model):
+    return model.objects.aggregate(last=Max("pk"))["last"] or 0
+
+
+def _new_pks(model, after):
+    return list(
+        model.objects.filter(pk__gt=after)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+def _activity(rng, alpha):
+    return min(int(rng.paretovariate(alpha)) - 1, MAX_PER_USER)
+
+
+def placeholder_image():
+    """Одна картинка на все рецепты, в хранилище она лежит один раз."""
+    buffer = BytesIO()
+    Image.new("RGB", (600, 400), (224, 224, 224)).save(buffer, "PNG")
+    storage = Recipe._meta.get_field("image").storage
+    return storage.save(PLACEHOLDER_NAME, ContentFile(buffer.getvalue()))
+
+
+def fill_timelines(first_user_id, batch_size=BATCH_SIZE):
+    """
+    Заполняет ленты пользователей начиная с first_user_id одним потоком
+    пар (подписчик, рецепт) вместо rebuild_timelines, который
+    раскладывает рецепты по одному автору за раз.
+    """
+    rows = (
+        Follow.objects.filter(
+            user_id__gte=first_user_id,
+            author__feed_fanout=True,
+            author__recipes__isnull=False,
+        )
+        .values_list("user_id", "author__recipes", "author__recipes__pub_date")
+        # В порядке уникального индекса вставка идёт в конец B-дерева.
+        .order_by("user_id", "author__recipes")
+    )
+    return bulk_load(
+        TimelineEntry,
+        (
+            {"user_id": user_id, "recipe_id": recipe_id, "pub_date": pub_date}
+            for user_id, recipe_id, pub_date in rows.iterator(
+                chunk_size=batch_size
+            )
+        ),
+        batch_size,
+    )
+
+
+def _recipe_rows(rng, count, authors, ingredients, names, image, now):
+    for _ in range(count):
+        ingredient_ids = sorted(
+            ingredients.sample(
+                max(2, min(round(rng.lognormvariate(2.0, 0.35)), 25))
+            )
+        )
+        ingredient_names = [names[pk] for pk in ingredient_ids]
+        cooking_time = rng.randint(5, 180)
+        row = {
+            "author_id": authors.choices(1)[0],
+            "name": f"{rng.choice(DISH_NAMES)} с {ingredient_names[0]}",
+            "image": image,
+            "text": (
+                f"Смешайте {', '.join(ingredient_names)} и готовьте "
+                f"{cooking_time} минут."
+            ),
+            "cooking_time": cooking_time,
+            "pub_date": now
+            - timedelta(
+                seconds=rng.uniform(0, PUBLICATION_PERIOD.total_seconds())
+            ),
+        }
+        yield row, ingredient_ids
+
+
+def generate_dataset(
+    users,
+    recipes,
+    seed=0,
+    exponent=1.0,
+    batch_size=BATCH_SIZE,
+    password=DEFAULT_PASSWORD,
+    log=None,
+):
+    """
+    Добавляет users пользователей и recipes рецептов. Авторство,
+    популярность рецептов и авторов и выбор ингредиентов подчиняются
+    закону Ципфа с показателем exponent, активность пользователей —
+    распределению Парето. Ингредиенты должны быть уже загружены.
+    После вставки пересчитываются счётчики, итоги списков покупок,
+    поисковые векторы и ленты новых пользователей.
+    """
+    if users < 1 or recipes < 1:
+        raise ValueError("Нужны хотя бы один пользователь и один рецепт.")
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    names = dict(Ingredient.objects.values_list("pk", "name"))
+    if not names:
+        raise ValueError("Нет ингредиентов, сначала load_ingredients.")
+    now = timezone.now()
+
+    def step(message, started):
+        log(f"{message} за {time.perf_counter() - started:.1f} с")
+
+    with transaction.atomic():
+        started = time.perf_counter()
+        offset = _last_pk(User)
+        password_hash = make_password(password)
+        bulk_load(
+            User,
+            (
+                {
+                    "email": f"user{offset + index}@example.com",
+                    "username": f"user{offset + index}",
+                    "first_name": "Пользователь",
+                    "last_name": str(offset + index),
+                    "password": password_hash,
+                }
+                for index in range(1, users + 1)
+            ),
+            batch_size,
+        )
+        user_ids = _new_pks(User, offset)
+        authors = ZipfChooser(user_ids, rng, exponent)
+        step(f"Пользователей: {len(user_ids)}", started)
+
+        started = time.perf_counter()
+        ingredients = ZipfChooser(sorted(names), rng, exponent)
+        image = placeholder_image()
+        recipe_ids = []
+        rows = _recipe_rows(
+            rng, recipes, authors, ingredients, names, image, now
+        )
+        while chunk := list(islice(rows, batch_size)):
+            offset = _last_pk(Recipe)
+            bulk_load(Recipe, (row for row, _ in chunk), batch_size)
+            chunk_ids = _new_pks(Recipe, offset)
+            bulk_load(
+                IngredientInRecipe,
+                (
+                    {
+                        "recipe_id": recipe_id,
+                        "ingredient_id": ingredient_id,
+                        "amount": rng.randint(1, 500),
+                    }
+                    for recipe_id, (_, ingredient_ids) in zip(chunk_ids, chunk)
+                    for ingredient_id in ingredient_ids
+                ),
+                batch_size,
+            )
+            recipe_ids += chunk_ids
+        step(f"Рецептов: {len(recipe_ids)}", started)
+
+        started = time.perf_counter()
+        popular = ZipfChooser(recipe_ids, rng, exponent)
+        for model, alpha in (
+            (Favorite, FAVORITES_ALPHA),
+            (ShoppingCart, CARTS_ALPHA),
+        ):
+            bulk_load(
+                model,
+                (
+                    {"user_id": user_id, "recipe_id": recipe_id}
+                    for user_id in user_ids
+                    for recipe_id in sorted(
+                        popular.sample(_activity(rng, alpha))
+                    )
+                ),
+                batch_size,
+            )
+        bulk_load(
+            Follow,
+            (
+                {"user_id": user_id, "author_id": author_id}
+                for user_id in user_ids
+                for author_id in sorted(
+                    authors.sample(
+                        _activity(rng, FOLLOWS_ALPHA), exclude=user_id
+                    )
+                )
+            ),
+            batch_size,
+        )
+        step("Избранное, списки покупок и подписки", started)
+
+    for message, rebuild in (
+        ("Счётчики", recount_counters),
+        ("Режимы лент", update_fanout_flags),
+        ("Итоги списков покупок", rebuild_cart_totals),
+        ("Поисковые векторы", update_search_vectors),
+        ("Ленты", lambda: fill_timelines(user_ids[0], batch_size)),
+    ):
+        started = time.perf_counter()
+        rebuild()
+        step(message, started)
+    return {"users": len(user_ids), "recipes": len(recipe_ids)}
@@ -0,0 +1,91 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.dataset import BATCH_SIZE, DEFAULT_PASSWORD, generate_dataset
+from recipes.models import Ingredient
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise ValueError(value)
+    return number
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерирует воспроизводимый набор данных для замеров: "
+        "пользователей, рецепты из настоящих ингредиентов, избранное, "
+        "списки покупок и подписки со степенным распределением"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            type=positive_int,
+            default=1000,
+            help="Число пользователей.",
+        )
+        parser.add_argument(
+            "--recipes",
+            type=positive_int,
+            default=10000,
+            help="Число рецептов.",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Зерно генератора."
+        )
+        parser.add_argument(
+            "--zipf",
+            type=float,
+            default=1.0,
+            help="Показатель закона Ципфа для популярности.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=positive_int,
+            default=BATCH_SIZE,
+            help="Строк в одной пачке COPY/INSERT.",
+        )
+        parser.add_argument(
+            "--password",
+            default=DEFAULT_PASSWORD,
+            help="Пароль всех созданных пользователей.",
+        )
+        parser.add_argument(
+            "--ingredients",
+            help=(
+                "Файл для load_ingredients, если ингредиентов в базе "
+                "ещё нет."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options["zipf"] <= 0:
+            raise CommandError("--zipf должен быть положительным.")
+        if not Ingredient.objects.exists():
+            call_command("load_ingredients", path=options["ingredients"])
+
+        started = time.perf_counter()
+        try:
+            created = generate_dataset(
+                users=options["users"],
+                recipes=options["recipes"],
+                seed=options["seed"],
+                exponent=options["zipf"],
+                batch_size=options["batch_size"],
+                password=options["password"],
+                log=self.stdout.write,
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Набор данных создан за "
+                f"{time.perf_counter() - started:.1f} с. "
+                f"Пользователей: {created['users']}, "
+                f"рецептов: {created['recipes']}"
+            )
+        )
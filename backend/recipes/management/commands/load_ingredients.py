@@ -1,97 +1,159 @@
+import csv
 import json
-from django.core.management.base import BaseCommand
-from django.db import IntegrityError
-from recipes.models import Ingredient
 import os
+import time
+
 from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import Ingredient
+from recipes.services import notify_data_changed
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(file):
+    """
+    Потоково разбирает JSON-массив объектов, не загружая файл целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith("["):
+        raise CommandError("Ожидался JSON-массив ингредиентов.")
+    position = 1
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if buffer.startswith("]", position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as error:
+            if eof:
+                raise CommandError(f"Ошибка декодирования JSON: {error}")
+            chunk = file.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+
+
+def iter_csv_rows(file):
+    for row in csv.reader(file):
+        if not row or row[:2] == ["name", "measurement_unit"]:
+            continue
+        yield {
+            "name": row[0],
+            "measurement_unit": row[1] if len(row) > 1 else None,
+        }
+
+
+READERS = {
+    ".json": iter_json_array,
+    ".csv": iter_csv_rows,
+}
 
 
 class Command(BaseCommand):
-    help = "Загружает ингредиенты из JSON файла в базу данных"
+    help = "Загружает ингредиенты из JSON или CSV файла в базу данных"
 
-    def handle(self, *args, **options):
-        file_path = os.path.join(settings.BASE_DIR, "data", "ingredients.json")
-        self.stdout.write(
-            self.style.SUCCESS(f"Ищем файл по пути: {file_path}")
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            help=(
+                "Путь к файлу .json или .csv. По умолчанию "
+                "data/ingredients.csv, а если его нет — data/ingredients.json."
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Количество ингредиентов в одном INSERT.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Выполнить загрузку и откатить транзакцию.",
         )
 
-        if not os.path.exists(file_path):
-            self.stdout.write(self.style.ERROR(f"Файл {file_path} не найден."))
-            return
+    def get_default_path(self):
+        # В контейнере data/ смонтирован рядом с manage.py, в репозитории
+        # он лежит в корне, на уровень выше backend/.
+        data_dirs = [
+            os.path.join(settings.BASE_DIR, "data"),
+            os.path.join(settings.BASE_DIR.parent, "data"),
+        ]
+        for data_dir in data_dirs:
+            for file_name in ("ingredients.csv", "ingredients.json"):
+                file_path = os.path.join(data_dir, file_name)
+                if os.path.exists(file_path):
+                    return file_path
+        raise CommandError(
+            f"В каталогах {', '.join(data_dirs)} нет файла ингредиентов."
+        )
 
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                ingredients_data = json.load(f)
-        except FileNotFoundError:
-            self.stdout.write(self.style.ERROR(f"Файл {file_path} не найден."))
-            return
-        except json.JSONDecodeError:
-            self.stdout.write(
-                self.style.ERROR(
-                    f"Ошибка декодирования JSON в файле {file_path}."
-                )
-            )
-            return
-        except Exception as e:
-            self.stdout.write(
-                self.style.ERROR(f"Произошла ошибка при чтении файла: {e}")
-            )
-            return
+    def handle(self, *args, **options):
+        file_path = options["path"] or self.get_default_path()
+        if not os.path.exists(file_path):
+            raise CommandError(f"Файл {file_path} не найден.")
+        reader = READERS.get(os.path.splitext(file_path)[1].lower())
+        if reader is None:
+            raise CommandError("Поддерживаются только файлы .json и .csv.")
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size должен быть положительным.")
 
-        count_added = 0
-        count_skipped = 0
-
-        for item in ingredients_data:
-            try:
-                ingredient, created = Ingredient.objects.get_or_create(
-                    name=item["name"].lower(),
-                    measurement_unit=item[
-                        "measurement_unit"
-                    ].lower(),  # Приводим к нижнему регистру
-                )
-                if created:
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f"Добавлен ингредиент: {ingredient.name}"
+        started = time.perf_counter()
+        count_read = 0
+        count_invalid = 0
+        with transaction.atomic():
+            count_before = Ingredient.objects.count()
+            batch = []
+            with open(file_path, "r", encoding="utf-8") as file:
+                for item in reader(file):
+                    try:
+                        batch.append(
+                            Ingredient(
+                                name=item["name"].strip().lower(),
+                                measurement_unit=item["measurement_unit"]
+                                .strip()
+                                .lower(),
+                            )
                         )
-                    )
-                    count_added += 1
-                else:
-                    self.stdout.write(
-                        self.style.WARNING(
-                            f"Ингредиент уже существует "
-                            f"(пропущен): "
-                            f"{ingredient.name}"
+                    except (KeyError, AttributeError, TypeError):
+                        self.stdout.write(
+                            self.style.ERROR(
+                                f"Пропущена запись из-за отсутствия ключа "
+                                f'"name" или "measurement_unit": {item}'
+                            )
                         )
-                    )
-                    count_skipped += 1
-            except IntegrityError as e:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f'Ошибка целостности для {item["name"]}: {e}'
-                    )
-                )
-                count_skipped += 1
-            except KeyError:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f"Пропущена запись из-за отсутствия ключа "
-                        f'"name" или "measurement_unit": {item}'
-                    )
-                )
-                count_skipped += 1
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f"Не удалось добавить ингредиент "
-                        f'{item.get("name", "(имя отсутствует)")}'
-                        f": {e}"
-                    )
-                )
-                count_skipped += 1
-
-        success_message = (
-            f"Загрузка ингредиентов завершена. Добавлено: {count_added}, "
-            f"Пропущено (уже существовали или ошибка): {count_skipped}"
+                        count_invalid += 1
+                        continue
+                    count_read += 1
+                    if len(batch) >= batch_size:
+                        Ingredient.objects.bulk_create(
+                            batch, ignore_conflicts=True
+                        )
+                        batch = []
+            if batch:
+                Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+            count_added = Ingredient.objects.count() - count_before
+            notify_data_changed(Ingredient)
+            if options["dry_run"]:
+                transaction.set_rollback(True)
+
+        elapsed = time.perf_counter() - started
+        prefix = "[dry-run] " if options["dry_run"] else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefix}Загрузка ингредиентов из {file_path} завершена "
+                f"за {elapsed:.2f} с. Прочитано: {count_read}, "
+                f"добавлено: {count_added}, "
+                f"пропущено (уже существовали): {count_read - count_added}, "
+                f"ошибок: {count_invalid}"
+            )
         )
-        self.stdout.write(self.style.SUCCESS(success_message))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from recipes.services import rebuild_cart_totals
+
+
+class Command(BaseCommand):
+    help = "Перестраивает итоги списков покупок из ShoppingCart"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только сверить таблицу итогов, ничего не изменяя.",
+        )
+
+    def handle(self, *args, **options):
+        mismatches = rebuild_cart_totals(dry_run=options["check"])
+        if options["check"]:
+            style = self.style.WARNING if mismatches else self.style.SUCCESS
+            self.stdout.write(style(f"Расхождений в итогах: {mismatches}"))
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Итоги списков покупок перестроены. "
+                f"Исправлено расхождений: {mismatches}"
+            )
+        )
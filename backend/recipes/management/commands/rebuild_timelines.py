@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import TimelineEntry
+from recipes.services import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = "Перестраивает ленты подписок по текущим подпискам"
+
+    def handle(self, *args, **options):
+        rebuild_timelines()
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Ленты перестроены. "
+                f"Записей в лентах: {TimelineEntry.objects.count()}"
+            )
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from recipes.services import recount_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет и исправляет счётчики избранного, списков покупок, "
+        "рецептов и подписчиков"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только сверить счётчики, ничего не изменяя.",
+        )
+
+    def handle(self, *args, **options):
+        mismatches = recount_counters(dry_run=options["check"])
+        if options["check"]:
+            style = self.style.WARNING if mismatches else self.style.SUCCESS
+            self.stdout.write(
+                style(f"Строк с неверными счётчиками: {mismatches}")
+            )
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Счётчики пересчитаны. Исправлено строк: {mismatches}"
+            )
+        )
@@ -0,0 +1,89 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_cart_totals(apps, schema_editor):
+    IngredientInRecipe = apps.get_model("recipes", "IngredientInRecipe")
+    ShoppingCartTotal = apps.get_model("recipes", "ShoppingCartTotal")
+    rows = (
+        IngredientInRecipe.objects.filter(
+            recipe__in_shopping_carts_of__isnull=False
+        )
+        .values_list("recipe__in_shopping_carts_of__user", "ingredient")
+        .annotate(total=Sum("amount"))
+        .order_by()
+    )
+    ShoppingCartTotal.objects.bulk_create(
+        [
+            ShoppingCartTotal(
+                user_id=user_id, ingredient_id=ingredient_id, total=total
+            )
+            for user_id, ingredient_id, total in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0004_recipe_pub_date_id_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ShoppingCartTotal",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "total",
+                    models.PositiveIntegerField(
+                        verbose_name="Общее количество"
+                    ),
+                ),
+                (
+                    "ingredient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="shopping_cart_totals",
+                        to="recipes.ingredient",
+                        verbose_name="Ингредиент",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="shopping_cart_totals",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Итог по списку покупок",
+                "verbose_name_plural": "Итоги по спискам покупок",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="shoppingcarttotal",
+            constraint=models.UniqueConstraint(
+                fields=("user", "ingredient"),
+                name="unique_user_cart_total_ingredient",
+            ),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
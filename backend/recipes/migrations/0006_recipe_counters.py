@@ -0,0 +1,57 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:09
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count_by(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    Favorite = apps.get_model("recipes", "Favorite")
+    ShoppingCart = apps.get_model("recipes", "ShoppingCart")
+    Recipe.objects.update(
+        favorites_count=_count_by(Favorite, "recipe"),
+        in_carts_count=_count_by(ShoppingCart, "recipe"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0005_shoppingcarttotal"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="favorites_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                verbose_name="Добавлений в избранное",
+            ),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="in_carts_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                verbose_name="Добавлений в список покупок",
+            ),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0006_recipe_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="image_variants",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                editable=False,
+                verbose_name="Уменьшенные копии картинки",
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:13
+
+import config.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0007_recipe_image_variants"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="recipe",
+            name="image",
+            field=models.ImageField(
+                db_index=True,
+                storage=config.storage.image_storage,
+                upload_to="recipes/images/",
+                verbose_name="Картинка рецепта",
+            ),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:16
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, TextField, Value
+from django.db.models.functions import Coalesce
+
+from recipes.operations import PostgresOnlyAddIndex
+
+SEARCH_CONFIG = "russian"
+
+
+def fill_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    Recipe = apps.get_model("recipes", "Recipe")
+    IngredientInRecipe = apps.get_model("recipes", "IngredientInRecipe")
+    ingredient_names = (
+        IngredientInRecipe.objects.filter(recipe=OuterRef("pk"))
+        .order_by()
+        .values("recipe")
+        .annotate(names=StringAgg("ingredient__name", delimiter=" "))
+        .values("names")
+    )
+    Recipe.objects.update(
+        search_vector=(
+            SearchVector("name", weight="A", config=SEARCH_CONFIG)
+            + SearchVector(
+                Coalesce(
+                    Subquery(ingredient_names),
+                    Value(""),
+                    output_field=TextField(),
+                ),
+                weight="B",
+                config=SEARCH_CONFIG,
+            )
+            + SearchVector("text", weight="C", config=SEARCH_CONFIG)
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0008_recipe_image_storage"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Поисковый вектор"
+            ),
+        ),
+        PostgresOnlyAddIndex(
+            model_name="recipe",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="recipe_search_vector_idx"
+            ),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
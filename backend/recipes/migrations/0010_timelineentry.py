@@ -0,0 +1,95 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:20
+
+from itertools import islice
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_timelines(apps, schema_editor):
+    Follow = apps.get_model("users", "Follow")
+    Recipe = apps.get_model("recipes", "Recipe")
+    TimelineEntry = apps.get_model("recipes", "TimelineEntry")
+    follows = Follow.objects.filter(
+        author__followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).values_list("user_id", "author_id")
+    recipe_ids = {}
+
+    def author_recipe_ids(author_id):
+        if author_id not in recipe_ids:
+            recipe_ids[author_id] = list(
+                Recipe.objects.filter(author_id=author_id).values_list(
+                    "pk", flat=True
+                )
+            )
+        return recipe_ids[author_id]
+
+    pairs = (
+        (user_id, recipe_id)
+        for user_id, author_id in follows.iterator()
+        for recipe_id in author_recipe_ids(author_id)
+    )
+    while batch := list(islice(pairs, 1000)):
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user_id=user_id, recipe_id=recipe_id)
+                for user_id, recipe_id in batch
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0009_recipe_search_vector"),
+        ("users", "0002_user_counters"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TimelineEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "recipe",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="timeline_entries",
+                        to="recipes.recipe",
+                        verbose_name="Рецепт",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="timeline_entries",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Подписчик",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Запись ленты",
+                "verbose_name_plural": "Записи лент",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="timelineentry",
+            constraint=models.UniqueConstraint(
+                fields=("user", "recipe"), name="unique_user_timeline_recipe"
+            ),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:29
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+from recipes.operations import PostgresOnlyAddIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0010_timelineentry"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="favorite",
+            index=models.Index(
+                fields=["recipe", "user"], name="favorite_recipe_user_idx"
+            ),
+        ),
+        PostgresOnlyAddIndex(
+            model_name="ingredient",
+            index=models.Index(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper(
+                        django.db.models.functions.comparison.Cast(
+                            "name", models.TextField()
+                        )
+                    ),
+                    name="text_pattern_ops",
+                ),
+                name="ingredient_name_upper_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["author", "-pub_date", "-id"],
+                name="recipe_author_pub_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="shoppingcart",
+            index=models.Index(
+                fields=["recipe", "user"], name="shopping_cart_recipe_user_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.6 on 2026-10-17 09:10
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_pub_date(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    TimelineEntry = apps.get_model("recipes", "TimelineEntry")
+    TimelineEntry.objects.update(
+        pub_date=Subquery(
+            Recipe.objects.filter(pk=OuterRef("recipe_id")).values(
+                "pub_date"
+            )
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0011_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="timelineentry",
+            name="pub_date",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                verbose_name="Дата публикации рецепта",
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_pub_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="timelineentry",
+            index=models.Index(
+                fields=["user", "-pub_date", "-recipe"],
+                name="timeline_user_pub_date_idx",
+            ),
+        ),
+    ]
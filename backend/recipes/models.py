@@ -1,9 +1,15 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 
+from config.storage import image_storage
+from users.models import DenormalizedFieldsMixin
+
 User = get_user_model()
 
+SEARCH_CONFIG = "russian"
+
 
 class Ingredient(models.Model):
     name = models.CharField("Название ингредиента", max_length=200)
@@ -19,12 +25,39 @@ class Ingredient(models.Model):
                 name="unique_ingredient_measurement_unit",
             )
         ]
+        # Индекс ingredient_name_upper_idx для name__istartswith есть
+        # только на PostgreSQL и создаётся миграцией 0011.
 
     def __str__(self):
         return f"{self.name}, {self.measurement_unit}"
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        """
+        Аннотирует рецепты флагами is_favorited и is_in_shopping_cart
+        для пользователя подзапросами EXISTS.
+        """
+        if user is None or not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                Favorite.objects.filter(
+                    user=user, recipe=models.OuterRef("pk")
+                )
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShoppingCart.objects.filter(
+                    user=user, recipe=models.OuterRef("pk")
+                )
+            ),
+        )
+
+
+class Recipe(DenormalizedFieldsMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -38,6 +71,11 @@ class Recipe(models.Model):
     image = models.ImageField(
         "Картинка рецепта",
         upload_to="recipes/images/",
+        storage=image_storage,
+        db_index=True,
+    )
+    image_variants = models.JSONField(
+        "Уменьшенные копии картинки", default=dict, blank=True, editable=False
     )
     text = models.TextField("Описание рецепта")
     ingredients = models.ManyToManyField(
@@ -51,11 +89,35 @@ class Recipe(models.Model):
         validators=[MinValueValidator(1)],
     )
     pub_date = models.DateTimeField("Дата публикации", auto_now_add=True)
+    favorites_count = models.PositiveIntegerField(
+        "Добавлений в избранное", default=0, editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        "Добавлений в список покупок", default=0, editable=False
+    )
+    search_vector = SearchVectorField(
+        "Поисковый вектор", null=True, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    denormalized_fields = ("favorites_count", "in_carts_count")
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ["-pub_date"]
+        indexes = [
+            models.Index(
+                fields=["-pub_date", "-id"], name="recipe_pub_date_id_idx"
+            ),
+            models.Index(
+                fields=["author", "-pub_date", "-id"],
+                name="recipe_author_pub_date_idx",
+            ),
+            # GIN-индекс recipe_search_vector_idx по search_vector есть
+            # только на PostgreSQL и создаётся миграцией 0009.
+        ]
 
     def __str__(self):
         return self.name
@@ -122,6 +184,11 @@ class Favorite(models.Model):
                 fields=["user", "recipe"], name="unique_user_favorite_recipe"
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["recipe", "user"], name="favorite_recipe_user_idx"
+            )
+        ]
 
     def __str__(self):
         return f"{self.user.username} добавил в избранное {self.recipe.name}"
@@ -150,8 +217,89 @@ class ShoppingCart(models.Model):
                 name="unique_user_shopping_cart_recipe",
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["recipe", "user"], name="shopping_cart_recipe_user_idx"
+            )
+        ]
 
     def __str__(self):
         return (
             f"{self.user.username} добавил в список покупок {self.recipe.name}"
         )
+
+
+class ShoppingCartTotal(models.Model):
+    """
+    Материализованная сумма ингредиента по списку покупок пользователя.
+    Поддерживается при изменении ShoppingCart и состава рецептов.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_cart_totals",
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name="shopping_cart_totals",
+        verbose_name="Ингредиент",
+    )
+    total = models.PositiveIntegerField("Общее количество")
+
+    class Meta:
+        verbose_name = "Итог по списку покупок"
+        verbose_name_plural = "Итоги по спискам покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_user_cart_total_ingredient",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.ingredient.name} — {self.total}"
+
+
+class TimelineEntry(models.Model):
+    """
+    Рецепт в ленте подписчика. Заполняется при публикации рецепта
+    (fan-out on write) для авторов с включённым User.feed_fanout;
+    рецепты остальных авторов лента добирает при чтении. Дата
+    публикации скопирована из рецепта, чтобы страница ленты читалась
+    по индексу (user, -pub_date, -recipe) без соединения с рецептами.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries",
+        verbose_name="Подписчик",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries",
+        verbose_name="Рецепт",
+    )
+    pub_date = models.DateTimeField("Дата публикации рецепта")
+
+    class Meta:
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Записи лент"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"], name="unique_user_timeline_recipe"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-pub_date", "-recipe"],
+                name="timeline_user_pub_date_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.recipe.name} в ленте {self.user.username}"
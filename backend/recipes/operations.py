@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+class PostgresOnlyAddIndex(migrations.AddIndex):
+    """
+    Добавляет индекс только в базу PostgreSQL (GIN, индексы с классами
+    операторов). В состояние моделей индекс не попадает и в Meta.indexes
+    не объявляется: иначе пересоздание таблицы на другой СУБД, например
+    при изменении поля на SQLite, попыталось бы создать его и там.
+    """
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(
+        self, app_label, schema_editor, from_state, to_state
+    ):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+
+    def database_backwards(
+        self, app_label, schema_editor, from_state, to_state
+    ):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
@@ -0,0 +1,479 @@
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import connection, transaction
+from django.db.models import (
+    Count,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    TextField,
+    Value,
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.dispatch import Signal
+
+from users.models import Follow
+
+from .models import (
+    SEARCH_CONFIG,
+    Favorite,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+    ShoppingCartTotal,
+    TimelineEntry,
+)
+from .tasks import defer
+
+User = get_user_model()
+
+# Массовые изменения в обход сигналов моделей: .update(), bulk_create,
+# загрузка набора данных. Получатели сбрасывают кеши и индексы, которые
+# зависят от изменённых данных; sender — изменённая модель, fields —
+# изменённые поля или None, если строки добавлялись или удалялись.
+data_changed = Signal()
+
+
+def notify_data_changed(model, fields=None):
+    """Отправляет data_changed после коммита текущей транзакции."""
+    transaction.on_commit(
+        lambda: data_changed.send(sender=model, fields=fields)
+    )
+
+
+def change_counter(queryset, field, delta):
+    """
+    Атомарно изменяет счётчик через F() без чтения строки.
+    При уменьшении значение не опускается ниже нуля.
+    """
+    if delta >= 0:
+        return queryset.update(**{field: F(field) + delta})
+    return queryset.update(**{field: Greatest(F(field) + delta, Value(0))})
+
+
+def _count_subquery(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def recount_counters(dry_run=False):
+    """
+    Сверяет денормализованные счётчики рецептов и пользователей с
+    фактическими данными и, если не dry_run, исправляет их.
+    Возвращает число строк с расхождениями.
+    """
+    targets = (
+        (
+            Recipe.objects.all(),
+            {
+                "favorites_count": _count_subquery(
+                    Favorite.objects.all(), "recipe"
+                ),
+                "in_carts_count": _count_subquery(
+                    ShoppingCart.objects.all(), "recipe"
+                ),
+            },
+        ),
+        (
+            User.objects.all(),
+            {
+                "recipes_count": _count_subquery(
+                    Recipe.objects.all(), "author"
+                ),
+                "followers_count": _count_subquery(
+                    Follow.objects.all(), "author"
+                ),
+            },
+        ),
+    )
+    mismatches = 0
+    with transaction.atomic():
+        for queryset, counters in targets:
+            actual = {
+                f"actual_{name}": expr for name, expr in counters.items()
+            }
+            drift = Q()
+            for name in counters:
+                drift |= ~Q(**{name: F(f"actual_{name}")})
+            mismatches += queryset.annotate(**actual).filter(drift).count()
+            if not dry_run:
+                queryset.update(**counters)
+                notify_data_changed(queryset.model, list(counters))
+    return mismatches
+
+
+def _aggregate_cart_totals(user_ids=None, ingredient_ids=None):
+    amounts = IngredientInRecipe.objects.all()
+    if user_ids is not None:
+        amounts = amounts.filter(
+            recipe__in_shopping_carts_of__user__in=user_ids
+        )
+    else:
+        amounts = amounts.filter(recipe__in_shopping_carts_of__isnull=False)
+    if ingredient_ids is not None:
+        amounts = amounts.filter(ingredient__in=ingredient_ids)
+    rows = (
+        amounts.values_list(
+            "recipe__in_shopping_carts_of__user", "ingredient"
+        )
+        .annotate(total=Sum("amount"))
+        .order_by()
+    )
+    return {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in rows
+    }
+
+
+def refresh_cart_totals(user_ids, ingredient_ids=None):
+    """
+    Пересчитывает итоги списка покупок для пользователей.
+    Если переданы ingredient_ids, пересчитываются только эти ингредиенты.
+    """
+    user_ids = list(user_ids)
+    if ingredient_ids is not None:
+        ingredient_ids = list(ingredient_ids)
+    if not user_ids or ingredient_ids == []:
+        return
+
+    expected = _aggregate_cart_totals(user_ids, ingredient_ids)
+    existing = ShoppingCartTotal.objects.filter(user__in=user_ids)
+    if ingredient_ids is not None:
+        existing = existing.filter(ingredient__in=ingredient_ids)
+
+    with transaction.atomic():
+        stale_ids = [
+            pk
+            for pk, user_id, ingredient_id in existing.values_list(
+                "pk", "user_id", "ingredient_id"
+            )
+            if (user_id, ingredient_id) not in expected
+        ]
+        if stale_ids:
+            ShoppingCartTotal.objects.filter(pk__in=stale_ids).delete()
+        if expected:
+            ShoppingCartTotal.objects.bulk_create(
+                [
+                    ShoppingCartTotal(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total=total,
+                    )
+                    for (user_id, ingredient_id), total in expected.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["user", "ingredient"],
+                update_fields=["total"],
+            )
+
+
+def refresh_cart_totals_for_recipe(recipe_id, ingredient_ids=None):
+    """
+    Пересчитывает итоги у всех, у кого рецепт в списке покупок.
+    Вызывается после изменения состава рецепта.
+    """
+    user_ids = ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+        "user_id", flat=True
+    )
+    refresh_cart_totals(user_ids, ingredient_ids)
+
+
+def shopping_list_totals(user):
+    """Строки списка покупок: (название, единица измерения, количество)."""
+    return (
+        ShoppingCartTotal.objects.filter(user=user)
+        .values_list(
+            "ingredient__name", "ingredient__measurement_unit", "total"
+        )
+        .order_by("ingredient__name")
+    )
+
+
+def shopping_list_recipes(user):
+    """Рецепты списка покупок: (название, автор)."""
+    return (
+        Recipe.objects.filter(in_shopping_carts_of__user=user)
+        .values_list("name", "author__username")
+        .order_by("name")
+    )
+
+
+def rebuild_cart_totals(dry_run=False):
+    """
+    Сверяет таблицу итогов с агрегатом по ShoppingCart и, если не
+    dry_run, перестраивает её с нуля. Возвращает число расхождений.
+    """
+    expected = _aggregate_cart_totals()
+    actual = {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in (
+            ShoppingCartTotal.objects.values_list(
+                "user_id", "ingredient_id", "total"
+            )
+        )
+    }
+    mismatches = sum(
+        1
+        for key in expected.keys() | actual.keys()
+        if expected.get(key) != actual.get(key)
+    )
+    if not dry_run:
+        with transaction.atomic():
+            ShoppingCartTotal.objects.all().delete()
+            ShoppingCartTotal.objects.bulk_create(
+                [
+                    ShoppingCartTotal(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total=total,
+                    )
+                    for (user_id, ingredient_id), total in expected.items()
+                ],
+                batch_size=1000,
+            )
+            notify_data_changed(ShoppingCartTotal)
+    return mismatches
+
+
+def search_vector_expression():
+    """
+    Поисковый вектор рецепта: название (вес A), названия ингредиентов
+    (вес B) и описание (вес C).
+    """
+    ingredient_names = (
+        IngredientInRecipe.objects.filter(recipe=OuterRef("pk"))
+        .order_by()
+        .values("recipe")
+        .annotate(names=StringAgg("ingredient__name", delimiter=" "))
+        .values("names")
+    )
+    return (
+        SearchVector("name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector(
+            Coalesce(
+                Subquery(ingredient_names),
+                Value(""),
+                output_field=TextField(),
+            ),
+            weight="B",
+            config=SEARCH_CONFIG,
+        )
+        + SearchVector("text", weight="C", config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(recipes=None):
+    """
+    Пересчитывает поисковые векторы рецептов одним UPDATE.
+    Полнотекстовый поиск есть только на PostgreSQL, на других СУБД
+    функция ничего не делает.
+    """
+    if connection.vendor != "postgresql":
+        return 0
+    if recipes is None:
+        recipes = Recipe.objects.all()
+    updated = recipes.update(search_vector=search_vector_expression())
+    notify_data_changed(Recipe, ["search_vector"])
+    return updated
+
+
+def schedule_search_vector_update(recipes):
+    """
+    Пересчитывает поисковые векторы фоновой задачей после коммита, чтобы
+    UPDATE с подзапросом по ингредиентам не выполнялся в запросе.
+    """
+    if connection.vendor == "postgresql":
+        defer(update_search_vectors, recipes)
+
+
+TIMELINE_BATCH_SIZE = 1000
+
+
+def is_fanout_author(author_id):
+    """Раскладываются ли рецепты автора по лентам при публикации."""
+    return User.objects.filter(pk=author_id, feed_fanout=True).exists()
+
+
+def _insert_timeline_entries(rows):
+    rows = iter(rows)
+    while batch := list(islice(rows, TIMELINE_BATCH_SIZE)):
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(
+                    user_id=user_id, recipe_id=recipe_id, pub_date=pub_date
+                )
+                for user_id, recipe_id, pub_date in batch
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def fan_out_recipe(recipe_id):
+    """Добавляет рецепт в ленты подписчиков автора. Фоновая задача."""
+    recipe = (
+        Recipe.objects.filter(pk=recipe_id, author__feed_fanout=True)
+        .values("author_id", "pub_date")
+        .first()
+    )
+    if recipe is None:
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=recipe["author_id"]
+    ).values_list("user_id", flat=True)
+    _insert_timeline_entries(
+        (user_id, recipe_id, recipe["pub_date"])
+        for user_id in follower_ids.iterator()
+    )
+
+
+def backfill_timelines(user_ids, author_id):
+    """Добавляет все рецепты автора в ленты указанных пользователей."""
+    recipes = list(
+        Recipe.objects.filter(author_id=author_id).values_list(
+            "pk", "pub_date"
+        )
+    )
+    _insert_timeline_entries(
+        (user_id, recipe_id, pub_date)
+        for user_id in user_ids
+        for recipe_id, pub_date in recipes
+    )
+
+
+def fan_out_author(author_id):
+    """
+    Раскладывает все рецепты автора по лентам всех его подписчиков.
+    Нужно, когда автор возвращается к раскладке по лентам.
+    """
+    follower_ids = Follow.objects.filter(author_id=author_id).values_list(
+        "user_id", flat=True
+    )
+    backfill_timelines(follower_ids.iterator(), author_id)
+
+
+def remove_from_timeline(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, recipe__author_id=author_id
+    ).delete()
+
+
+def sync_follower_timeline(user_id, author_id):
+    """
+    Приводит ленту пользователя в соответствие с подпиской на автора.
+    Фоновая задача: задачи подписки и отписки могут выполниться в любом
+    порядке, поэтому решение принимается по текущему состоянию.
+    """
+    follows = Follow.objects.filter(user_id=user_id, author_id=author_id)
+    if not follows.exists():
+        remove_from_timeline(user_id, author_id)
+    elif is_fanout_author(author_id):
+        backfill_timelines([user_id], author_id)
+
+
+def update_fanout_mode(author_id):
+    """
+    Переключает автора между раскладкой по лентам и чтением при запросе
+    ленты. Раскладка выключается, когда подписчиков больше
+    FEED_FANOUT_MAX_FOLLOWERS, и включается снова, только когда их не
+    больше FEED_FANOUT_MAX_FOLLOWERS - FEED_FANOUT_HYSTERESIS. Записи лент
+    при выключении не удаляются: лента объединяет оба источника без
+    повторов. Фоновая задача.
+    """
+    authors = User.objects.filter(pk=author_id)
+    if authors.filter(
+        feed_fanout=True,
+        followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).update(feed_fanout=False):
+        return
+    if authors.filter(
+        feed_fanout=False,
+        followers_count__lte=(
+            settings.FEED_FANOUT_MAX_FOLLOWERS
+            - settings.FEED_FANOUT_HYSTERESIS
+        ),
+    ).update(feed_fanout=True):
+        fan_out_author(author_id)
+
+
+def _after_position(position, date_field, id_field):
+    if position is None:
+        return Q()
+    pub_date, pk = position
+    return Q(**{f"{date_field}__lt": pub_date}) | Q(
+        **{date_field: pub_date, f"{id_field}__lt": pk}
+    )
+
+
+def feed_positions(user, limit, after=None):
+    """
+    Позиции (pub_date, id) рецептов ленты пользователя по убыванию,
+    начиная после позиции after. Записи ленты читаются по индексу
+    (user, -pub_date, -recipe), рецепты авторов без раскладки — по
+    индексу (author, -pub_date, -id); оба потока сливаются без повторов.
+    """
+    entries = (
+        TimelineEntry.objects.filter(user=user)
+        .filter(_after_position(after, "pub_date", "recipe_id"))
+        .order_by("-pub_date", "-recipe_id")
+        .values_list("pub_date", "recipe_id")[:limit]
+    )
+    pulled_author_ids = list(
+        Follow.objects.filter(user=user, author__feed_fanout=False)
+        .values_list("author_id", flat=True)
+    )
+    streams = [list(entries)]
+    if pulled_author_ids:
+        streams.append(
+            list(
+                Recipe.objects.filter(author_id__in=pulled_author_ids)
+                .filter(_after_position(after, "pub_date", "id"))
+                .order_by("-pub_date", "-id")
+                .values_list("pub_date", "id")[:limit]
+            )
+        )
+    positions = []
+    for position in heapq.merge(*streams, reverse=True):
+        if positions and positions[-1] == position:
+            continue
+        positions.append(position)
+        if len(positions) == limit:
+            break
+    return positions
+
+
+def update_fanout_flags():
+    """Выставляет User.feed_fanout по текущему числу подписчиков."""
+    limit = settings.FEED_FANOUT_MAX_FOLLOWERS
+    User.objects.filter(followers_count__gt=limit, feed_fanout=True).update(
+        feed_fanout=False
+    )
+    User.objects.filter(followers_count__lte=limit, feed_fanout=False).update(
+        feed_fanout=True
+    )
+
+
+def rebuild_timelines():
+    """Перестраивает таблицу лент с нуля по текущим подпискам."""
+    with transaction.atomic():
+        update_fanout_flags()
+        TimelineEntry.objects.all().delete()
+        author_ids = User.objects.filter(
+            followers_count__gt=0, feed_fanout=True
+        ).values_list("pk", flat=True)
+        for author_id in author_ids.iterator():
+            fan_out_author(author_id)
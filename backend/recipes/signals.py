@@ -0,0 +1,133 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import (
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+)
+from users.models import Follow
+
+from .services import (
+    change_counter,
+    fan_out_recipe,
+    refresh_cart_totals,
+    schedule_search_vector_update,
+    sync_follower_timeline,
+    update_fanout_mode,
+)
+from .tasks import defer
+
+User = get_user_model()
+
+
+def _recipe_ingredient_ids(recipe_id):
+    return list(
+        IngredientInRecipe.objects.filter(recipe_id=recipe_id).values_list(
+            "ingredient_id", flat=True
+        )
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_cart_totals(sender, instance, created, **kwargs):
+    if created:
+        refresh_cart_totals(
+            [instance.user_id], _recipe_ingredient_ids(instance.recipe_id)
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_cart_totals(sender, instance, **kwargs):
+    # При каскадном удалении рецепта его ингредиенты могут быть уже
+    # удалены — тогда пересчитываем весь список пользователя.
+    ingredient_ids = _recipe_ingredient_ids(instance.recipe_id)
+    refresh_cart_totals([instance.user_id], ingredient_ids or None)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(
+            User.objects.filter(pk=instance.author_id), "recipes_count", 1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id), "recipes_count", -1
+    )
+
+
+@receiver(post_save, sender=Favorite)
+def increment_favorites_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(
+            Recipe.objects.filter(pk=instance.recipe_id), "favorites_count", 1
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+def decrement_favorites_count(sender, instance, **kwargs):
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id), "favorites_count", -1
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def increment_in_carts_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(
+            Recipe.objects.filter(pk=instance.recipe_id), "in_carts_count", 1
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_in_carts_count(sender, instance, **kwargs):
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id), "in_carts_count", -1
+    )
+
+
+SEARCH_SOURCE_FIELDS = {"name", "text"}
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, update_fields, **kwargs):
+    if update_fields is None or SEARCH_SOURCE_FIELDS & set(update_fields):
+        schedule_search_vector_update(Recipe.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def update_search_vector_on_amount_change(sender, instance, **kwargs):
+    schedule_search_vector_update(
+        Recipe.objects.filter(pk=instance.recipe_id)
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+def update_search_vectors_on_rename(sender, instance, created, **kwargs):
+    if not created:
+        schedule_search_vector_update(
+            Recipe.objects.filter(ingredient_amounts__ingredient=instance)
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def add_recipe_to_timelines(sender, instance, created, **kwargs):
+    if created:
+        defer(fan_out_recipe, instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def sync_timelines_on_follow_change(sender, instance, **kwargs):
+    if kwargs.get("created") is False:
+        return
+    defer(update_fanout_mode, instance.author_id)
+    defer(sync_follower_timeline, instance.user_id, instance.author_id)
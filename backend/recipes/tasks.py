@@ -0,0 +1,44 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.BACKGROUND_WORKER_THREADS,
+            thread_name_prefix="background-tasks",
+        )
+    return _executor
+
+
+def _run_in_worker(func, args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Фоновая задача %s завершилась с ошибкой", func)
+    finally:
+        connections.close_all()
+
+
+def defer(func, *args):
+    """
+    Выполняет func(*args) после коммита текущей транзакции вне потока
+    запроса. При BACKGROUND_TASKS_ASYNC = False задача выполняется сразу
+    после коммита в текущем потоке.
+    """
+
+    def submit():
+        if settings.BACKGROUND_TASKS_ASYNC:
+            _get_executor().submit(_run_in_worker, func, args)
+        else:
+            func(*args)
+
+    transaction.on_commit(submit)
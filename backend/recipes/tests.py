@@ -0,0 +1,322 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, override_settings
+
+from users.models import Follow
+
+from .models import (
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+    ShoppingCartTotal,
+    TimelineEntry,
+)
+from .services import (
+    rebuild_cart_totals,
+    refresh_cart_totals_for_recipe,
+    schedule_search_vector_update,
+    shopping_list_totals,
+)
+from .tasks import defer
+
+User = get_user_model()
+
+
+def create_user(username, **extra):
+    return User.objects.create_user(
+        email=f"{username}@example.com",
+        username=username,
+        first_name="Имя",
+        last_name="Фамилия",
+        password="password-123",
+        **extra,
+    )
+
+
+def create_recipe(author, name="Рецепт", **extra):
+    image = extra.pop("image", "recipes/images/aa/recipe.png")
+    return Recipe.objects.create(
+        author=author,
+        name=name,
+        image=image,
+        image_variants=extra.pop("image_variants", {"source": image}),
+        text=extra.pop("text", "Описание"),
+        cooking_time=extra.pop("cooking_time", 10),
+        **extra,
+    )
+
+
+class ShoppingCartTotalsTests(TestCase):
+    """Итоги списка покупок обновляются вместе с ShoppingCart."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("buyer")
+        author = create_user("author")
+        cls.flour = Ingredient.objects.create(
+            name="мука", measurement_unit="г"
+        )
+        cls.milk = Ingredient.objects.create(
+            name="молоко", measurement_unit="мл"
+        )
+        cls.pancakes = create_recipe(author, "Блины")
+        cls.bread = create_recipe(author, "Хлеб")
+        IngredientInRecipe.objects.bulk_create(
+            [
+                IngredientInRecipe(
+                    recipe=cls.pancakes, ingredient=cls.flour, amount=200
+                ),
+                IngredientInRecipe(
+                    recipe=cls.pancakes, ingredient=cls.milk, amount=500
+                ),
+                IngredientInRecipe(
+                    recipe=cls.bread, ingredient=cls.flour, amount=300
+                ),
+            ]
+        )
+
+    def totals(self):
+        return dict(
+            ShoppingCartTotal.objects.filter(user=self.user).values_list(
+                "ingredient__name", "total"
+            )
+        )
+
+    def test_add_and_remove(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pancakes)
+        self.assertEqual(self.totals(), {"мука": 200, "молоко": 500})
+
+        bread = ShoppingCart.objects.create(user=self.user, recipe=self.bread)
+        self.assertEqual(self.totals(), {"мука": 500, "молоко": 500})
+
+        ShoppingCart.objects.filter(recipe=self.pancakes).delete()
+        self.assertEqual(self.totals(), {"мука": 300})
+
+        bread.delete()
+        self.assertEqual(self.totals(), {})
+
+    def test_recipe_ingredients_change(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pancakes)
+        ShoppingCart.objects.create(user=self.user, recipe=self.bread)
+
+        IngredientInRecipe.objects.filter(
+            recipe=self.pancakes, ingredient=self.flour
+        ).update(amount=250)
+        IngredientInRecipe.objects.filter(
+            recipe=self.pancakes, ingredient=self.milk
+        ).delete()
+        refresh_cart_totals_for_recipe(
+            self.pancakes.pk, [self.flour.pk, self.milk.pk]
+        )
+
+        self.assertEqual(self.totals(), {"мука": 550})
+        self.assertEqual(
+            list(shopping_list_totals(self.user)), [("мука", "г", 550)]
+        )
+
+    def test_rebuild_matches_incremental_totals(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pancakes)
+        ShoppingCart.objects.create(user=self.user, recipe=self.bread)
+        self.assertEqual(rebuild_cart_totals(dry_run=True), 0)
+
+        ShoppingCartTotal.objects.filter(ingredient=self.flour).update(
+            total=1
+        )
+        self.assertEqual(rebuild_cart_totals(dry_run=True), 1)
+        self.assertEqual(self.totals()["мука"], 1)
+
+        self.assertEqual(rebuild_cart_totals(), 1)
+        self.assertEqual(self.totals(), {"мука": 500, "молоко": 500})
+
+
+class LoadIngredientsTests(TestCase):
+    """Команда load_ingredients."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, file_name, content):
+        path = os.path.join(self.directory, file_name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def load(self, *args):
+        out = StringIO()
+        call_command("load_ingredients", *args, stdout=out)
+        return out.getvalue()
+
+    def ingredients(self):
+        return set(
+            Ingredient.objects.values_list("name", "measurement_unit")
+        )
+
+    def test_csv(self):
+        path = self.write(
+            "ingredients.csv",
+            "name,measurement_unit\n"
+            " Мука ,Г\n"
+            "сахар,г\n"
+            "мука,г\n"
+            "соль\n",
+        )
+        output = self.load("--path", path, "--batch-size", "1")
+        self.assertEqual(self.ingredients(), {("мука", "г"), ("сахар", "г")})
+        self.assertIn("Прочитано: 3, добавлено: 2", output)
+        self.assertIn("ошибок: 1", output)
+
+    def test_json(self):
+        path = self.write(
+            "ingredients.json",
+            json.dumps(
+                [
+                    {"name": "молоко", "measurement_unit": "мл"},
+                    {"name": "яйца"},
+                ],
+                ensure_ascii=False,
+            ),
+        )
+        output = self.load("--path", path)
+        self.assertEqual(self.ingredients(), {("молоко", "мл")})
+        self.assertIn("ошибок: 1", output)
+
+    def test_dry_run(self):
+        path = self.write("ingredients.csv", "мука,г\nсахар,г\n")
+        output = self.load("--path", path, "--dry-run")
+        self.assertFalse(Ingredient.objects.exists())
+        self.assertIn("[dry-run]", output)
+        self.assertIn("добавлено: 2", output)
+
+    def test_default_path(self):
+        output = self.load("--dry-run")
+        self.assertIn(os.path.join("data", "ingredients.csv"), output)
+        self.assertFalse(Ingredient.objects.exists())
+        self.assertNotIn("Прочитано: 0,", output)
+
+
+class DeferTests(TestCase):
+    """Отложенные задачи выполняются только после коммита."""
+
+    @override_settings(BACKGROUND_TASKS_ASYNC=False)
+    def test_sync_mode_runs_after_commit(self):
+        task = mock.Mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            defer(task, 1, 2)
+            task.assert_not_called()
+        task.assert_called_once_with(1, 2)
+
+    @override_settings(BACKGROUND_TASKS_ASYNC=True)
+    def test_async_mode_submits_to_pool(self):
+        task = mock.Mock()
+        with mock.patch("recipes.tasks._get_executor") as get_executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                defer(task, 1)
+        get_executor.return_value.submit.assert_called_once()
+        task.assert_not_called()
+
+    def test_search_vectors_are_not_updated_in_request(self):
+        recipes = Recipe.objects.none()
+        with mock.patch("recipes.services.defer") as deferred:
+            with mock.patch("recipes.services.connection") as connection:
+                connection.vendor = "postgresql"
+                schedule_search_vector_update(recipes)
+                connection.vendor = "sqlite"
+                schedule_search_vector_update(recipes)
+        deferred.assert_called_once()
+
+
+@override_settings(
+    BACKGROUND_TASKS_ASYNC=False,
+    FEED_FANOUT_MAX_FOLLOWERS=2,
+    FEED_FANOUT_HYSTERESIS=1,
+)
+class FeedFanoutTests(TestCase):
+    """Переключение раскладки по лентам с гистерезисом."""
+
+    def setUp(self):
+        self.author = create_user("author")
+        self.readers = [create_user(f"reader{index}") for index in range(3)]
+        self.recipe = create_recipe(self.author)
+
+    def follow(self, reader):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Follow.objects.create(user=reader, author=self.author)
+
+    def unfollow(self, reader):
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.get(user=reader, author=self.author).delete()
+
+    def fanout(self):
+        self.author.refresh_from_db(fields=["feed_fanout"])
+        return self.author.feed_fanout
+
+    def timeline_users(self):
+        return set(
+            TimelineEntry.objects.filter(recipe=self.recipe).values_list(
+                "user__username", flat=True
+            )
+        )
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        self.follow(self.readers[0])
+        self.assertEqual(self.timeline_users(), {"reader0"})
+        entry = TimelineEntry.objects.get()
+        self.assertEqual(entry.pub_date, self.recipe.pub_date)
+
+        self.unfollow(self.readers[0])
+        self.assertEqual(self.timeline_users(), set())
+
+    def test_hysteresis(self):
+        for reader in self.readers[:2]:
+            self.follow(reader)
+        self.assertTrue(self.fanout())
+
+        self.follow(self.readers[2])
+        self.assertFalse(self.fanout())
+        # Без раскладки новые подписчики и рецепты в ленты не попадают.
+        self.assertEqual(self.timeline_users(), {"reader0", "reader1"})
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = create_recipe(self.author, "Новый")
+        self.assertFalse(TimelineEntry.objects.filter(recipe=recipe).exists())
+
+        # Подписчиков снова не больше порога, но раскладка не
+        # включается, пока их число не опустится ниже на гистерезис.
+        self.unfollow(self.readers[0])
+        self.assertFalse(self.fanout())
+
+        self.unfollow(self.readers[1])
+        self.assertTrue(self.fanout())
+        self.assertEqual(
+            set(
+                TimelineEntry.objects.values_list("user__username", "recipe")
+            ),
+            {("reader2", self.recipe.pk), ("reader2", recipe.pk)},
+        )
+
+
+class PostgresOnlyIndexTests(TestCase):
+    """Индексы только для PostgreSQL не попадают в состояние моделей."""
+
+    def test_indexes_are_not_in_migration_state(self):
+        state = MigrationLoader(connection).project_state()
+        names = {
+            index.name
+            for model_name in ("ingredient", "recipe")
+            for index in state.models["recipes", model_name].options[
+                "indexes"
+            ]
+        }
+        self.assertIn("recipe_author_pub_date_idx", names)
+        self.assertNotIn("recipe_search_vector_idx", names)
+        self.assertNotIn("ingredient_name_upper_idx", names)
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db.models import Count
 from .models import User, Follow
 
 
@@ -12,15 +13,25 @@ class UserAdmin(BaseUserAdmin):
         "last_name",
         "is_staff",
         "favorites_count",
+        "recipes_count",
+        "followers_count",
     )
     search_fields = ("email", "username", "first_name", "last_name")
     list_filter = ("is_staff", "is_superuser", "is_active", "groups")
     ordering = ("email",)
 
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(favorites_total=Count("favorite_recipes"))
+        )
+
     def favorites_count(self, obj):
-        return obj.favorite_recipes.count()
+        return obj.favorites_total
 
     favorites_count.short_description = "Избранных рецептов"
+    favorites_count.admin_order_field = "favorites_total"
 
 
 @admin.register(Follow)
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:09
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count_by(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model("users", "User")
+    Follow = apps.get_model("users", "Follow")
+    Recipe = apps.get_model("recipes", "Recipe")
+    User.objects.update(
+        recipes_count=_count_by(Recipe, "author"),
+        followers_count=_count_by(Follow, "author"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+        (
+            "recipes",
+            "0002_ingredientinrecipe_recipe_ingredientinrecipe_recipe_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="followers_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                verbose_name="количество подписчиков",
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="recipes_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="количество рецептов"
+            ),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_user_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="avatar_variants",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                editable=False,
+                verbose_name="уменьшенные копии аватара",
+            ),
+        ),
+    ]
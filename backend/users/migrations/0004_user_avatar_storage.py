@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:13
+
+import config.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0003_user_avatar_variants"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="avatar",
+            field=models.ImageField(
+                blank=True,
+                db_index=True,
+                null=True,
+                storage=config.storage.image_storage,
+                upload_to="users/avatars/",
+                verbose_name="аватар",
+            ),
+        ),
+    ]
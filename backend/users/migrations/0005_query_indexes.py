@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-17 06:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0004_user_avatar_storage"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(
+                fields=["author", "user"], name="follow_author_user_idx"
+            ),
+        ),
+    ]
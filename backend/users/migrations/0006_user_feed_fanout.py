@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-17 09:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_feed_fanout(apps, schema_editor):
+    User = apps.get_model("users", "User")
+    User.objects.filter(
+        followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).update(feed_fanout=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0005_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="feed_fanout",
+            field=models.BooleanField(
+                default=True,
+                editable=False,
+                verbose_name="рецепты раскладываются по лентам подписчиков",
+            ),
+        ),
+        migrations.RunPython(fill_feed_fanout, migrations.RunPython.noop),
+    ]
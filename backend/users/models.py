@@ -1,8 +1,36 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from config.storage import image_storage
 
-class User(AbstractUser):
+
+class DenormalizedFieldsMixin:
+    """
+    Полный save() не записывает денормализованные поля: их меняют только
+    атомарные UPDATE, а значение в загруженном объекте могло устареть.
+    """
+
+    denormalized_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            not args
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+            and not self._state.adding
+        ):
+            deferred_fields = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.denormalized_fields
+                and field.attname not in deferred_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(DenormalizedFieldsMixin, AbstractUser):
     email = models.EmailField(
         'адрес электронной почты',
         unique=True,
@@ -11,12 +39,29 @@ class User(AbstractUser):
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    denormalized_fields = ('recipes_count', 'followers_count', 'feed_fanout')
 
     avatar = models.ImageField(
         'аватар',
         upload_to='users/avatars/',
+        storage=image_storage,
         blank=True,
         null=True,
+        db_index=True,
+    )
+    avatar_variants = models.JSONField(
+        'уменьшенные копии аватара', default=dict, blank=True, editable=False
+    )
+    recipes_count = models.PositiveIntegerField(
+        'количество рецептов', default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'количество подписчиков', default=0, editable=False
+    )
+    feed_fanout = models.BooleanField(
+        'рецепты раскладываются по лентам подписчиков',
+        default=True,
+        editable=False,
     )
 
     class Meta:
@@ -59,6 +104,11 @@ class Follow(models.Model):
                 name='prevent_self_follow'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'], name='follow_author_user_idx'
+            )
+        ]
 
     def __str__(self):
         return f'{self.user.username} подписан на {self.author.username}'